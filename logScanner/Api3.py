@@ -3,17 +3,30 @@ import re
 import uuid
 import json
 import time
+import atexit
 import shutil
-import zipfile
 import threading
 import tempfile
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file, url_for
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify, send_file, url_for, stream_with_context, g
 from werkzeug.utils import secure_filename
 
 # Import your log scanner module
 # Adjust the import path to match your project structure
-from logsprint import scan_logs_parallel
+from advancemain import (scan_logs_parallel, parse_patterns, new_scan_counters, create_shared_pool,
+                         shutdown_shared_pool, scan_slot, stream_scan, DEFAULT_LINE_INDEX_DIR)
+from lineindex import read_lines
+from filediscovery import is_log_name
+from compressedlogs import is_compressed
+from resultcache import (fingerprint_directory, cache_key, find_cached_result, record_result,
+                         prune_cache_index, merge_cached_result, merge_cached_pattern_counts)
+from resultarchive import DEFAULT_COMPRESS_LEVEL, iter_zip_stream, iter_gzip_stream, iter_decompressed_file
+from scanmetrics import CONTENT_TYPE, LatencyHistogram, render_metric, render_worker_stats
+from timerange import parse_time_range, format_time_range
+from jsonquery import compile_json_query, parse_fields
+from booleanquery import compile_boolean_query
 
 app = Flask(__name__)
 
@@ -21,32 +34,330 @@ app = Flask(__name__)
 RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'scan_results')
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
+# Time span of each log scanned with since/until, to skip the logs outside the window
+TIME_CATALOG_PATH = os.path.join(os.path.dirname(__file__), 'time_catalog.json')
+
+# Largest number of lines /lines returns in one request
+MAX_LINES_PER_REQUEST = 10000
+
+# Directories /lines may read logs from, separated by os.pathsep in
+# LOGSCANNER_SCAN_ROOTS, and the extensions of the files it serves there
+SCAN_ROOTS = [os.path.realpath(root)
+              for root in os.environ.get('LOGSCANNER_SCAN_ROOTS', '/var/log').split(os.pathsep) if root]
+LOG_EXTENSIONS = ['.log', '.1', '.txt']
+
+# Total disk space scan results may take before the least recently used are removed
+MAX_RESULTS_SIZE_MB = 2048
+
+# Scans submitted with async=true run here instead of in the request thread
+MAX_CONCURRENT_JOBS = 2
+job_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS)
+
+# Background scan jobs by ID, kept for a while after they finish
+JOB_RETENTION_HOURS = 24
+jobs = {}
+jobs_lock = threading.Lock()
+
+# The scans of all requests share one pool of warm workers, started by
+# create_app. Its size bounds the CPUs used by all scans together.
+SCAN_POOL_PROCESSES = os.cpu_count()
+MAX_CONCURRENT_SCANS = 4
+shared_pool = None
+shared_pool_lock = threading.Lock()
+
+# Form fields of the engine options each scan used to set, now fixed by the shared pool
+REMOVED_SCAN_FIELDS = ('num_processes', 'use_mmap', 'max_file_size_mb')
+
+# Latencies of the scan and download endpoints, up to the last byte of the
+# response, and of the scans themselves, for /metrics
+TIMED_ENDPOINTS = {'scan_logs_api', 'stream_scan_api', 'download_results', 'download_single_file'}
+REQUEST_LATENCY = LatencyHistogram('logscanner_request_duration_seconds',
+                                   'Time from receiving a request until its response was sent', 'endpoint')
+SCAN_DURATION = LatencyHistogram('logscanner_scan_duration_seconds',
+                                 'Duration of scans run for /scan, cached results excluded', 'engine')
+
+def get_shared_pool():
+    """Return the shared scan pool, starting it if it isn't running yet"""
+    global shared_pool
+    with shared_pool_lock:
+        if shared_pool is None:
+            shared_pool = create_shared_pool(SCAN_POOL_PROCESSES, MAX_CONCURRENT_SCANS)
+            atexit.register(shutdown_shared_pool, shared_pool)
+        return shared_pool
+
+def in_scan_roots(real_path):
+    """Whether a resolved path is inside one of the SCAN_ROOTS"""
+    return any(os.path.commonpath([root, real_path]) == root for root in SCAN_ROOTS)
+
+def remove_result(result_id):
+    """Remove a scan result and its zip file"""
+    shutil.rmtree(os.path.join(RESULTS_DIR, result_id))
+    # Also remove the zip file if it exists
+    zip_path = os.path.join(RESULTS_DIR, f"{result_id}.zip")
+    if os.path.exists(zip_path):
+        os.remove(zip_path)
+
+def result_size(result_id):
+    """Disk space taken by a scan result and its zip file, in bytes"""
+    total = 0
+    for root, _, files in os.walk(os.path.join(RESULTS_DIR, result_id)):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    zip_path = os.path.join(RESULTS_DIR, f"{result_id}.zip")
+    if os.path.exists(zip_path):
+        total += os.path.getsize(zip_path)
+    return total
+
 # Cleanup job to remove old results
-def cleanup_old_results(max_age_hours=24):
-    """Remove scan results older than specified hours"""
+def cleanup_old_results(max_age_hours=24, max_total_mb=MAX_RESULTS_SIZE_MB):
+    """
+    Remove scan results not used for the specified hours, then the least
+    recently used ones until all results fit in max_total_mb. A result counts
+    as used when it is created or served from the cache (its mtime).
+    """
     current_time = time.time()
+    remaining = []
     
     for result_id in os.listdir(RESULTS_DIR):
         result_path = os.path.join(RESULTS_DIR, result_id)
         if os.path.isdir(result_path):
-            # Check if directory is older than 24 hours
-            creation_time = os.path.getctime(result_path)
-            if current_time - creation_time > max_age_hours * 60 * 60:
-                try:
-                    shutil.rmtree(result_path)
-                    # Also remove the zip file if it exists
-                    zip_path = os.path.join(RESULTS_DIR, f"{result_id}.zip")
-                    if os.path.exists(zip_path):
-                        os.remove(zip_path)
+            try:
+                last_used = os.path.getmtime(result_path)
+                if current_time - last_used > max_age_hours * 60 * 60:
+                    remove_result(result_id)
                     print(f"Cleaned up old scan result: {result_id}")
-                except Exception as e:
-                    print(f"Error cleaning up {result_id}: {str(e)}")
+                else:
+                    remaining.append((last_used, result_id, result_size(result_id)))
+            except Exception as e:
+                print(f"Error cleaning up {result_id}: {str(e)}")
+    
+    # Evict by size, always keeping the most recently used result
+    total_size = sum(size for _, _, size in remaining)
+    for _, result_id, size in sorted(remaining)[:-1]:
+        if total_size <= max_total_mb * 1024 * 1024:
+            break
+        try:
+            remove_result(result_id)
+            total_size -= size
+            print(f"Evicted scan result to free space: {result_id}")
+        except Exception as e:
+            print(f"Error cleaning up {result_id}: {str(e)}")
+    
+    prune_cache_index(RESULTS_DIR)
+
+def get_request_patterns():
+    """
+    Read the optional pattern list of a scan request, either from an uploaded
+    patterns_file or from a newline-separated patterns form field.
+    
+    Returns None when the request doesn't use a pattern list.
+    """
+    patterns_file = request.files.get('patterns_file')
+    if patterns_file and patterns_file.filename:
+        return parse_patterns(patterns_file.read().decode('utf-8', errors='replace').splitlines())
+    
+    patterns_text = request.form.get('patterns')
+    if patterns_text:
+        return parse_patterns(patterns_text.splitlines())
+    
+    return None
+
+def run_scan(scan_dir, search_parameter, result_dir, patterns=None, reuse=None, job=None,
+             compress_results=False, profile=False, profile_samples=False, time_range=None,
+             query_search=None, use_regex=False):
+    """
+    Run a scan with its output going to the result directory.
+    
+    Every scan runs on the shared pool, searching for search_parameter (a
+    regex with use_regex), a pattern list in a single pass, or a
+    query_search, ('json', query, fields) of a JSON field query or
+    ('boolean', query) of a boolean query. A pattern scan also writes
+    per-pattern counts next to the results. A scan can reuse a cached
+    result of the same scan: reuse is (result_id, changed_files,
+    unchanged_files), and only the changed files are scanned while the
+    sections of the unchanged ones are copied from the cached result. The
+    counters of a background scan are kept in its job, live while it runs.
+    With compress_results the result files are stored gzip-compressed
+    (.gz). With profile a profiling report is written next to the results,
+    with samples of the workers' stacks if profile_samples is set. A
+    time_range limits the scan to the lines inside it, skipping the files
+    the time catalog shows to lie outside it.
+    
+    Returns a list of output files.
+    """
+    output_name = "scan_results.gz" if compress_results else "scan_results"
+    scan_start = time.perf_counter()
+    
+    pool = get_shared_pool()
+    with scan_slot(pool) as counters:
+        if job is not None:
+            job["counters"] = counters
+        try:
+            output_file = scan_logs_parallel(
+                scan_dir,
+                search_parameter if patterns is None and query_search is None else None,
+                output_file=os.path.join(result_dir, output_name),
+                use_regex=use_regex,
+                patterns=patterns,
+                file_list=reuse[1] if reuse else None,
+                counters=counters,
+                shared_pool=pool,
+                profile=profile,
+                profile_samples=profile_samples,
+                time_range=time_range,
+                time_catalog=TIME_CATALOG_PATH,
+                json_query=query_search[1] if query_search and query_search[0] == 'json' else None,
+                json_fields=query_search[2] if query_search and query_search[0] == 'json' else None,
+                query=query_search[1] if query_search and query_search[0] == 'boolean' else None
+            )
+        finally:
+            if job is not None:
+                # The slot goes to the next scan, so keep the final counts
+                final_counters = new_scan_counters()
+                for final_counter, counter in zip(final_counters, counters):
+                    final_counter.value = counter.value
+                job["counters"] = final_counters
+    if reuse:
+        cached_id, _, unchanged_files = reuse
+        cached_output = os.path.join(RESULTS_DIR, cached_id, output_name)
+        merge_cached_result(output_file, cached_output, unchanged_files, cached_id)
+        if patterns is not None:
+            merge_cached_pattern_counts(f"{output_file}.patterns.json", f"{cached_output}.patterns.json",
+                                        unchanged_files, patterns)
+    SCAN_DURATION.observe('multi_pattern' if patterns is not None else 'search', time.perf_counter() - scan_start)
+    output_files = [output_file]
+    if patterns is not None:
+        output_files.append(f"{output_file}.patterns.json")
+    if profile or profile_samples:
+        output_files.append(f"{output_file}.profile.json")
+    return output_files
+
+def scan_directory(directory_path, search_parameter, patterns, job=None, compress_results=False, profile=False,
+                   profile_samples=False, time_range=None, query_search=None, use_regex=False):
+    """
+    Scan a directory into a new result, or serve the cached result of the
+    same scan if nothing in the directory changed. A scan over a directory
+    where only some files changed rescans just those files.
+    A profiled scan always scans everything, so its report covers the whole
+    scan; its result is then cached like any other.
+    
+    Returns (result_id, file_count, cached). Raises if the scan fails.
+    """
+    # Serve the cached result if nothing in the directory changed
+    fingerprints = fingerprint_directory(directory_path)
+    options = {"compress_results": compress_results}
+    if use_regex:
+        options["use_regex"] = True
+    if time_range is not None:
+        options["time_range"] = format_time_range(time_range)
+    if query_search is not None and query_search[0] == 'json':
+        options["json_query"], options["json_fields"] = query_search[1:]
+    elif query_search is not None:
+        options["query"] = query_search[1]
+    key = cache_key(directory_path, search_parameter, patterns, options)
+    if profile or profile_samples:
+        cached_id, unchanged_files, exact = None, set(), False
+    else:
+        cached_id, unchanged_files, exact = find_cached_result(RESULTS_DIR, key, fingerprints)
+    if exact:
+        # Mark it as recently used so it is evicted last
+        os.utime(os.path.join(RESULTS_DIR, cached_id))
+        with open(os.path.join(RESULTS_DIR, cached_id, "metadata.json"), 'r') as f:
+            return cached_id, json.load(f)["file_count"], True
+    
+    # Only the files that changed are rescanned
+    reuse = None
+    if cached_id and unchanged_files:
+        changed_files = [f for f in fingerprints if f not in unchanged_files]
+        reuse = (cached_id, changed_files, unchanged_files)
+    
+    # Generate a unique ID for this scan result
+    result_id = str(uuid.uuid4())
+    result_dir = os.path.join(RESULTS_DIR, result_id)
+    os.makedirs(result_dir, exist_ok=True)
+    
+    try:
+        # Run the scan with output files going to the result directory
+        file_list = run_scan(directory_path, search_parameter, result_dir, patterns, reuse, job,
+                             compress_results, profile, profile_samples, time_range, query_search, use_regex)
+        
+        # Create a metadata file with information about the scan
+        metadata = {
+            "search_parameter": search_parameter,
+            "pattern_count": len(patterns) if patterns is not None else None,
+            "json_query": query_search[1] if query_search and query_search[0] == 'json' else None,
+            "query": query_search[1] if query_search and query_search[0] == 'boolean' else None,
+            "directory_path": directory_path,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "file_count": len(file_list),
+            "total_size_bytes": sum(os.path.getsize(f) for f in file_list if os.path.exists(f)),
+            "files": [os.path.basename(f) for f in file_list],
+            "reused_result_id": reuse[0] if reuse else None,
+            "rescanned_file_count": len(reuse[1]) if reuse else None,
+            "compressed": compress_results
+        }
+        
+        with open(os.path.join(result_dir, "metadata.json"), 'w') as f:
+            json.dump(metadata, f, indent=2)
+    except Exception:
+        # Clean up result directory on error
+        shutil.rmtree(result_dir, ignore_errors=True)
+        raise
+    
+    # Cache the result for repeated scans and keep the results within their disk budget
+    record_result(RESULTS_DIR, key, result_id, fingerprints)
+    cleanup_old_results()
+    
+    return result_id, len(file_list), False
+
+def run_scan_job(job_id, directory_path, search_parameter, patterns, compress_results=False, profile=False,
+                 profile_samples=False, time_range=None, query_search=None, use_regex=False):
+    """Run a directory scan submitted with async=true, recording its outcome in its job"""
+    job = jobs[job_id]
+    job["status"] = "running"
+    job["started"] = time.time()
+    
+    try:
+        result_id, file_count, cached = scan_directory(directory_path, search_parameter, patterns, job,
+                                                       compress_results, profile, profile_samples, time_range,
+                                                       query_search, use_regex)
+        job.update({
+            "status": "completed",
+            "result_id": result_id,
+            "file_count": file_count,
+            "cached": cached
+        })
+    except Exception as e:
+        job.update({"status": "failed", "error": str(e)})
+    finally:
+        job["finished"] = time.time()
+
+def cleanup_old_jobs(max_age_hours=JOB_RETENTION_HOURS):
+    """Forget background jobs that finished more than the specified hours ago"""
+    current_time = time.time()
+    with jobs_lock:
+        for job_id in [job_id for job_id, job in jobs.items()
+                       if job.get("finished") and current_time - job["finished"] > max_age_hours * 60 * 60]:
+            del jobs[job_id]
+
+def scan_response(result_id, file_count, cached=False):
+    """JSON response pointing at a scan result"""
+    message = f"Found results in {file_count} file(s)"
+    return jsonify({
+        "status": "success",
+        "message": f"{message} (cached)" if cached else message,
+        "result_id": result_id,
+        "cached": cached,
+        "download_url": url_for('download_results', result_id=result_id, _external=True),
+        "info_url": url_for('get_result_info', result_id=result_id, _external=True),
+        "expiration": "Results will be available for 24 hours"
+    })
 
 # Schedule periodic cleanup
 def schedule_cleanup():
     while True:
         try:
             cleanup_old_results()
+            cleanup_old_jobs()
         except Exception as e:
             print(f"Error in cleanup job: {str(e)}")
         # Sleep for 1 hour
@@ -57,6 +368,24 @@ cleanup_thread = threading.Thread(target=schedule_cleanup)
 cleanup_thread.daemon = True
 cleanup_thread.start()
 
+@app.before_request
+def start_request_timer():
+    """Note when a request came in, for REQUEST_LATENCY"""
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def time_request(response):
+    """
+    Count the latency of the timed endpoints in REQUEST_LATENCY once the
+    response is closed, so streamed scans and downloads count until their
+    last byte is sent.
+    """
+    endpoint = request.endpoint
+    if endpoint in TIMED_ENDPOINTS:
+        request_start = g.request_start
+        response.call_on_close(lambda: REQUEST_LATENCY.observe(endpoint, time.perf_counter() - request_start))
+    return response
+
 @app.route('/scan', methods=['POST'])
 def scan_logs_api():
     """
@@ -64,80 +393,141 @@ def scan_logs_api():
     
     Form parameters:
     - search_parameter: Text to search for in log files
+    - use_regex: Treat search_parameter as a regular expression (default: false)
+    - patterns_file: Uploaded file with one pattern per line, searched in a single
+      pass instead of search_parameter (optional)
+    - patterns: Newline-separated patterns, as an alternative to patterns_file (optional)
     - directory_path: Path to directory containing log files
-    - max_file_size_mb: Maximum size of each output file in MB (default: 1)
-    - use_mmap: Whether to use memory mapping (default: true)
-    - num_processes: Number of processes to use (default: CPU count)
+    - async: Run a directory scan in the background and return 202 with a job
+      to poll at /jobs/<job_id> (default: false)
+    - compress_results: Store the result files gzip-compressed, to be served
+      with Content-Encoding: gzip (default: false)
+    - json_query: Field query over JSON-lines logs, searched instead of
+      search_parameter, e.g. level=ERROR AND user.id=42 (optional)
+    - fields: Comma-separated fields to keep of each line matching json_query
+      instead of the whole line (optional)
+    - query: Boolean query searched instead of search_parameter: words,
+      "phrases" and /regexes/ joined by AND, OR and NOT, e.g.
+      ERROR AND (timeout OR "connection reset") (optional)
+    - profile: Add a profiling report to the result, with the time of each
+      phase of the scan and the throughput of each file (default: false)
+    - profile_samples: Also sample the stacks of the scan's workers for the
+      profiling report (default: false)
+    - since / until: Only scan the lines logged inside this window, as
+      YYYY-MM-DD HH:MM[:SS], YYYY-MM-DD or a time of day HH:MM[:SS]; files
+      are assumed to be in time order (optional)
+    
+    All scans run on the shared pool of warm workers, which also sets how
+    many processes a scan uses; the results of a scan are written to one
+    file. The num_processes, use_mmap and max_file_size_mb fields of
+    earlier versions are rejected. Scans of a directory are cached.
+    Repeating a scan over an unchanged directory returns the earlier
+    result; a scan over a directory where only some files changed rescans
+    just those files.
     
     Returns JSON with scan result metadata and download URL.
     """
     try:
+        removed_fields = [field for field in REMOVED_SCAN_FIELDS if field in request.form]
+        if removed_fields:
+            return jsonify({"error": f"{', '.join(removed_fields)} is no longer supported; "
+                                     f"scans run on the shared pool of workers"}), 400
+        
         # Get parameters from the request
         search_parameter = request.form.get('search_parameter')
-        if not search_parameter:
-            return jsonify({"error": "Search parameter is required"}), 400
+        patterns = get_request_patterns()
+        if patterns is not None and not patterns:
+            return jsonify({"error": "The patterns list is empty"}), 400
+        
+        query_search = None
+        json_query = request.form.get('json_query')
+        fields = request.form.get('fields')
+        query = request.form.get('query')
+        if json_query and query:
+            return jsonify({"error": "json_query cannot be combined with query"}), 400
+        if (json_query or query) and (search_parameter or patterns is not None):
+            return jsonify({"error": f"{'json_query' if json_query else 'query'} cannot be combined "
+                                     f"with search_parameter or patterns"}), 400
+        if fields and not json_query:
+            return jsonify({"error": "fields requires json_query"}), 400
+        try:
+            if json_query:
+                query_search = ('json', json_query, parse_fields(fields) if fields else [])
+                compile_json_query(json_query)
+            elif query:
+                query_search = ('boolean', query)
+                compile_boolean_query(query)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        if not search_parameter and patterns is None and query_search is None:
+            return jsonify({"error": "Search parameter, patterns_file, json_query or query is required"}), 400
+        
+        use_regex = request.form.get('use_regex', 'false').lower() == 'true'
+        if use_regex and (patterns is not None or query_search is not None):
+            return jsonify({"error": "use_regex cannot be combined with a pattern list or a query"}), 400
+        if use_regex:
+            try:
+                # Compiled as the engine compiles it
+                re.compile(search_parameter.encode('utf-8'))
+            except re.error as e:
+                return jsonify({"error": f"Invalid regex pattern: {str(e)}"}), 400
         
         directory_path = request.form.get('directory_path')
-        max_file_size_mb = int(request.form.get('max_file_size_mb', 1))
-        use_mmap = request.form.get('use_mmap', 'true').lower() == 'true'
-        num_processes = request.form.get('num_processes')
+        run_async = request.form.get('async', 'false').lower() == 'true'
+        compress_results = request.form.get('compress_results', 'false').lower() == 'true'
+        profile_samples = request.form.get('profile_samples', 'false').lower() == 'true'
+        profile = profile_samples or request.form.get('profile', 'false').lower() == 'true'
         
-        if num_processes:
-            num_processes = int(num_processes)
+        try:
+            time_range = parse_time_range(request.form.get('since'), request.form.get('until'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        if run_async and not directory_path:
+            return jsonify({"error": "async is only supported with directory_path"}), 400
         
         # Handle directory path option
         if directory_path:
             if not os.path.exists(directory_path):
                 return jsonify({"error": "Directory path does not exist"}), 400
             
-            # Generate a unique ID for this scan result
-            result_id = str(uuid.uuid4())
-            result_dir = os.path.join(RESULTS_DIR, result_id)
-            os.makedirs(result_dir, exist_ok=True)
-            
-            try:
-                # Run the scan with output files going to the result directory
-                output_files = scan_logs_parallel(
-                    directory_path,
-                    search_parameter,
-                    output_file=os.path.join(result_dir, "scan_results"),
-                    use_mmap=use_mmap,
-                    num_processes=num_processes,
-                    max_file_size_mb=max_file_size_mb
-                )
+            if run_async:
+                job_id = str(uuid.uuid4())
+                with jobs_lock:
+                    jobs[job_id] = {
+                        "status": "queued",
+                        "search_parameter": search_parameter,
+                        "pattern_count": len(patterns) if patterns is not None else None,
+                        "directory_path": directory_path,
+                        "submitted": time.time(),
+                        # Live progress is available once the scan has started on the shared pool
+                        "counters": None
+                    }
+                job_executor.submit(run_scan_job, job_id, directory_path, search_parameter, patterns,
+                                    compress_results, profile, profile_samples, time_range, query_search,
+                                    use_regex)
                 
-                if not output_files:
-                    return jsonify({"error": "No matches found or scan failed"}), 404
-                
-                # Create a metadata file with information about the scan
-                file_list = output_files if isinstance(output_files, list) else [output_files]
-                
-                metadata = {
-                    "search_parameter": search_parameter,
-                    "directory_path": directory_path,
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "file_count": len(file_list),
-                    "total_size_bytes": sum(os.path.getsize(f) for f in file_list if os.path.exists(f)),
-                    "files": [os.path.basename(f) for f in file_list]
-                }
-                
-                with open(os.path.join(result_dir, "metadata.json"), 'w') as f:
-                    json.dump(metadata, f, indent=2)
-                
-                # Return information about where to find the results
-                return jsonify({
-                    "status": "success",
-                    "message": f"Found results in {len(file_list)} file(s)",
-                    "result_id": result_id,
-                    "download_url": url_for('download_results', result_id=result_id, _external=True),
-                    "info_url": url_for('get_result_info', result_id=result_id, _external=True),
-                    "expiration": "Results will be available for 24 hours"
+                status_url = url_for('get_job_status', job_id=job_id, _external=True)
+                response = jsonify({
+                    "status": "accepted",
+                    "job_id": job_id,
+                    "status_url": status_url
                 })
-                
+                response.headers['Location'] = status_url
+                return response, 202
+            
+            try:
+                result_id, file_count, cached = scan_directory(directory_path, search_parameter, patterns,
+                                                               compress_results=compress_results,
+                                                               profile=profile, profile_samples=profile_samples,
+                                                               time_range=time_range, query_search=query_search,
+                                                               use_regex=use_regex)
             except Exception as e:
-                # Clean up result directory on error
-                shutil.rmtree(result_dir, ignore_errors=True)
                 return jsonify({"error": f"Scan failed: {str(e)}"}), 500
+            
+            # Return information about where to find the results
+            return scan_response(result_id, file_count, cached)
         
         # Handle uploaded files
         elif 'log_files' in request.files:
@@ -164,41 +554,29 @@ def scan_logs_api():
                         saved_files.append(file_path)
                 
                 # Run the scan on the uploaded files
-                output_files = scan_logs_parallel(
-                    temp_dir,
-                    search_parameter,
-                    output_file=os.path.join(result_dir, "scan_results"),
-                    use_mmap=use_mmap,
-                    num_processes=num_processes,
-                    max_file_size_mb=max_file_size_mb
-                )
-                
-                if not output_files:
-                    return jsonify({"error": "No matches found in uploaded files"}), 404
+                file_list = run_scan(temp_dir, search_parameter, result_dir, patterns,
+                                     compress_results=compress_results,
+                                     profile=profile, profile_samples=profile_samples,
+                                     time_range=time_range, query_search=query_search, use_regex=use_regex)
                 
                 # Create metadata
-                file_list = output_files if isinstance(output_files, list) else [output_files]
-                
                 metadata = {
                     "search_parameter": search_parameter,
+                    "pattern_count": len(patterns) if patterns is not None else None,
+                    "json_query": query_search[1] if query_search and query_search[0] == 'json' else None,
+                    "query": query_search[1] if query_search and query_search[0] == 'boolean' else None,
                     "uploaded_files": [os.path.basename(f) for f in saved_files],
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                     "file_count": len(file_list),
                     "total_size_bytes": sum(os.path.getsize(f) for f in file_list if os.path.exists(f)),
-                    "files": [os.path.basename(f) for f in file_list]
+                    "files": [os.path.basename(f) for f in file_list],
+                    "compressed": compress_results
                 }
                 
                 with open(os.path.join(result_dir, "metadata.json"), 'w') as f:
                     json.dump(metadata, f, indent=2)
                 
-                return jsonify({
-                    "status": "success",
-                    "message": f"Found results in {len(file_list)} file(s)",
-                    "result_id": result_id,
-                    "download_url": url_for('download_results', result_id=result_id, _external=True),
-                    "info_url": url_for('get_result_info', result_id=result_id, _external=True),
-                    "expiration": "Results will be available for 24 hours"
-                })
+                return scan_response(result_id, len(file_list))
                 
             except Exception as e:
                 # Clean up on error
@@ -215,42 +593,171 @@ def scan_logs_api():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/scan/stream', methods=['POST'])
+def stream_scan_api():
+    """
+    API endpoint streaming the matches of a directory scan while it runs.
+    
+    Form parameters:
+    - search_parameter: Text to search for in log files
+    - patterns_file / patterns: Pattern list searched instead, as for /scan (optional)
+    - use_regex: Treat search_parameter as a regular expression (default: false)
+    - directory_path: Path to directory containing log files
+    - since / until: Only scan the lines logged inside this window, as for /scan (optional)
+    
+    The response is newline-delimited JSON, one object per matching line
+    with its file, 1-based line number and text ({"file", "error"} for parts
+    of files that could not be read), followed by a final object with
+    "done": true and the scan's totals. Matches are sent as the workers find
+    them, in file order. The scan runs on the shared pool and only keeps a
+    few file ranges ahead of the client, so a slow client slows the scan down.
+    """
+    search_parameter = request.form.get('search_parameter')
+    patterns = get_request_patterns()
+    if patterns is not None and not patterns:
+        return jsonify({"error": "The patterns list is empty"}), 400
+    if not search_parameter and patterns is None:
+        return jsonify({"error": "Search parameter or patterns_file is required"}), 400
+    use_regex = request.form.get('use_regex', 'false').lower() == 'true'
+    if use_regex and patterns is not None:
+        return jsonify({"error": "use_regex cannot be combined with a pattern list"}), 400
+    if use_regex:
+        try:
+            # Compiled as the engine compiles it
+            re.compile(search_parameter.encode('utf-8'))
+        except re.error as e:
+            return jsonify({"error": f"Invalid regex pattern: {str(e)}"}), 400
+    
+    try:
+        time_range = parse_time_range(request.form.get('since'), request.form.get('until'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    directory_path = request.form.get('directory_path')
+    if not directory_path or not os.path.isdir(directory_path):
+        return jsonify({"error": "Directory path does not exist"}), 400
+    
+    def generate():
+        pool = get_shared_pool()
+        start_time = time.time()
+        with scan_slot(pool) as counters, closing(stream_scan(
+                directory_path, search_parameter, use_regex=use_regex, patterns=patterns,
+                counters=counters, shared_pool=pool, time_range=time_range,
+                time_catalog=TIME_CATALOG_PATH)) as matches:
+            for match in matches:
+                yield json.dumps(match) + "\n"
+            
+            total_matches, total_files, total_bytes = (counter.value for counter in counters)
+            yield json.dumps({
+                "done": True,
+                "files_scanned": total_files,
+                "bytes_processed": total_bytes,
+                "matches_found": total_matches,
+                "elapsed_seconds": round(time.time() - start_time, 2)
+            }) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Report the state of a scan submitted with async=true.
+    
+    Parameters:
+    - job_id: ID returned by /scan
+    
+    Returns JSON with the job status (queued, running, completed or
+    failed), elapsed time and, while the scan runs, the files,
+    bytes and matches processed so far and the throughput. A completed job
+    links to its result.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    
+    started = job.get("started")
+    elapsed = (job.get("finished") or time.time()) - started if started else 0
+    status = {
+        "job_id": job_id,
+        "status": job["status"],
+        "search_parameter": job["search_parameter"],
+        "pattern_count": job["pattern_count"],
+        "directory_path": job["directory_path"],
+        "submitted": datetime.fromtimestamp(job["submitted"]).strftime("%Y-%m-%d %H:%M:%S"),
+        "elapsed_seconds": round(elapsed, 2)
+    }
+    
+    counters = job["counters"]
+    if counters is not None:
+        matches, files, bytes_processed = (counter.value for counter in counters)
+        status.update({
+            "files_processed": files,
+            "bytes_processed": bytes_processed,
+            "matches_found": matches,
+            "throughput_bytes_per_second": round(bytes_processed / elapsed) if elapsed else 0
+        })
+    
+    if job["status"] == "completed":
+        status.update({
+            "result_id": job["result_id"],
+            "file_count": job["file_count"],
+            "cached": job["cached"],
+            "download_url": url_for('download_results', result_id=job["result_id"], _external=True),
+            "info_url": url_for('get_result_info', result_id=job["result_id"], _external=True)
+        })
+    elif job["status"] == "failed":
+        status["error"] = job["error"]
+    
+    return jsonify(status)
+
 @app.route('/results/<result_id>/download', methods=['GET'])
 def download_results(result_id):
     """
-    Download the complete scan results as a zip file.
+    Download the complete scan results, streamed as they are compressed.
     
     Parameters:
     - result_id: ID of the scan result to download
+    - format: zip for a zip file of all result files, or gzip for a single
+      gzip stream of the result files one after the other (default: zip)
+    - level: Compression level from 1 (fastest) to 9 (smallest), or 0 to
+      store the files in a zip uncompressed (default: 6)
     
-    Returns a zip file containing all result files.
+    Returns the archive. Files stored compressed are included without
+    being compressed again.
     """
     result_dir = os.path.join(RESULTS_DIR, result_id)
     
     if not os.path.exists(result_dir):
         return jsonify({"error": "Results not found or expired"}), 404
     
-    # Check for existing zip file
-    zip_path = os.path.join(RESULTS_DIR, f"{result_id}.zip")
+    archive_format = request.args.get('format', 'zip').lower()
+    if archive_format not in ('zip', 'gzip'):
+        return jsonify({"error": "format must be zip or gzip"}), 400
+    try:
+        level = int(request.args.get('level', DEFAULT_COMPRESS_LEVEL))
+    except ValueError:
+        return jsonify({"error": "level must be a number from 0 to 9"}), 400
+    if not 0 <= level <= 9:
+        return jsonify({"error": "level must be a number from 0 to 9"}), 400
     
-    # Create the zip file if it doesn't exist
-    if not os.path.exists(zip_path):
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, _, files in os.walk(result_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    zipf.write(file_path, os.path.basename(file_path))
+    file_paths = []
+    for root, _, files in os.walk(result_dir):
+        for file in sorted(files):
+            file_paths.append(os.path.join(root, file))
     
-    # Return the zip file for download
-    try:
-        return send_file(
-            zip_path,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f"scan_results_{result_id}.zip"
-        )
-    except Exception as e:
-        return jsonify({"error": f"Error downloading file: {str(e)}"}), 500
+    if archive_format == 'zip':
+        response = Response(stream_with_context(iter_zip_stream(file_paths, level)),
+                            mimetype='application/zip')
+        download_name = f"scan_results_{result_id}.zip"
+    else:
+        # Only the scan output goes in the stream, not the metadata
+        file_paths = [f for f in file_paths if not f.endswith('.json')]
+        response = Response(stream_with_context(iter_gzip_stream(file_paths, max(level, 1))),
+                            mimetype='application/gzip')
+        download_name = f"scan_results_{result_id}.log.gz"
+    
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    return response
 
 @app.route('/results/<result_id>/file/<filename>', methods=['GET'])
 def download_single_file(result_id, filename):
@@ -261,7 +768,9 @@ def download_single_file(result_id, filename):
     - result_id: ID of the scan result
     - filename: Name of the file to download
     
-    Returns the requested file.
+    Returns the requested file. A file stored gzip-compressed is sent as it
+    is with Content-Encoding: gzip to clients accepting gzip, under its name
+    without .gz, and decompressed for other clients.
     """
     result_dir = os.path.join(RESULTS_DIR, result_id)
     
@@ -274,6 +783,23 @@ def download_single_file(result_id, filename):
         return jsonify({"error": f"File {filename} not found"}), 404
     
     try:
+        if filename.endswith('.gz'):
+            download_name = filename[:-len('.gz')]
+            if 'gzip' in request.accept_encodings:
+                response = send_file(
+                    file_path,
+                    mimetype='text/plain',
+                    as_attachment=True,
+                    download_name=download_name
+                )
+                response.headers['Content-Encoding'] = 'gzip'
+            else:
+                response = Response(stream_with_context(iter_decompressed_file(file_path)),
+                                    mimetype='text/plain')
+                response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+            response.headers['Vary'] = 'Accept-Encoding'
+            return response
+        
         return send_file(
             file_path,
             as_attachment=True,
@@ -385,6 +911,55 @@ def list_available_results():
     except Exception as e:
         return jsonify({"error": f"Error listing results: {str(e)}"}), 500
 
+@app.route('/lines', methods=['GET'])
+def get_log_lines():
+    """
+    Return a range of lines from a log file, seeking to them through a
+    persistent line-offset index instead of reading from the start.
+    
+    Only uncompressed log files (by the extensions scans look for) inside
+    the SCAN_ROOTS are served; symlinks are resolved before checking.
+    
+    Query parameters:
+    - file_path: Path to the log file
+    - start: First line to return (1-based)
+    - end: Last line to return (inclusive, default: start)
+    
+    Returns JSON with the requested lines.
+    """
+    file_path = request.args.get('file_path')
+    if not file_path:
+        return jsonify({"error": "file_path is required"}), 400
+    real_path = os.path.realpath(file_path)
+    if not in_scan_roots(real_path) or not is_log_name(os.path.basename(real_path), LOG_EXTENSIONS):
+        return jsonify({"error": "Only log files inside the scan roots can be read"}), 403
+    if is_compressed(real_path):
+        return jsonify({"error": "Lines can't be read from compressed logs"}), 400
+    if not os.path.isfile(real_path):
+        return jsonify({"error": "File path does not exist"}), 400
+    
+    try:
+        start = int(request.args.get('start', 1))
+        end = int(request.args.get('end', start))
+    except ValueError:
+        return jsonify({"error": "start and end must be integers"}), 400
+    
+    if start < 1 or end < start:
+        return jsonify({"error": "Invalid line range"}), 400
+    if end - start + 1 > MAX_LINES_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_LINES_PER_REQUEST} lines can be requested at once"}), 400
+    
+    try:
+        lines = read_lines(real_path, start, end, index_dir=DEFAULT_LINE_INDEX_DIR)
+        return jsonify({
+            "file_path": file_path,
+            "start": start,
+            "end": start + len(lines) - 1,
+            "lines": lines
+        })
+    except Exception as e:
+        return jsonify({"error": f"Error reading lines: {str(e)}"}), 500
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -400,6 +975,38 @@ def health_check():
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Scan statistics in the Prometheus text format.
+    
+    Reports what each worker of the shared scan pool has scanned since the
+    service started (bytes, lines, matches, files, tasks, and the time spent
+    busy, waiting for data and decoding matches), the scans running on the
+    pool and the background jobs, and latency histograms of the scan and
+    download endpoints and of the scans. Worker statistics are flushed by
+    the workers about once a second and after every file or range.
+    """
+    lines = []
+    
+    # Don't start the pool just to report on it
+    pool = shared_pool
+    if pool is not None:
+        lines += render_worker_stats(pool["worker_stats"])
+        lines += render_metric('logscanner_pool_scans_running', 'Scans holding a slot of the shared pool',
+                               'gauge', [({}, MAX_CONCURRENT_SCANS - pool["free_slots"].qsize())])
+    
+    job_counts = {status: 0 for status in ('queued', 'running')}
+    for job in list(jobs.values()):
+        if job["status"] in job_counts:
+            job_counts[job["status"]] += 1
+    lines += render_metric('logscanner_jobs', 'Background scan jobs by status', 'gauge',
+                           [({"status": status}, count) for status, count in job_counts.items()])
+    
+    lines += REQUEST_LATENCY.render()
+    lines += SCAN_DURATION.render()
+    return Response('\n'.join(lines) + '\n', content_type=CONTENT_TYPE)
+
 @app.route('/test-rollback', methods=['POST'])
 def test_rollback():
     """
@@ -449,6 +1056,20 @@ def test_rollback():
             "created_files_count": len(created_files) if 'created_files' in locals() else 0
         })
 
+def create_app():
+    """
+    Return the app with the shared pool started, so no scan waits for its
+    workers. WSGI servers should load the app through it, e.g. gunicorn
+    'Api3:create_app()', in each of their worker processes (no preloading),
+    as a pool doesn't survive a fork. Importing the module starts nothing;
+    without create_app the pool starts with the first scan.
+    """
+    get_shared_pool()
+    return app
+
 if __name__ == '__main__':
-    # For development only - use a production WSGI server in production
+    # For development only - use a production WSGI server in production.
+    # Of the reloader's two processes only the serving one starts the pool.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        create_app()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -2,12 +2,46 @@
 import os
 import re
 import mmap
+import json
 import argparse
 import multiprocessing
 import time
 import sys
+import queue
+import hashlib
+import threading
 from datetime import datetime
-from functools import partial
+from itertools import islice
+from functools import partial, lru_cache
+from contextlib import contextmanager
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from trigramindex import DEFAULT_BLOCK_SIZE, update_index, find_candidate_ranges
+from bloomindex import DEFAULT_REGION_SIZE, needle_tokens, update_sketches, find_sketch_ranges
+from scanstate import state_path_for, load_state, save_state, plan_incremental_scan
+from compressedlogs import (compression_extension, is_compressed, iter_compressed_windows,
+                            find_gzip_member_ranges, open_text)
+from scanmetrics import WORKER_STAT_FIELDS, new_worker_stats_table, claim_worker_row, write_worker_row
+from scanprofile import new_profile, end_phase, add_task_stats, write_report, start_sampling, stop_sampling
+from filediscovery import DEFAULT_DISCOVERY_THREADS, is_log_name, discover_log_files
+from scanschedule import FileBatcher, TaskQueue, batch_size_for, add_worker_busy, worker_busy_report
+from jsonquery import JsonQuery, compile_json_query, parse_fields
+from booleanquery import BooleanQuery, compile_boolean_query
+from timecatalog import (load_catalog as load_time_catalog, save_catalog as save_time_catalog, catalog_file,
+                         catalog_files, overlaps_time_range)
+from timerange import (DETECT_LINES, parse_time_range, format_time_range, find_time_bounds, time_filter_for,
+                       narrow_windows)
+from lineindex import get_line_index, line_number_at
 # Custom progress tracking without external dependencies
 
 # Global variables for statistics
@@ -15,8 +49,924 @@ TOTAL_MATCHES = multiprocessing.Value('i', 0)
 TOTAL_FILES_PROCESSED = multiprocessing.Value('i', 0)
 TOTAL_BYTES_PROCESSED = multiprocessing.Value('L', 0)
 
+# Multi-pattern matcher, built once per worker process by init_scan_worker
+PATTERN_MATCHER = None
+
+# Counter slots of a shared pool and the store its workers fetch pattern
+# lists from, handed to every worker when the pool starts (see create_shared_pool)
+COUNTER_SLOTS = None
+PATTERN_STORE = None
+
+# Matchers built by a shared pool's worker, by digest of their pattern list
+MATCHER_CACHE = {}
+MAX_CACHED_MATCHERS = 8
+
+# Size of the ranges stream_scan cuts files into, small enough for the
+# first matches to come back quickly
+STREAM_RANGE_SIZE = 8 * 1024 * 1024
+
+# Where the line-offset indexes (see lineindex) giving the line numbers at
+# the edges of a time range are kept unless a scan names another directory;
+# the same indexes serve Api3's /lines
+DEFAULT_LINE_INDEX_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')),
+                                      'logscanner', 'line_indexes')
+
+# Output collected by scan_logs_parallel's writer before each write
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Scan results a scan can have queued, running or waiting to be written, per process
+RESULTS_IN_FLIGHT_PER_PROCESS = 4
+
+# What this worker has scanned so far (see scanmetrics.WORKER_STAT_FIELDS),
+# counted locally and flushed to the scan's counters and the worker's row of
+# its pool's statistics table at most every STATS_FLUSH_INTERVAL seconds and
+# at the end of each task
+WORKER_STATS = dict.fromkeys(WORKER_STAT_FIELDS, 0)
+STATS_FLUSH_INTERVAL = 1.0
+LAST_STATS_FLUSH = 0.0
+
+# The part of WORKER_STATS already added to the scan's counters
+FLUSHED_SCAN_STATS = {"matches": 0, "files": 0, "bytes": 0}
+
+# The shared pool's statistics table and this worker's row of it
+WORKER_STATS_TABLE = None
+WORKER_STATS_ROW = None
+
+
+def count_newlines(mm, start, end, step=16*1024*1024):
+    """
+    Count newline bytes in mm[start:end] without copying more than `step`
+    bytes at a time.
+    """
+    total = 0
+    for pos in range(start, end, step):
+        total += mm[pos:min(pos + step, end)].count(b'\n')
+    return total
+
+
+def format_match(line_index, line, line_offset=0):
+    """
+    Render a match for the output file, prefixing the 1-based line number
+    when one was tracked for it.
+    """
+    if line_index is None:
+        return line
+    return f"{line_offset + line_index + 1}: {line}"
+
+
+def parse_patterns(lines):
+    """
+    Turn lines of text into a pattern list: one literal pattern per line,
+    surrounding whitespace and blank lines ignored, duplicates dropped.
+    
+    Returns:
+        list: Unique patterns in their original order
+    """
+    patterns = []
+    seen = set()
+    for line in lines:
+        pattern = line.strip()
+        if pattern and pattern not in seen:
+            seen.add(pattern)
+            patterns.append(pattern)
+    return patterns
+
+
+def load_patterns_file(patterns_file):
+    """
+    Read a patterns file: one literal pattern per line.
+    
+    Returns:
+        list: Unique patterns in file order
+    """
+    with open(patterns_file, 'r', encoding='utf-8') as f:
+        return parse_patterns(f)
+
+
+def build_automaton(patterns):
+    """
+    Build an Aho-Corasick automaton over the UTF-8 bytes of the patterns.
+    
+    Returns:
+        tuple: (goto, fail, output) where goto[state] maps a byte to the next
+               state, fail[state] is the failure link and output[state] lists
+               the indexes of the patterns ending in that state
+    """
+    goto = [{}]
+    fail = [0]
+    output = [[]]
+    
+    # Build the trie
+    for index, pattern in enumerate(patterns):
+        state = 0
+        for byte in pattern.encode('utf-8'):
+            next_state = goto[state].get(byte)
+            if next_state is None:
+                next_state = len(goto)
+                goto[state][byte] = next_state
+                goto.append({})
+                fail.append(0)
+                output.append([])
+            state = next_state
+        output[state].append(index)
+    
+    # Compute failure links breadth-first
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for byte, next_state in goto[state].items():
+            queue.append(next_state)
+            fallback = fail[state]
+            while fallback and byte not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(byte, 0)
+            output[next_state] = output[next_state] + output[fail[next_state]]
+    
+    return goto, fail, output
+
+
+def automaton_search(automaton, data):
+    """
+    Run the automaton over a bytes object.
+    
+    Returns:
+        set: Indexes of every pattern that occurs in data
+    """
+    goto, fail, output = automaton
+    state = 0
+    hits = set()
+    
+    for byte in data:
+        while state and byte not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(byte, 0)
+        if output[state]:
+            hits.update(output[state])
+    
+    return hits
+
+
+def build_trie_regex(patterns):
+    """
+    Compile the patterns into one bytes regex shaped like their trie, e.g.
+    TXN-1, TXN-12 and TXN-2 become TXN-(?:12?|2). The regex engine then walks
+    a single branch per position instead of trying every pattern, which makes
+    it a fast prefilter for lines that contain at least one pattern.
+    """
+    trie = {}
+    for pattern in patterns:
+        node = trie
+        for byte in pattern.encode('utf-8'):
+            node = node.setdefault(byte, {})
+        node[None] = {}
+    
+    def to_regex(node):
+        branches = [re.escape(bytes([byte])) + to_regex(child)
+                    for byte, child in sorted(node.items(), key=lambda item: -1 if item[0] is None else item[0])
+                    if byte is not None]
+        if not branches:
+            return b''
+        if len(branches) == 1 and None not in node:
+            return branches[0]
+        return b'(?:' + b'|'.join(branches) + b')' + (b'?' if None in node else b'')
+    
+    return re.compile(to_regex(trie))
+
+
+def build_pattern_matcher(patterns):
+    """
+    Build everything needed for a multi-pattern scan.
+    
+    Returns:
+        tuple: (prefilter, automaton, patterns)
+    """
+    return build_trie_regex(patterns), build_automaton(patterns), patterns
+
+
+def new_scan_counters():
+    """
+    Fresh (matches, files, bytes) counters for a scan running next to other
+    scans in the same process, e.g. in a service. Pass them to
+    scan_logs_parallel and read their .value while it runs.
+    """
+    return (multiprocessing.Value('i', 0), multiprocessing.Value('i', 0), multiprocessing.Value('L', 0))
+
+
+def init_scan_worker(counters, patterns=None):
+    """
+    Pool initializer: point the worker's statistics at the scan's counters
+    and build the multi-pattern matcher once per worker process rather than
+    shipping it with every task.
+    """
+    global TOTAL_MATCHES, TOTAL_FILES_PROCESSED, TOTAL_BYTES_PROCESSED, PATTERN_MATCHER
+    TOTAL_MATCHES, TOTAL_FILES_PROCESSED, TOTAL_BYTES_PROCESSED = counters
+    if patterns is not None:
+        PATTERN_MATCHER = build_pattern_matcher(patterns)
+
+
+def add_worker_stats(**amounts):
+    """Count what this worker scanned in WORKER_STATS, e.g. add_worker_stats(bytes=n)."""
+    for field, amount in amounts.items():
+        WORKER_STATS[field] += amount
+
+
+def flush_worker_stats(force=False):
+    """
+    Add what this worker counted since the last flush to the scan's counters
+    and copy its totals to its row of the pool's statistics table, if
+    STATS_FLUSH_INTERVAL has passed since then or force is set. Tasks end
+    with a forced flush, so a shared pool's worker never carries counts
+    over to the next scan's counters.
+    """
+    global LAST_STATS_FLUSH
+    now = time.monotonic()
+    if not force and now - LAST_STATS_FLUSH < STATS_FLUSH_INTERVAL:
+        return
+    LAST_STATS_FLUSH = now
+    
+    for field, counter in (("matches", TOTAL_MATCHES), ("files", TOTAL_FILES_PROCESSED),
+                           ("bytes", TOTAL_BYTES_PROCESSED)):
+        amount = WORKER_STATS[field] - FLUSHED_SCAN_STATS[field]
+        if amount:
+            with counter.get_lock():
+                counter.value += amount
+            FLUSHED_SCAN_STATS[field] = WORKER_STATS[field]
+    
+    if WORKER_STATS_ROW is not None:
+        write_worker_row(WORKER_STATS_TABLE, WORKER_STATS_ROW, WORKER_STATS)
+
+
+def create_shared_pool(num_processes=None, max_scans=4):
+    """
+    Start a pool of scan workers that several scans can run on, one after
+    the other or at the same time, e.g. all the requests of a service. The
+    workers are started once and stay warm between scans, and however many
+    scans run, no more than num_processes files or ranges are scanned at once.
+    
+    Each running scan takes one of max_scans counter slots for its progress
+    (see scan_slot); further scans wait for a slot to be released. What each
+    worker scans over the pool's lifetime is kept in the pool's
+    "worker_stats" table (see scanmetrics.read_worker_stats).
+    
+    Args:
+        num_processes (int, optional): Number of workers. If None, uses CPU count.
+        max_scans (int): Number of scans that can run at the same time
+        
+    Returns:
+        dict: The shared pool, to pass to scan_logs_parallel and shutdown_shared_pool
+    """
+    if num_processes is None:
+        num_processes = multiprocessing.cpu_count()
+    
+    # Per-scan counters and the pattern store can't be sent with the tasks,
+    # so the workers get all of them up front
+    manager = multiprocessing.Manager()
+    slots = [new_scan_counters() for _ in range(max_scans)]
+    pattern_store = manager.dict()
+    worker_stats = new_worker_stats_table(num_processes)
+    pool = multiprocessing.Pool(processes=num_processes, initializer=init_shared_worker,
+                                initargs=(slots, pattern_store, worker_stats))
+    
+    free_slots = queue.Queue()
+    for slot in range(max_scans):
+        free_slots.put(slot)
+    
+    return {
+        "pool": pool,
+        "manager": manager,
+        "num_processes": num_processes,
+        "slots": slots,
+        "free_slots": free_slots,
+        "patterns": pattern_store,
+        "worker_stats": worker_stats,
+        # Number of running scans using each pattern list in the store
+        "pattern_users": {},
+        "lock": threading.Lock()
+    }
+
+
+def shutdown_shared_pool(shared_pool):
+    """Stop the workers of a shared pool once its running scans are done."""
+    shared_pool["pool"].close()
+    shared_pool["pool"].join()
+    shared_pool["manager"].shutdown()
+
+
+@contextmanager
+def scan_slot(shared_pool):
+    """
+    Claim a counter slot of a shared pool for one scan, waiting while all of
+    them are in use. Yields the slot's (matches, files, bytes) counters, to
+    pass to scan_logs_parallel with the pool and read while it runs.
+    """
+    slot = shared_pool["free_slots"].get()
+    try:
+        yield shared_pool["slots"][slot]
+    finally:
+        shared_pool["free_slots"].put(slot)
+
+
+def init_shared_worker(slots, pattern_store, worker_stats):
+    """Pool initializer of a shared pool's workers, see create_shared_pool."""
+    global COUNTER_SLOTS, PATTERN_STORE, WORKER_STATS_TABLE, WORKER_STATS_ROW
+    COUNTER_SLOTS = slots
+    PATTERN_STORE = pattern_store
+    WORKER_STATS_TABLE = worker_stats
+    WORKER_STATS_ROW = claim_worker_row(worker_stats)
+
+
+def add_shared_patterns(shared_pool, patterns):
+    """
+    Put a scan's pattern list in a shared pool's store, where workers fetch it
+    the first time they see it. Returns the digest that names it.
+    """
+    digest = hashlib.sha1(json.dumps(patterns).encode('utf-8')).hexdigest()
+    with shared_pool["lock"]:
+        users = shared_pool["pattern_users"]
+        if digest not in users:
+            shared_pool["patterns"][digest] = patterns
+        users[digest] = users.get(digest, 0) + 1
+    return digest
+
+
+def remove_shared_patterns(shared_pool, digest):
+    """Drop a pattern list from a shared pool's store once no scan uses it."""
+    with shared_pool["lock"]:
+        users = shared_pool["pattern_users"]
+        users[digest] -= 1
+        if not users[digest]:
+            del users[digest]
+            del shared_pool["patterns"][digest]
+
+
+def run_in_slot(args):
+    """
+    Run a scan task on a shared pool's worker: point the worker's statistics
+    at the scan's counter slot and its matcher at the scan's patterns first.
+    Matchers are cached in the worker, so a pattern list is only fetched and
+    built once per worker, however many scans use it.
+    
+    Args:
+        args (tuple): (slot, patterns_digest, task, task_args), task being
+                      process_file_wrapper, process_batch_wrapper or process_range_wrapper
+    """
+    global TOTAL_MATCHES, TOTAL_FILES_PROCESSED, TOTAL_BYTES_PROCESSED, PATTERN_MATCHER
+    slot, patterns_digest, task, task_args = args
+    TOTAL_MATCHES, TOTAL_FILES_PROCESSED, TOTAL_BYTES_PROCESSED = COUNTER_SLOTS[slot]
+    
+    if patterns_digest is not None:
+        matcher = MATCHER_CACHE.get(patterns_digest)
+        if matcher is None:
+            if len(MATCHER_CACHE) >= MAX_CACHED_MATCHERS:
+                # Forget the oldest matcher
+                del MATCHER_CACHE[next(iter(MATCHER_CACHE))]
+            matcher = build_pattern_matcher(PATTERN_STORE[patterns_digest])
+            MATCHER_CACHE[patterns_digest] = matcher
+        PATTERN_MATCHER = matcher
+    
+    return task(task_args)
+
+
+def find_next_line_start(f, pos, file_end):
+    """
+    Return the offset just past the first newline at or after `pos`,
+    or file_end if there is none. Reads the file in small blocks.
+    """
+    f.seek(pos)
+    while pos < file_end:
+        block = f.read(min(64 * 1024, file_end - pos))
+        if not block:
+            break
+        newline = block.find(b'\n')
+        if newline != -1:
+            return pos + newline + 1
+        pos += len(block)
+    return file_end
+
+
+def find_line_aligned_ranges(file_path, file_size, split_size, start=0):
+    """
+    Cut a file into byte ranges of roughly split_size bytes. Every range
+    except the first starts right after a newline, so no line is shared
+    between two ranges.
+    
+    Args:
+        file_path (str): Path to the log file
+        file_size (int): Size of the file in bytes, or where to stop
+        split_size (int): Target size of each range in bytes
+        start (int): Where to begin (0 or the first byte of a line)
+        
+    Returns:
+        list: (start, end) tuples covering [start, file_size) in order
+    """
+    ranges = []
+    
+    with open(file_path, 'rb') as f:
+        while start < file_size:
+            target = start + split_size
+            if target >= file_size:
+                ranges.append((start, file_size))
+                break
+            
+            # Move the boundary forward to just past the next newline
+            end = find_next_line_start(f, target - 1, file_size)
+            ranges.append((start, end))
+            start = end
+    
+    return ranges
+
+
+def iter_line_windows(f, start, end, window_size=100*1024*1024):
+    """
+    Walk the byte range [start, end) of an open file as a series of
+    memory-mapped windows that only ever contain complete lines.
+    
+    A window is cut at the last newline before window_size bytes; the partial
+    line after it is carried over to the start of the next window, so no line
+    is ever split or skipped. A single line longer than window_size gets a
+    window of its own that is stretched to the line's end.
+    
+    Args:
+        f (file): File opened in binary mode
+        start (int): First byte of the range (0 or the first byte of a line)
+        end (int): End of the range (exclusive)
+        window_size (int): Target size of each window in bytes
+        
+    Yields:
+        tuple: (mm, lo, hi) where mm[lo:hi] holds whole lines. The map is
+               closed once the consumer advances, so don't keep it around.
+    """
+    window_start = start
+    
+    while window_start < end:
+        window_end = min(window_start + window_size, end)
+        
+        # mmap offsets must be a multiple of the allocation granularity
+        map_start = window_start - window_start % mmap.ALLOCATIONGRANULARITY
+        lo = window_start - map_start
+        
+        if window_end < end:
+            with mmap.mmap(f.fileno(), window_end - map_start,
+                          access=mmap.ACCESS_READ,
+                          offset=map_start) as mm:
+                last_newline = mm.rfind(b'\n', lo)
+            
+            if last_newline != -1:
+                # Carry the partial tail line over to the next window
+                window_end = map_start + last_newline + 1
+            else:
+                # The line is longer than the window; stretch to its end
+                window_end = find_next_line_start(f, window_end, end)
+        
+        with mmap.mmap(f.fileno(), window_end - map_start,
+                      access=mmap.ACCESS_READ,
+                      offset=map_start) as mm:
+            yield mm, lo, window_end - map_start
+        
+        window_start = window_end
+
+
+def scan_range(f, start, end, search_bytes=None, pattern=None,
+               chunk_size=100*1024*1024, count_lines=False, matcher=None, pattern_counts=None):
+    """
+    Scan the byte range [start, end) of an open file using memory-mapped I/O.
+    `start` must be 0 or the first byte of a line.
+    
+    Args:
+        f (file): File opened in binary mode
+        start (int): First byte of the range
+        end (int): End of the range (exclusive)
+        search_bytes (bytes): Literal to search for; with a pattern, a literal every
+            match must contain, so the regex only runs on lines containing it.
+            May be a compiled regex of several literals for a boolean query.
+        pattern (re.Pattern): Compiled bytes regex to search with, or a
+            jsonquery.JsonQuery or booleanquery.BooleanQuery; matches of a
+            JSON query with fields are rendered as just those fields
+        chunk_size (int): Size of the windows to process at once
+        count_lines (bool): Whether to track line numbers of the matches
+        matcher (tuple, optional): Multi-pattern matcher from build_pattern_matcher;
+            when given, lines are prefixed with the patterns they hit
+        pattern_counts (dict, optional): Updated with the number of lines hit per pattern
+        
+    Returns:
+        tuple: (matches, newline_count) where matches is a list of
+               (line_index, line) pairs. line_index is the 0-based line
+               number relative to `start`, or None when count_lines is False.
+    """
+    return scan_windows(iter_line_windows(f, start, end, chunk_size), search_bytes, pattern,
+                        count_lines=count_lines, matcher=matcher, pattern_counts=pattern_counts)
+
+
+def scan_file_part(file_path, start, end, search_bytes=None, pattern=None,
+                   chunk_size=100*1024*1024, count_lines=False, matcher=None, pattern_counts=None,
+                   time_range=None):
+    """
+    Scan the byte range [start, end) of a file with scan_range, or the
+    decompressed lines of a compressed file (or of a range of gzip members)
+    with iter_compressed_windows. Compressed files can't be bisected, so
+    their windows are narrowed to a time_range as they are decompressed;
+    plain files are narrowed by the caller (see narrow_to_time_range).
+    """
+    if is_compressed(file_path):
+        windows = iter_compressed_windows(file_path, start, end, chunk_size)
+        if time_range is not None:
+            time_filter = compressed_time_filter(file_path, time_range)
+            if time_filter is not None:
+                windows = narrow_windows(windows, time_filter, count_lines)
+        return scan_windows(windows, search_bytes, pattern, count_lines=count_lines,
+                            matcher=matcher, pattern_counts=pattern_counts)
+    
+    with open(file_path, 'rb') as f:
+        return scan_range(f, start, end, search_bytes, pattern, chunk_size=chunk_size,
+                          count_lines=count_lines, matcher=matcher, pattern_counts=pattern_counts)
+
+
+def scan_windows(windows, search_bytes=None, pattern=None, count_lines=False, matcher=None,
+                 pattern_counts=None):
+    """
+    Search a series of windows of whole lines, as yielded by iter_line_windows
+    or iter_compressed_windows, or narrowed by timerange.narrow_windows. See
+    scan_range for the arguments.
+    
+    The bytes and lines scanned, the time spent waiting for each window and
+    the time spent decoding its matching lines are counted in WORKER_STATS.
+    
+    Returns:
+        tuple: (matches, newline_count), line numbers counting from the
+               first window
+    """
+    matches = []
+    lines_before = 0
+    windows = iter(windows)
+    
+    while True:
+        # Mapping, reading or decompressing the next window
+        wait_start = time.perf_counter()
+        window = next(windows, None)
+        io_wait = time.perf_counter() - wait_start
+        if window is None:
+            add_worker_stats(io_wait_seconds=io_wait)
+            break
+        mm, lo, hi = window[:3]
+        if len(window) > 3:
+            # Lines passed over before lo, see timerange.narrow_windows
+            lines_before += window[3]
+        lines_at_start = lines_before
+        
+        # The window's matching lines, undecoded
+        found_lines = []
+        
+        # If searching for a list of patterns
+        if matcher is not None:
+            prefilter, automaton, patterns = matcher
+            current_pos = lo
+            counted_pos = lo
+            
+            while True:
+                # The trie regex finds candidate lines straight from the map
+                found = prefilter.search(mm, current_pos, hi)
+                if found is None:
+                    break
+                found_pos = found.start()
+                
+                # Find the bounds of the line containing the candidate
+                line_start = mm.rfind(b'\n', lo, found_pos)
+                if line_start == -1:  # If not found, start of the window
+                    line_start = lo
+                else:
+                    line_start += 1  # Skip the newline character
+                
+                line_end = mm.find(b'\n', found_pos, hi)
+                if line_end == -1:  # If not found, end of the window
+                    line_end = hi
+                
+                line_index = None
+                if count_lines:
+                    lines_before += count_newlines(mm, counted_pos, line_start)
+                    counted_pos = line_start
+                    line_index = lines_before
+                
+                # The automaton reports every pattern on the line, overlaps included
+                raw_line = mm[line_start:line_end]
+                hit_patterns = [patterns[index] for index in sorted(automaton_search(automaton, raw_line))]
+                if pattern_counts is not None:
+                    for hit_pattern in hit_patterns:
+                        pattern_counts[hit_pattern] = pattern_counts.get(hit_pattern, 0) + 1
+                
+                found_lines.append((line_index, raw_line, f"[{', '.join(hit_patterns)}] "))
+                
+                # Each line is reported once, with all of its patterns
+                current_pos = line_end + 1
+            
+            if count_lines:
+                lines_before += count_newlines(mm, counted_pos, hi)
+        # If using regex without a usable literal
+        elif pattern is not None and search_bytes is None:
+            # For regex, we'll process line by line
+            lines = mm[lo:hi].split(b'\n')
+            newline_count = len(lines) - 1
+            if lines[-1] == b'':
+                # The window ends with a newline, not with a partial line
+                lines.pop()
+            
+            for i, line in enumerate(lines):
+                if pattern.search(line):
+                    line_index = lines_before + i if count_lines else None
+                    found_lines.append((line_index, line))
+            
+            if count_lines:
+                lines_before += newline_count
+        else:
+            # For simple string search, use mmap's efficient search. A regex is
+            # only run on the lines the literal prefilter finds.
+            current_pos = lo
+            counted_pos = lo
+            
+            while True:
+                if isinstance(search_bytes, bytes):
+                    found_pos = mm.find(search_bytes, current_pos, hi)
+                else:
+                    # A boolean query's lines hold one of several literals
+                    found = search_bytes.search(mm, current_pos, hi)
+                    found_pos = found.start() if found else -1
+                if found_pos == -1:
+                    break
+                
+                # Find the start of the line containing match
+                line_start = mm.rfind(b'\n', lo, found_pos)
+                if line_start == -1:  # If not found, start of the window
+                    line_start = lo
+                else:
+                    line_start += 1  # Skip the newline character
+                
+                # Find the end of the line
+                line_end = mm.find(b'\n', found_pos, hi)
+                if line_end == -1:  # If not found, end of the window
+                    line_end = hi
+                
+                raw_line = mm[line_start:line_end]
+                if pattern is not None:
+                    # Each candidate line is checked once
+                    current_pos = line_end + 1
+                    if not pattern.search(raw_line):
+                        continue
+                else:
+                    # Move to position after current match
+                    current_pos = found_pos + 1
+                
+                line_index = None
+                if count_lines:
+                    lines_before += count_newlines(mm, counted_pos, line_start)
+                    counted_pos = line_start
+                    line_index = lines_before
+                
+                found_lines.append((line_index, raw_line))
+            
+            if count_lines:
+                lines_before += count_newlines(mm, counted_pos, hi)
+        
+        # Decode the window's matching lines in one go
+        decode_start = time.perf_counter()
+        if matcher is not None:
+            matches.extend((line_index, prefix + raw_line.decode('utf-8', errors='replace'))
+                           for line_index, raw_line, prefix in found_lines)
+        elif isinstance(pattern, JsonQuery) and pattern.fields:
+            # Only the selected fields of a JSON query's matches are kept
+            matches.extend((line_index, pattern.project(raw_line)) for line_index, raw_line in found_lines)
+        else:
+            matches.extend((line_index, raw_line.decode('utf-8', errors='replace'))
+                           for line_index, raw_line in found_lines)
+        
+        add_worker_stats(bytes=hi - lo, lines=lines_before - lines_at_start, io_wait_seconds=io_wait,
+                         decode_seconds=time.perf_counter() - decode_start)
+        flush_worker_stats()
+    
+    return matches, lines_before
+
+
+def required_literals(parsed, ignore_case=False):
+    """
+    Collect byte strings that every match of a parsed regex must contain.
+    Runs of literal characters are required as long as nothing optional,
+    repeated zero times or alternated sits between them.
+    
+    Args:
+        parsed: A sequence of (opcode, argument) items from sre_parse
+        ignore_case (bool): Whether the sequence is matched case-insensitively
+        
+    Returns:
+        list: Required literals (bytes); may be empty
+    """
+    candidates = []
+    run = bytearray()
+    
+    for opcode, argument in parsed:
+        if opcode == sre_parse.LITERAL and not ignore_case:
+            run.append(argument)
+            continue
+        if opcode == sre_parse.AT:
+            # Anchors are zero-width, the literal run continues past them
+            continue
+        
+        if run:
+            candidates.append(bytes(run))
+            run = bytearray()
+        
+        if opcode == sre_parse.SUBPATTERN:
+            _, add_flags, del_flags, sub = argument
+            sub_ignore_case = (ignore_case or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+            candidates.extend(required_literals(sub, sub_ignore_case))
+        elif opcode in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            min_count, _, sub = argument
+            if min_count >= 1:
+                candidates.extend(required_literals(sub, ignore_case))
+    
+    if run:
+        candidates.append(bytes(run))
+    return candidates
+
+
+def bounded_literal_runs(pattern):
+    """
+    Return the runs of literal characters at the top level of a bytes regex,
+    which every match contains, with whether each run is known to start and
+    end at a token boundary (\\b, ^ or $ right next to it).
+    
+    Returns:
+        list: (literal, bounded_start, bounded_end) tuples
+    """
+    boundaries = {sre_parse.AT_BOUNDARY, sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING,
+                  sre_parse.AT_END, sre_parse.AT_END_STRING}
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return []
+    
+    runs = []
+    run = bytearray()
+    run_bounded = False
+    after_boundary = False
+    
+    for opcode, argument in parsed:
+        if opcode == sre_parse.LITERAL:
+            if not run:
+                run_bounded = after_boundary
+            run.append(argument)
+            continue
+        
+        after_boundary = opcode == sre_parse.AT and argument in boundaries
+        if run:
+            runs.append((bytes(run), run_bounded, after_boundary))
+            run = bytearray()
+    
+    if run:
+        runs.append((bytes(run), run_bounded, False))
+    return runs
+
+
+def extract_required_literal(pattern, min_length=3):
+    """
+    Pick the longest literal every match of a compiled bytes regex must
+    contain, to find candidate lines with mm.find before running the regex.
+    
+    Returns:
+        bytes: The literal, or None if there is none at least min_length long
+               (the regex then has to run over every line)
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    
+    candidates = required_literals(parsed, bool(pattern.flags & re.IGNORECASE))
+    if not candidates:
+        return None
+    
+    literal = max(candidates, key=len)
+    return literal if len(literal) >= min_length else None
+
 
-def scan_file_with_mmap(file_path, search_parameter, chunk_size=100*1024*1024, use_regex=False):
+def compile_query_search(query_search):
+    """
+    The compiled query of a query_search: ('json', query, fields) for
+    jsonquery.compile_json_query or ('boolean', query) for
+    booleanquery.compile_boolean_query. Raises ValueError for an invalid query.
+    """
+    kind, *query = query_search
+    if kind == 'json':
+        return compile_json_query(*query)
+    return compile_boolean_query(*query)
+
+
+@lru_cache(maxsize=64)
+def compile_search(search_parameter, use_regex, query_search=None):
+    """
+    Prepare the search for scan_range. For a regex, search_bytes is a
+    literal every match must contain (or None), used as a prefilter.
+    A query_search (see compile_query_search) is searched for instead of
+    search_parameter; its compiled query takes the place of the regex,
+    and search_bytes is the literal the query's planner picked, or for a
+    boolean query a regex of several literals. Cached, so a worker only
+    compiles a search once for all its files.
+    
+    Returns:
+        tuple: (search_bytes, pattern); raises re.error for an invalid regex
+               and ValueError for an invalid query
+    """
+    if query_search is not None:
+        query = compile_query_search(query_search)
+        if isinstance(query, BooleanQuery) and query.prefilter is not None:
+            return query.prefilter, query
+        return query.needle, query
+    if use_regex:
+        pattern = re.compile(search_parameter.encode('utf-8'))
+        return extract_required_literal(pattern), pattern
+    return search_parameter.encode('utf-8'), None
+
+
+def narrow_to_time_range(file_path, start, end, time_range, count_lines=False):
+    """
+    Narrow the line-aligned range [start, end) of a plain file to the lines
+    inside time_range, bisecting on the file's timestamps (see timerange).
+    The newlines of the parts left out are counted directly; the scans
+    narrow their files with narrow_ranges_to_time_range before handing them
+    out, so their workers have nothing left to narrow or count here.
+    
+    Returns:
+        tuple: (start, end, lines_before, lines_after), the narrowed range
+               and, with count_lines, the newlines of [start, end) before
+               and after it
+    """
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # The window is found in the whole file, so lines without a timestamp
+        # at the start of a range go with the line before them
+        window_start, window_end = find_time_bounds(mm, time_range)
+        narrowed_start = min(max(start, window_start), end)
+        narrowed_end = max(narrowed_start, min(end, window_end))
+        lines_before = lines_after = 0
+        if count_lines:
+            lines_before = count_newlines(mm, start, narrowed_start)
+            lines_after = count_newlines(mm, narrowed_end, end)
+    return narrowed_start, narrowed_end, lines_before, lines_after
+
+
+def narrow_ranges_to_time_range(file_path, ranges, time_range, count_lines=False,
+                                index_dir=DEFAULT_LINE_INDEX_DIR):
+    """
+    Narrow the line-aligned ranges of a plain file to the lines inside
+    time_range before they are handed out to the workers. The window is
+    found once for the whole file, and ranges entirely outside it are
+    dropped without being read. With count_lines, the first range kept
+    gets its line number from the file's line index in index_dir when lines
+    before it were left out; the index is only read whole to build or
+    extend it (the first time, or after the log grew), and newlines are
+    counted directly if it can't be stored.
+    
+    Args:
+        file_path (str): Path to the plain log file
+        ranges (list): (start, end, first_line) ranges in file order, as in
+            stitch_range_results
+        time_range (tuple): (since, until) from timerange.parse_time_range
+        count_lines (bool): Whether the matches are numbered
+        index_dir (str): Directory holding the line indexes
+        
+    Returns:
+        list: The (start, end, first_line) ranges left; empty if no line of
+              the file is inside time_range
+    """
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        window_start, window_end = find_time_bounds(mm, time_range)
+        narrowed = []
+        for range_index, (start, end, first_line) in enumerate(ranges):
+            narrowed_start = max(start, window_start)
+            narrowed_end = min(end, window_end)
+            if narrowed_start >= narrowed_end:
+                continue
+            if count_lines and not narrowed and (narrowed_start > start or
+                                                 (range_index > 0 and first_line is None)):
+                # Later ranges continue from this one
+                try:
+                    index = get_line_index(file_path, index_dir=index_dir)
+                except OSError:
+                    index = None
+                if index is not None and index["size"] >= len(mm):
+                    first_line = line_number_at(index, mm, narrowed_start)
+                else:
+                    first_line = count_newlines(mm, 0, narrowed_start)
+            narrowed.append((narrowed_start, narrowed_end, first_line))
+    return narrowed
+
+
+def compressed_time_filter(file_path, time_range):
+    """The timerange.time_filter_for of a compressed file, from its first lines."""
+    with open_text(file_path, 'r', errors='replace') as f:
+        head = [line.encode('utf-8') for line in islice(f, DETECT_LINES)]
+    return time_filter_for(head, time_range)
+
+
+def scan_file_with_mmap(file_path, search_parameter, chunk_size=100*1024*1024, use_regex=False,
+                        line_numbers=False, matcher=None, pattern_counts=None, time_range=None,
+                        query_search=None):
     """
     Scan a single file using memory-mapped I/O with chunked processing.
     Returns a list of matching lines.
@@ -26,6 +976,13 @@ def scan_file_with_mmap(file_path, search_parameter, chunk_size=100*1024*1024, u
         search_parameter (str): Text or pattern to search for
         chunk_size (int): Size of chunks to process at once (default: 100MB)
         use_regex (bool): Whether to use regex pattern matching
+        line_numbers (bool): Whether to prefix each match with its line number
+        matcher (tuple, optional): Multi-pattern matcher used instead of search_parameter
+        pattern_counts (dict, optional): Updated with the number of lines hit per pattern
+        time_range (tuple, optional): (since, until) from timerange.parse_time_range;
+            only the lines inside it are scanned
+        query_search (tuple, optional): JSON field query or boolean query searched
+            instead of search_parameter, see compile_query_search
         
     Returns:
         tuple: (file_path, matches)
@@ -33,10 +990,10 @@ def scan_file_with_mmap(file_path, search_parameter, chunk_size=100*1024*1024, u
     matches = []
     
     # Compile regex pattern if using regex
-    pattern = None
-    if use_regex:
+    search_bytes = pattern = None
+    if matcher is None:
         try:
-            pattern = re.compile(search_parameter.encode('utf-8'))
+            search_bytes, pattern = compile_search(search_parameter, use_regex, query_search)
         except re.error as e:
             return file_path, [f"ERROR: Invalid regex pattern: {str(e)}"]
     
@@ -48,132 +1005,173 @@ def scan_file_with_mmap(file_path, search_parameter, chunk_size=100*1024*1024, u
         if file_size == 0:
             return file_path, matches
         
-        # Convert search parameter to bytes for mmap searching
-        search_bytes = search_parameter.encode('utf-8') if not use_regex else None
+        # Narrow the file to the time range before searching it
+        start, end, lines_before = 0, file_size, 0
+        if time_range is not None and not is_compressed(file_path):
+            start, end, lines_before, _ = narrow_to_time_range(file_path, 0, file_size, time_range, line_numbers)
         
-        with open(file_path, 'rb') as f:
-            # Process the file in chunks
-            for chunk_start in range(0, file_size, chunk_size):
-                chunk_end = min(chunk_start + chunk_size, file_size)
-                actual_chunk_size = chunk_end - chunk_start
-                
-                # Create memory map for this chunk
-                with mmap.mmap(f.fileno(), actual_chunk_size, 
-                              access=mmap.ACCESS_READ, 
-                              offset=chunk_start) as mm:
-                    
-                    # Adjust for potential line breaks across chunks
-                    # If we're not at the start of the file, find the beginning of the first complete line
-                    line_start_pos = 0
-                    if chunk_start > 0:
-                        # Find the first newline in this chunk
-                        first_newline = mm.find(b'\n')
-                        if first_newline != -1:
-                            line_start_pos = first_newline + 1
-                    
-                    # If using regex
-                    if use_regex:
-                        # For regex, we'll process line by line
-                        mm.seek(line_start_pos)
-                        data = mm.read()
-                        lines = data.split(b'\n')
-                        
-                        for i, line in enumerate(lines):
-                            if pattern.search(line):
-                                try:
-                                    decoded_line = line.decode('utf-8', errors='replace')
-                                    matches.append(decoded_line)
-                                except Exception as e:
-                                    matches.append(f"ERROR DECODING LINE: {str(e)}")
-                    else:
-                        # For simple string search, use mmap's efficient search
-                        current_pos = line_start_pos
-                        
-                        while True:
-                            found_pos = mm.find(search_bytes, current_pos)
-                            if found_pos == -1:
-                                break
-                            
-                            # Find the start of the line containing match
-                            line_start = mm.rfind(b'\n', line_start_pos, found_pos)
-                            if line_start == -1:  # If not found, start of visible chunk
-                                line_start = line_start_pos
-                            else:
-                                line_start += 1  # Skip the newline character
-                            
-                            # Find the end of the line
-                            line_end = mm.find(b'\n', found_pos)
-                            if line_end == -1:  # If not found, end of chunk
-                                line_end = mm.size()
-                            
-                            # Extract the line and decode to string
-                            try:
-                                line = mm[line_start:line_end].decode('utf-8', errors='replace')
-                                matches.append(line)
-                            except Exception as e:
-                                matches.append(f"ERROR DECODING LINE: {str(e)}")
-                            
-                            # Move to position after current match
-                            current_pos = found_pos + 1
-                
-                # Update bytes processed counter
-                with TOTAL_BYTES_PROCESSED.get_lock():
-                    TOTAL_BYTES_PROCESSED.value += actual_chunk_size
+        found = []
+        if start < end:
+            found, _ = scan_file_part(file_path, start, end, search_bytes, pattern,
+                                      chunk_size=chunk_size, count_lines=line_numbers,
+                                      matcher=matcher, pattern_counts=pattern_counts, time_range=time_range)
+        matches = [format_match(line_index, line, lines_before) for line_index, line in found]
+    
+    except PermissionError:
+        return file_path, [f"ERROR: Permission denied: {file_path}"]
+    except IsADirectoryError:
+        return file_path, [f"ERROR: Is a directory: {file_path}"]
+    except Exception as e:
+        return file_path, [f"ERROR: {str(e)}"]
+    
+    # Counted in the scan's counters at the next flush
+    add_worker_stats(files=1, matches=len(matches))
+    
+    return file_path, matches
+
+
+def scan_file_range(file_path, search_parameter, start, end, chunk_size=100*1024*1024,
+                    use_regex=False, line_numbers=False, matcher=None, pattern_counts=None,
+                    time_range=None, query_search=None):
+    """
+    Scan one line-aligned byte range of a file, or one member range of a
+    gzip file. Used to spread a single large file over several workers; the
+    caller stitches the ranges back together. With a time_range only the
+    part of the range inside it is scanned; a query_search is searched for
+    as in scan_file_with_mmap.
     
+    Returns:
+        tuple: (matches, newline_count) as returned by scan_range
+    """
+    search_bytes = pattern = None
+    if matcher is None:
+        try:
+            search_bytes, pattern = compile_search(search_parameter, use_regex, query_search)
+        except re.error as e:
+            return [(None, f"ERROR: Invalid regex pattern: {str(e)}")], 0
+    
+    try:
+        # Narrow the range to the time range before searching it
+        scan_start, scan_end, lines_before, lines_after = start, end, 0, 0
+        if time_range is not None and not is_compressed(file_path):
+            scan_start, scan_end, lines_before, lines_after = narrow_to_time_range(file_path, start, end,
+                                                                                   time_range, line_numbers)
+        
+        matches, newline_count = [], 0
+        if scan_start < scan_end:
+            matches, newline_count = scan_file_part(file_path, scan_start, scan_end, search_bytes, pattern,
+                                                    chunk_size=chunk_size, count_lines=line_numbers,
+                                                    matcher=matcher, pattern_counts=pattern_counts,
+                                                    time_range=time_range)
+        if lines_before:
+            matches = [(line_index + lines_before, line) for line_index, line in matches]
+        newline_count += lines_before + lines_after
     except PermissionError:
-        return file_path, [f"ERROR: Permission denied: {file_path}"]
-    except IsADirectoryError:
-        return file_path, [f"ERROR: Is a directory: {file_path}"]
+        return [(None, f"ERROR: Permission denied: {file_path}")], 0
     except Exception as e:
-        return file_path, [f"ERROR: {str(e)}"]
-    
-    # Update processed files counter
-    with TOTAL_FILES_PROCESSED.get_lock():
-        TOTAL_FILES_PROCESSED.value += 1
+        return [(None, f"ERROR: {str(e)}")], 0
     
-    # Update matches counter
-    with TOTAL_MATCHES.get_lock():
-        TOTAL_MATCHES.value += len(matches)
+    # Counted in the scan's counters at the next flush
+    add_worker_stats(matches=len(matches))
     
-    return file_path, matches
+    return matches, newline_count
 
 
-def write_results_to_file(file_path, matches, output_file, lock):
+def format_section(file_path, matches):
     """
-    Write results to output file with proper locking for concurrent access.
+    The section of the output file listing the matches of one scanned file.
     
     Args:
         file_path (str): Path to the processed file
         matches (list): List of matching lines
-        output_file (str): Path to output file
-        lock (multiprocessing.Lock): Lock for file access
+        
+    Returns:
+        str: The section, or an empty string for a file without matches
     """
     if not matches:
-        return
+        return ''
     
-    with lock:
-        with open(output_file, 'a') as out_file:
-            out_file.write(f"\n{'=' * 80}\n")
-            out_file.write(f"MATCHES FROM: {file_path}\n")
-            out_file.write(f"{'=' * 80}\n\n")
-            
-            for line in matches:
-                out_file.write(line + '\n')
-            
-            out_file.write(f"\nTotal matches in this file: {len(matches)}\n\n")
+    separator = '=' * 80
+    return (f"\n{separator}\nMATCHES FROM: {file_path}\n{separator}\n\n" +
+            ''.join(line + '\n' for line in matches) +
+            f"\nTotal matches in this file: {len(matches)}\n\n")
+
+
+def start_task(sample_stacks=False):
+    """
+    Note where a scan task starts, for finish_task. With sample_stacks the
+    task's stack is sampled while it runs (see scanprofile).
+    """
+    if sample_stacks:
+        # Stacks start at the task wrapper calling this
+        start_sampling(sys._getframe(1))
+    return {
+        "start": time.perf_counter(),
+        "cpu": time.process_time(),
+        "stats": dict(WORKER_STATS),
+        "faults": page_faults(),
+        "sample_stacks": sample_stacks
+    }
+
+
+def finish_task(task):
+    """
+    Count a finished task in the worker's statistics and flush them.
+    
+    Returns:
+        dict: What the task cost: seconds, cpu_seconds, bytes, matches,
+              io_wait_seconds, decode_seconds, minor_faults and major_faults,
+              the worker that ran it (its process ID) and its stack samples
+              if they were taken
+    """
+    seconds = time.perf_counter() - task["start"]
+    add_worker_stats(tasks=1, busy_seconds=seconds)
+    flush_worker_stats(force=True)
+    
+    before = task["stats"]
+    minor_faults, major_faults = (after - start for after, start in zip(page_faults(), task["faults"]))
+    task_stats = {
+        "seconds": seconds,
+        "cpu_seconds": time.process_time() - task["cpu"],
+        "bytes": WORKER_STATS["bytes"] - before["bytes"],
+        "matches": WORKER_STATS["matches"] - before["matches"],
+        "io_wait_seconds": WORKER_STATS["io_wait_seconds"] - before["io_wait_seconds"],
+        "decode_seconds": WORKER_STATS["decode_seconds"] - before["decode_seconds"],
+        "minor_faults": minor_faults,
+        "major_faults": major_faults,
+        "worker": os.getpid()
+    }
+    if task["sample_stacks"]:
+        task_stats["samples"] = stop_sampling()
+    return task_stats
+
+
+def page_faults():
+    """(minor, major) page faults of this process so far; mapped log pages are read through these."""
+    if resource is None:
+        return 0, 0
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_minflt, usage.ru_majflt
 
 
 def process_file_wrapper(args):
     """
-    Wrapper function for parallel processing that handles writing results directly.
+    Wrapper function for scanning one whole file in parallel. The file's
+    section of the output is returned to the parent, whose writer stage
+    writes it out; one string is much cheaper to send back than many lines.
     
     Args:
-        args (tuple): (file_path, search_parameter, output_file, lock, use_regex, chunk_size)
+        args (tuple): (file_path, search_parameter, use_regex, chunk_size, line_numbers, use_patterns,
+                       sample_stacks, time_range, query_search)
         
     Returns:
-        int: Number of matches found
+        tuple: (file_path, section, pattern_counts, task_stats), section being ''
+               without matches and task_stats as returned by finish_task
     """
-    file_path, search_parameter, output_file, lock, use_regex, chunk_size = args
+    (file_path, search_parameter, use_regex, chunk_size, line_numbers, use_patterns,
+     sample_stacks, time_range, query_search) = args
+    pattern_counts = {}
+    task = start_task(sample_stacks)
     
     try:
         # Scan the file
@@ -181,23 +1179,381 @@ def process_file_wrapper(args):
             file_path, 
             search_parameter, 
             chunk_size=chunk_size,
-            use_regex=use_regex
+            use_regex=use_regex,
+            line_numbers=line_numbers,
+            matcher=PATTERN_MATCHER if use_patterns else None,
+            pattern_counts=pattern_counts,
+            time_range=time_range,
+            query_search=query_search
         )
-        
-        # Write results directly to the output file
-        if matches:
-            write_results_to_file(file_path, matches, output_file, lock)
-        
-        return len(matches)
+        section = format_section(file_path, matches)
     except Exception as e:
         print(f"Error processing {file_path}: {str(e)}")
-        return 0
+        section = ''
+    return file_path, section, pattern_counts, finish_task(task)
+
+
+def process_batch_wrapper(args):
+    """
+    Wrapper function for scanning a batch of small whole files in one task,
+    saving a round trip to the pool for each of them.
+    
+    Args:
+        args (tuple): The process_file_wrapper args of each file
+        
+    Returns:
+        list: process_file_wrapper's result for each file, in order
+    """
+    return [process_file_wrapper(file_args) for file_args in args]
+
+
+def process_range_wrapper(args):
+    """
+    Wrapper function for scanning one byte range of a split file in parallel.
+    The results are returned to the parent, which stitches the ranges of a
+    file back together in order before writing them.
+    
+    Args:
+        args (tuple): (file_path, range_index, start, end, search_parameter, use_regex,
+                       chunk_size, line_numbers, use_patterns, sample_stacks, time_range, query_search)
+        
+    Returns:
+        tuple: (file_path, range_index, matches, newline_count, pattern_counts, task_stats)
+    """
+    (file_path, range_index, start, end, search_parameter, use_regex,
+     chunk_size, line_numbers, use_patterns, sample_stacks, time_range, query_search) = args
+    pattern_counts = {}
+    task = start_task(sample_stacks)
+    
+    try:
+        matches, newline_count = scan_file_range(
+            file_path,
+            search_parameter,
+            start,
+            end,
+            chunk_size=chunk_size,
+            use_regex=use_regex,
+            line_numbers=line_numbers,
+            matcher=PATTERN_MATCHER if use_patterns else None,
+            pattern_counts=pattern_counts,
+            time_range=time_range,
+            query_search=query_search
+        )
+    finally:
+        task_stats = finish_task(task)
+    return file_path, range_index, matches, newline_count, pattern_counts, task_stats
+
+
+def stitch_range_results(range_results, ranges):
+    """
+    Join the per-range results of a split file in file order, turning the
+    range-relative line numbers into file line numbers.
+    
+    Args:
+        range_results (list): (matches, newline_count) for each range, in order
+        ranges (list): (start, end, first_line) for each range. first_line is the
+            line number at start when known (ranges that skip parts of the file),
+            or None to continue from the previous range.
+        
+    Returns:
+        list: Formatted matching lines for the whole file
+    """
+    matches = []
+    line_offset = 0
+    for (range_matches, newline_count), (_, _, first_line) in zip(range_results, ranges):
+        if first_line is not None:
+            line_offset = first_line
+        for line_index, line in range_matches:
+            matches.append(format_match(line_index, line, line_offset))
+        line_offset += newline_count
+    return matches
+
+
+def search_needles(search_parameter, use_regex, patterns, query_search=None):
+    """
+    Return the literals (bytes) a matching line must contain one of, for
+    narrowing a search with the trigram index, or None if there are none.
+    """
+    if patterns is not None:
+        return [pattern.encode('utf-8') for pattern in patterns]
+    try:
+        search_bytes, pattern = compile_search(search_parameter, use_regex, query_search)
+    except (re.error, ValueError):
+        return None
+    if isinstance(pattern, BooleanQuery):
+        return pattern.cover
+    return [search_bytes] if search_bytes else None
+
+
+def bloom_token_sets(search_parameter, use_regex, patterns, query_search=None):
+    """
+    Return, for each alternative a matching line satisfies, the tokens and
+    token affixes it must contain (see needle_tokens), for checking the
+    Bloom filter sketches, or None if some alternative has none (the
+    sketches can't rule anything out).
+    """
+    if query_search is not None and query_search[0] == 'boolean':
+        # A line holds one of the literals of the query's cover
+        cover = compile_boolean_query(query_search[1]).cover
+        token_sets = [needle_tokens(literal) for literal in cover or ()]
+        return token_sets if token_sets and all(token_sets) else None
+    if query_search is not None:
+        # The tokens inside the quotes of string values are complete
+        query = compile_query_search(query_search)
+        tokens = [token for needle in query.needles for token in needle_tokens(needle)]
+        return [tokens] if tokens else None
+    if use_regex:
+        try:
+            _, pattern = compile_search(search_parameter, use_regex)
+        except re.error:
+            return None
+        tokens = [token for run in bounded_literal_runs(pattern) for token in needle_tokens(*run)]
+        return [tokens] if tokens else None
+    
+    needles = patterns if patterns is not None else [search_parameter]
+    token_sets = [needle_tokens(needle.encode('utf-8')) for needle in needles]
+    return token_sets if all(token_sets) else None
+
+
+def is_log_file(file_path, file_extensions, min_file_size=None, max_file_size=None):
+    """
+    Whether a path is a regular file with one of the log extensions (or a
+    numbered rotation of one, e.g. app.log.3), possibly compressed (app.log.3.gz),
+    within the size limits.
+    """
+    # Check file extension - allow for both regular extensions and numeric extensions
+    if not is_log_name(os.path.basename(file_path), file_extensions):
+        return False
+    
+    # Check if it's a regular file
+    if not os.path.isfile(file_path):
+        return False
+    
+    # Check file size constraints
+    if min_file_size is not None or max_file_size is not None:
+        try:
+            file_size = os.path.getsize(file_path)
+            if min_file_size is not None and file_size < min_file_size:
+                return False
+            if max_file_size is not None and file_size > max_file_size:
+                return False
+        except OSError:
+            # Skip files we can't get size for
+            return False
+    
+    return True
+
+
+def find_scan_ranges(file_path, file_size, split_size):
+    """
+    Cut a file into ranges that can be scanned in parallel: line-aligned
+    byte ranges for a plain file, ranges of whole members for a gzip file.
+    .bz2 and .xz files can only be read from the start, so they stay whole.
+    
+    Returns:
+        list: (start, end) tuples covering the file in order
+    """
+    extension = compression_extension(file_path)
+    if extension is None:
+        return find_line_aligned_ranges(file_path, file_size, split_size)
+    if extension == '.gz':
+        return find_gzip_member_ranges(file_path, file_size, split_size)
+    return [(0, file_size)]
+
+
+def find_log_files(directory_path, file_extensions, follow_symlinks=False, max_depth=None,
+                   min_file_size=None, max_file_size=None, discovery_threads=DEFAULT_DISCOVERY_THREADS):
+    """
+    Yield the log files under a directory, as accepted by is_log_file,
+    down to max_depth levels below it. Directories are listed in parallel
+    (see filediscovery), so the order differs from run to run.
+    """
+    for file_path, _ in discover_log_files(directory_path, file_extensions, follow_symlinks, max_depth,
+                                           min_file_size, max_file_size, discovery_threads):
+        yield file_path
+
+
+def find_counter_slot(shared_pool, counters):
+    """Index of the shared pool's counter slot a scan claimed with scan_slot."""
+    for slot, slot_counters in enumerate(shared_pool["slots"]):
+        if slot_counters is counters:
+            return slot
+    raise ValueError("Scans on a shared pool need a counter slot from scan_slot")
+
+
+def stream_scan(directory_path, search_parameter, use_regex=False, patterns=None,
+                file_extensions=None, follow_symlinks=False, max_depth=None,
+                num_processes=None, chunk_size=100*1024*1024, range_size=STREAM_RANGE_SIZE,
+                max_pending=None, counters=None, shared_pool=None,
+                discovery_threads=DEFAULT_DISCOVERY_THREADS, time_range=None, time_catalog=None,
+                index_dir=DEFAULT_LINE_INDEX_DIR):
+    """
+    Scan log files like scan_logs_parallel, but yield the matches as the
+    workers find them instead of writing them to an output file.
+    
+    Files are cut into line-aligned ranges of about range_size bytes, scanned
+    in parallel and reported in file order. At most max_pending ranges are
+    queued, being scanned or waiting to be consumed at any time, so a slow
+    consumer holds the scan back instead of matches piling up in memory.
+    
+    Args:
+        directory_path (str): Path to the directory containing log files
+        search_parameter (str): Text to search for in log files
+        use_regex (bool): Whether to use regex pattern matching
+        patterns (list, optional): Literal patterns to search for instead of
+            search_parameter; matching lines are prefixed with the patterns they hit
+        file_extensions (list): List of file extensions to include
+        follow_symlinks (bool): Whether to follow symlinks when searching for files
+        max_depth (int, optional): Maximum directory depth to search
+        num_processes (int, optional): Number of processes to use. If None, uses CPU count.
+        chunk_size (int): Size of chunks to process at once
+        range_size (int): Size in bytes of the ranges files are scanned in
+        max_pending (int, optional): Ranges in flight; defaults to twice num_processes
+        counters (tuple, optional): (matches, files, bytes) counters, as for scan_logs_parallel
+        shared_pool (dict, optional): Pool from create_shared_pool to scan on,
+            with counters from scan_slot
+        discovery_threads (int): Directories listed at the same time while
+            searching for files; the first files are scanned while the rest
+            of the tree is still being listed
+        time_range (tuple, optional): (since, until) from timerange.parse_time_range;
+            only the lines inside it are scanned
+        time_catalog (str, optional): Time catalog file used with time_range
+            to skip the files outside it, as for scan_logs_parallel
+        index_dir (str): Directory holding the line indexes numbering the
+            matches of a time range, as for scan_logs_parallel
+        
+    Yields:
+        dict: {"file", "line", "text"} for each matching line, line being the
+              1-based line number, or {"file", "error"} for a failed range
+    """
+    if patterns is not None:
+        if use_regex:
+            raise ValueError("Regex matching cannot be combined with a patterns list")
+        if not patterns:
+            raise ValueError("The patterns list is empty")
+    use_patterns = patterns is not None
+    
+    if file_extensions is None:
+        file_extensions = ['.log', '.1', '.txt']
+    
+    if shared_pool is not None:
+        slot = find_counter_slot(shared_pool, counters)
+        num_processes = shared_pool["num_processes"]
+    else:
+        if counters is None:
+            counters = (TOTAL_MATCHES, TOTAL_FILES_PROCESSED, TOTAL_BYTES_PROCESSED)
+        if num_processes is None:
+            num_processes = multiprocessing.cpu_count()
+    if max_pending is None:
+        max_pending = 2 * num_processes
+    
+    # Reset the counters
+    matches_counter, files_counter, bytes_counter = counters
+    matches_counter.value = 0
+    files_counter.value = 0
+    bytes_counter.value = 0
+    
+    time_catalog_data = load_time_catalog(time_catalog) if time_range and time_catalog else None
+    
+    def range_tasks():
+        """
+        (file_path, is_last_range, first_line, process_range_wrapper args) for
+        every range to scan, first_line being as in stitch_range_results
+        """
+        for file_path, file_size in discover_log_files(directory_path, file_extensions, follow_symlinks,
+                                                       max_depth, num_threads=discovery_threads):
+            if file_size == 0:
+                continue
+            if (time_catalog_data is not None
+                    and not overlaps_time_range(catalog_file(time_catalog_data, file_path), time_range)):
+                continue
+            try:
+                ranges = [(start, end, None) for start, end in find_scan_ranges(file_path, file_size, range_size)]
+                if time_range is not None and not is_compressed(file_path):
+                    ranges = narrow_ranges_to_time_range(file_path, ranges, time_range, True, index_dir)
+            except OSError as e:
+                yield file_path, True, None, None, str(e)
+                continue
+            for range_index, (start, end, first_line) in enumerate(ranges):
+                args = (file_path, range_index, start, end, search_parameter, use_regex,
+                        chunk_size, True, use_patterns, False, time_range, None)
+                yield file_path, range_index == len(ranges) - 1, first_line, args, None
+        if time_catalog_data is not None:
+            save_time_catalog(time_catalog, time_catalog_data)
+    
+    if shared_pool is None:
+        pool = multiprocessing.Pool(processes=num_processes, initializer=init_scan_worker,
+                                    initargs=(counters, patterns))
+    else:
+        pool = shared_pool["pool"]
+        patterns_digest = add_shared_patterns(shared_pool, patterns) if use_patterns else None
+    
+    tasks = range_tasks()
+    pending = deque()
+    line_offset = 0
+    try:
+        while True:
+            # Top the ranges in flight back up, then wait for the oldest
+            while len(pending) < max_pending:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                file_path, last_range, first_line, args, error = task
+                if args is None:
+                    pending.append((file_path, last_range, first_line, None, error))
+                elif shared_pool is None:
+                    pending.append((file_path, last_range, first_line,
+                                    pool.apply_async(process_range_wrapper, (args,)), None))
+                else:
+                    task_args = (slot, patterns_digest, process_range_wrapper, args)
+                    pending.append((file_path, last_range, first_line,
+                                    pool.apply_async(run_in_slot, (task_args,)), None))
+            
+            if not pending:
+                break
+            
+            file_path, last_range, first_line, result, error = pending.popleft()
+            if result is None:
+                yield {"file": file_path, "error": f"ERROR: {error}"}
+                continue
+            
+            if first_line is not None:
+                line_offset = first_line
+            _, _, matches, newline_count, _, _ = result.get()
+            for line_index, line in matches:
+                if line_index is None:
+                    yield {"file": file_path, "error": line}
+                else:
+                    yield {"file": file_path, "line": line_offset + line_index + 1, "text": line}
+            line_offset += newline_count
+            
+            if last_range:
+                line_offset = 0
+                with files_counter.get_lock():
+                    files_counter.value += 1
+    finally:
+        if shared_pool is None:
+            pool.terminate()
+        else:
+            # Let the ranges still in flight finish before the slot is reused
+            for _, _, _, result, _ in pending:
+                if result is not None:
+                    result.wait()
+            if use_patterns:
+                remove_shared_patterns(shared_pool, patterns_digest)
 
 
 def scan_logs_parallel(directory_path, search_parameter, output_file=None, 
                       use_regex=False, num_processes=None, chunk_size=100*1024*1024,
                       file_extensions=None, follow_symlinks=False, max_depth=None,
-                      min_file_size=None, max_file_size=None):
+                      min_file_size=None, max_file_size=None, split_size=None,
+                      line_numbers=False, patterns=None, trigram_index=None,
+                      index_block_size=DEFAULT_BLOCK_SIZE, bloom_index=None,
+                      bloom_region_size=DEFAULT_REGION_SIZE, state_dir=None,
+                      file_list=None, counters=None, shared_pool=None, ordered_output=False,
+                      profile=False, profile_samples=False, discovery_threads=DEFAULT_DISCOVERY_THREADS,
+                      time_range=None, time_catalog=None, json_query=None, json_fields=None,
+                      query=None, index_dir=DEFAULT_LINE_INDEX_DIR):
     """
     Scan all log files in the directory in parallel for lines containing the search parameter
     and write them directly to the output file.
@@ -206,6 +1562,7 @@ def scan_logs_parallel(directory_path, search_parameter, output_file=None,
         directory_path (str): Path to the directory containing log files
         search_parameter (str): Text to search for in log files
         output_file (str, optional): Path to output file. If None, generates a default name.
+            An output file ending in .gz is written gzip-compressed.
         use_regex (bool): Whether to use regex pattern matching
         num_processes (int, optional): Number of processes to use. If None, uses CPU count.
         chunk_size (int): Size of chunks to process at once (default: 100MB)
@@ -214,16 +1571,120 @@ def scan_logs_parallel(directory_path, search_parameter, output_file=None,
         max_depth (int, optional): Maximum directory depth to search
         min_file_size (int, optional): Minimum file size in bytes to process
         max_file_size (int, optional): Maximum file size in bytes to process
+        split_size (int, optional): Files larger than this many bytes are cut into
+            line-aligned ranges of about this size and scanned by several workers;
+            gzip files made of several members are cut between members
+        line_numbers (bool): Whether to prefix each matching line with its line number
+        patterns (list, optional): Literal patterns to search for in a single pass
+            instead of search_parameter. Each matching line is prefixed with the
+            patterns it hit, and per-pattern counts are written to the summary and
+            to a <output_file>.patterns.json file.
+        trigram_index (str, optional): Trigram index directory. The index is brought
+            up to date for the files found, and only the blocks that can contain a
+            match are read.
+        index_block_size (int): Block size in bytes for files newly added to the index
+        bloom_index (str, optional): Bloom filter sketch store. Sketches of new or
+            changed files are rebuilt, and files and regions whose filters don't
+            hold the searched tokens are skipped. Filters only know whole tokens, so a
+            plain search is checked on the tokens inside it; a regex like \\bORD-123\\b
+            is checked on all of them. Cannot be combined with trigram_index.
+        bloom_region_size (int): Region size in bytes for files newly sketched
+        state_dir (str, optional): Directory keeping per-search scan state. Only the
+            complete lines appended since the last run of the same search are
+            scanned, following rotated files by inode and restarting truncated
+            ones. Cannot be combined with trigram_index or bloom_index.
+        file_list (list, optional): Scan these files instead of searching
+            directory_path for log files; the extension and size filters still apply
+        counters (tuple, optional): (matches, files, bytes) counters from
+            new_scan_counters to report progress in; defaults to the module's
+            TOTAL_MATCHES, TOTAL_FILES_PROCESSED and TOTAL_BYTES_PROCESSED
+        shared_pool (dict, optional): Pool from create_shared_pool to scan on
+            instead of starting a pool for this scan; num_processes is then the
+            pool's size. counters must be the slot taken with scan_slot.
+        ordered_output (bool): Write the files' sections in the order the files
+            were found instead of as they finish
+        profile (bool): Write a profiling report to <output_file>.profile.json
+            with the wall and CPU time of each phase of the scan and what each
+            file cost the workers (see scanprofile)
+        profile_samples (bool): Also sample the workers' stacks for the report
+        discovery_threads (int): Directories listed at the same time while
+            searching directory_path. Without an index or scan state, files
+            are scanned as they are found rather than once the search ends.
+        time_range (tuple, optional): (since, until) from timerange.parse_time_range.
+            Each file is narrowed to the lines inside it by bisecting on its
+            timestamps before its tasks are planned, and the parts of split
+            files outside it are not scanned; compressed files are read from
+            the start up to the end of the range. With line_numbers, the line
+            number at the start of the range comes from the file's line index
+            (see narrow_ranges_to_time_range). Cannot be combined with state_dir.
+        time_catalog (str, optional): Time catalog file (see timecatalog). With a
+            time_range, files whose first and last timestamps show they hold
+            no line inside it are skipped without being opened; new and
+            changed files are cataloged from their head and tail.
+        json_query (str, optional): Field query over JSON-lines logs searched
+            instead of search_parameter, e.g. 'level=ERROR AND user.id=42'
+            (see jsonquery). Lines holding the query's values are found first
+            and only those are parsed.
+        json_fields (list, optional): Fields to write for each line matching
+            json_query instead of the whole line
+        query (str, optional): Boolean query searched instead of search_parameter,
+            e.g. 'ERROR AND "disk full" AND NOT /retry [0-9]+/' (see booleanquery).
+            Lines holding the query's rarest literal are found first and the
+            rest of the query is only checked on those.
+        index_dir (str): Directory holding the line indexes numbering the
+            matches of a time_range; defaults to the user's cache directory
         
     Returns:
         str: Path to the output file
     """
     start_time = time.time()
+    profile_data = new_profile() if profile or profile_samples else None
     
-    # Reset global counters
-    TOTAL_MATCHES.value = 0
-    TOTAL_FILES_PROCESSED.value = 0
-    TOTAL_BYTES_PROCESSED.value = 0
+    if patterns is not None:
+        if use_regex:
+            raise ValueError("Regex matching cannot be combined with a patterns list")
+        if not patterns:
+            raise ValueError("The patterns list is empty")
+        search_parameter = f"{len(patterns)} patterns"
+    
+    query_search = None
+    if json_query is not None and query is not None:
+        raise ValueError("A JSON query cannot be combined with a boolean query")
+    if json_query is not None or query is not None:
+        if use_regex or patterns is not None:
+            raise ValueError("A query cannot be combined with regex matching or a patterns list")
+    if json_query is not None:
+        query_search = ('json', json_query, tuple(json_fields or ()))
+        search_parameter = f"JSON query: {json_query}"
+        if json_fields:
+            search_parameter += f" (fields: {', '.join(json_fields)})"
+    elif json_fields:
+        raise ValueError("json_fields requires a json_query")
+    if query is not None:
+        query_search = ('boolean', query)
+        search_parameter = f"Query: {query}"
+    if query_search is not None:
+        # Raises ValueError for an invalid query before any file is scanned
+        compile_query_search(query_search)
+    
+    if trigram_index and bloom_index:
+        raise ValueError("The trigram index cannot be combined with Bloom filter sketches")
+    if state_dir and (trigram_index or bloom_index):
+        raise ValueError("Incremental scan state cannot be combined with an index")
+    if state_dir and time_range:
+        raise ValueError("Incremental scan state cannot be combined with a time range")
+    
+    if shared_pool is not None:
+        slot = find_counter_slot(shared_pool, counters)
+        num_processes = shared_pool["num_processes"]
+    
+    # Reset the counters
+    if counters is None:
+        counters = (TOTAL_MATCHES, TOTAL_FILES_PROCESSED, TOTAL_BYTES_PROCESSED)
+    matches_counter, files_counter, bytes_counter = counters
+    matches_counter.value = 0
+    files_counter.value = 0
+    bytes_counter.value = 0
     
     # Set default file extensions if not provided
     if file_extensions is None:
@@ -236,87 +1697,470 @@ def scan_logs_parallel(directory_path, search_parameter, output_file=None,
         output_file = f"combined_logs_{safe_param}_{timestamp}.log"
     
     # Create or clear the output file
-    with open(output_file, 'w') as out_file:
+    with open_text(output_file, 'w') as out_file:
         out_file.write(f"LOG SCAN RESULTS\n")
         out_file.write(f"Search Parameter: {search_parameter}\n")
         out_file.write(f"Directory: {directory_path}\n")
+        if time_range:
+            out_file.write(f"Time range: {format_time_range(time_range)}\n")
         out_file.write(f"Scan started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
         out_file.write(f"{'=' * 80}\n\n")
+    end_phase(profile_data, 'setup')
     
-    # Collect all matching files
-    print(f"Searching for files in {directory_path}...")
+    # Collect all matching files, with their sizes to schedule them by
     log_files = []
+    file_sizes = {}
     
-    for root, _, files in os.walk(directory_path, followlinks=follow_symlinks):
-        # Check depth limit if specified
-        if max_depth is not None:
-            relative_path = os.path.relpath(root, directory_path)
-            current_depth = 0 if relative_path == '.' else relative_path.count(os.sep) + 1
-            if current_depth > max_depth:
-                continue
+    # Nothing but the index and the scan state needs the complete list of
+    # files up front; without them files go to the pool as they are found
+    stream_discovery = file_list is None and not (trigram_index or bloom_index or state_dir)
+    
+    if file_list is not None:
+        # The caller already knows which files to scan
+        log_files = [file_path for file_path in file_list
+                     if is_log_file(file_path, file_extensions, min_file_size, max_file_size)]
+    elif stream_discovery:
+        print(f"Searching for files in {directory_path} while scanning...")
+    else:
+        print(f"Searching for files in {directory_path}...")
+        for file_path, file_size in discover_log_files(directory_path, file_extensions, follow_symlinks, max_depth,
+                                                       min_file_size, max_file_size, discovery_threads):
+            log_files.append(file_path)
+            file_sizes[file_path] = file_size
+    
+    for file_path in log_files:
+        if file_path not in file_sizes:
+            try:
+                file_sizes[file_path] = os.path.getsize(file_path)
+            except OSError:
+                # Left to the worker to report
+                file_sizes[file_path] = 0
+    
+    total_files = len(log_files)
+    if not stream_discovery:
+        print(f"Found {total_files} files to scan")
+        end_phase(profile_data, 'discovery')
         
-        for file in files:
-            file_path = os.path.join(root, file)
-            
-            # Check file extension - allow for both regular extensions and numeric extensions
-            if not (any(file.endswith(ext) for ext in file_extensions) or 
-                    (os.path.splitext(file)[1].isdigit() and os.path.splitext(os.path.splitext(file)[0])[1] in file_extensions)):
+        if total_files == 0:
+            print("No files found matching the criteria. Exiting.")
+            return output_file
+    
+    use_patterns = patterns is not None
+    
+    # Files the time catalog shows to lie outside the time range
+    outside_files = set()
+    time_catalog_data = load_time_catalog(time_catalog) if time_range and time_catalog else None
+    if time_catalog_data is not None and not stream_discovery:
+        entries = catalog_files(time_catalog_data, log_files)
+        outside_files.update(file_path for file_path, entry in entries.items()
+                             if not overlaps_time_range(entry, time_range))
+        save_time_catalog(time_catalog, time_catalog_data)
+        print(f"Time catalog skipped {len(outside_files)} of {total_files} files outside the time range")
+    
+    # The indexes and the scan state locate lines by byte offset, which
+    # compressed logs don't have; those are scanned whole
+    plain_files = [file_path for file_path in log_files
+                   if not is_compressed(file_path) and file_path not in outside_files]
+    
+    # Byte ranges to scan for the files that are not scanned whole,
+    # as (start, end, first_line) tuples
+    split_files = {}
+    skipped_files = set()
+    
+    # Narrow files to the blocks that can contain a match using the trigram index
+    if trigram_index:
+        needles = search_needles(search_parameter, use_regex, patterns, query_search)
+        if needles:
+            catalog = update_index(trigram_index, plain_files, index_block_size, num_processes)
+            candidates = find_candidate_ranges(trigram_index, plain_files, needles, catalog, split_size)
+            for file_path, ranges in candidates.items():
+                if not ranges:
+                    skipped_files.add(file_path)
+                elif ranges != [(0, catalog[file_path]["size"], 0)]:
+                    split_files[file_path] = ranges
+            print(f"Trigram index skipped {len(skipped_files)} files and narrowed {len(split_files)} files")
+        else:
+            print("The search has no literal the trigram index can narrow with; scanning everything")
+    
+    # Only scan what was appended since the last run of this search
+    if state_dir:
+        state_path = state_path_for(state_dir, search_parameter, use_regex, patterns)
+        new_ranges, new_state = plan_incremental_scan(load_state(state_path), log_files)
+        for file_path in log_files:
+            if file_path not in new_ranges:
+                skipped_files.add(file_path)
                 continue
-            
-            # Check if it's a regular file
-            if not os.path.isfile(file_path):
+            if is_compressed(file_path):
                 continue
-            
-            # Check file size constraints
-            if min_file_size is not None or max_file_size is not None:
-                try:
-                    file_size = os.path.getsize(file_path)
-                    if min_file_size is not None and file_size < min_file_size:
-                        continue
-                    if max_file_size is not None and file_size > max_file_size:
-                        continue
-                except OSError:
-                    # Skip files we can't get size for
-                    continue
-            
-            log_files.append(file_path)
+            start, end, first_line = new_ranges[file_path]
+            if split_size and end - start > split_size:
+                ranges = find_line_aligned_ranges(file_path, end, split_size, start)
+            else:
+                ranges = [(start, end)]
+            # Later ranges continue counting from the first one
+            split_files[file_path] = [
+                (range_start, range_end, first_line if range_start == start else None)
+                for range_start, range_end in ranges
+            ]
+        new_bytes = sum(end - start for start, end, _ in new_ranges.values())
+        print(f"{len(skipped_files)} files unchanged since the last run; "
+              f"scanning {new_bytes} new bytes in {len(new_ranges)} files")
     
-    total_files = len(log_files)
-    print(f"Found {total_files} files to scan")
+    # Skip files and regions whose Bloom filters rule out the searched tokens
+    if bloom_index:
+        token_sets = bloom_token_sets(search_parameter, use_regex, patterns, query_search)
+        if token_sets:
+            update_sketches(bloom_index, plain_files, bloom_region_size, num_processes)
+            candidates = find_sketch_ranges(bloom_index, plain_files, token_sets, split_size)
+            for file_path, ranges in candidates.items():
+                if ranges:
+                    split_files[file_path] = ranges
+                else:
+                    skipped_files.add(file_path)
+            print(f"Bloom filters skipped {len(skipped_files)} files and narrowed {len(split_files)} files")
+        else:
+            print("The search has no token or token affix of 3 or more characters the Bloom filters "
+                  "can check (a single word needs \\b on both sides in a regex); scanning everything")
+    
+    # Cut files above the split size into line-aligned ranges, or
+    # multi-member gzip files into ranges of members
+    if split_size:
+        for file_path in log_files:
+            if file_path in split_files or file_path in skipped_files or file_path in outside_files:
+                continue
+            file_size = file_sizes[file_path]
+            if file_size > split_size:
+                ranges = find_scan_ranges(file_path, file_size, split_size)
+                if len(ranges) > 1:
+                    split_files[file_path] = [(start, end, None) for start, end in ranges]
+    
+    def narrow_to_window(file_path, file_size):
+        """
+        Narrow a plain file, or its ranges if it is split, to the lines inside
+        time_range, marking it outside the range if none are left.
+        """
+        if file_size == 0 or is_compressed(file_path):
+            return
+        ranges = split_files.get(file_path, [(0, file_size, None)])
+        try:
+            narrowed = narrow_ranges_to_time_range(file_path, ranges, time_range, line_numbers, index_dir)
+        except OSError:
+            # Scanned as it is; the worker reports the error if it persists
+            return
+        if not narrowed:
+            outside_files.add(file_path)
+        elif narrowed != ranges:
+            split_files[file_path] = narrowed
+    
+    if time_range and not stream_discovery:
+        for file_path in plain_files:
+            if file_path not in skipped_files:
+                narrow_to_window(file_path, file_sizes[file_path])
     
-    if total_files == 0:
-        print("No files found matching the criteria. Exiting.")
-        return output_file
+    range_count = sum(len(ranges) for ranges in split_files.values())
+    if split_files:
+        print(f"Scanning {len(split_files)} files as {range_count} byte ranges")
     
     # Determine number of processes - use fewer for small numbers of files
+    whole_files = [file_path for file_path in log_files
+                   if file_path not in split_files and file_path not in skipped_files
+                   and file_path not in outside_files]
     if num_processes is None:
-        num_processes = min(multiprocessing.cpu_count(), max(1, total_files // 2))
+        if stream_discovery:
+            num_processes = multiprocessing.cpu_count()
+        else:
+            num_processes = min(multiprocessing.cpu_count(),
+                                max(1, len(whole_files) // 2) + range_count)
     
-    # Create a lock for file access
-    file_lock = multiprocessing.Manager().Lock()
+    if use_patterns:
+        search_mode = f"using multi-pattern search over {len(patterns)} patterns"
+    elif query_search is not None:
+        search_mode = 'using a JSON field query' if query_search[0] == 'json' else 'using a boolean query'
+    else:
+        search_mode = 'using regex' if use_regex else 'using string search'
+    print(f"Processing with {num_processes} processes {search_mode}")
     
-    # Prepare arguments for process_file_wrapper
-    args_list = [
-        (file_path, search_parameter, output_file, file_lock, use_regex, chunk_size)
-        for file_path in log_files
-    ]
+    # Process files in parallel without progress reporting
+    if stream_discovery:
+        print(f"Scanning files as they are found...")
+    else:
+        print(f"Scanning {total_files} files...")
     
-    print(f"Processing with {num_processes} processes {'using regex' if use_regex else 'using string search'}")
+    # Small files are scanned in batches of about the same byte size, sized
+    # to the scan when the files were listed before it started
+    whole_bytes = None if stream_discovery else sum(file_sizes[file_path] for file_path in whole_files)
+    batcher = FileBatcher(batch_size_for(whole_bytes, num_processes))
     
-    # Process files in parallel without progress reporting
-    print(f"Scanning {total_files} files...")
+    def batch_tasks(batch):
+        """The task for a batch from the batcher: none, a single file or the batch"""
+        if batch is None:
+            return []
+        batch_args, batch_bytes = batch
+        if len(batch_args) == 1:
+            return [('file', process_file_wrapper, batch_args[0], batch_bytes)]
+        return [('batch', process_batch_wrapper, tuple(batch_args), batch_bytes)]
+    
+    def file_tasks(file_path, file_size):
+        """
+        Tasks as (kind, wrapper, args, size) for one file: its ranges if it
+        is split, the file itself if it is large, or the batch it completes
+        if it is small. For ordered output the files batched so far go first,
+        so the batches keep the files in order.
+        """
+        if file_path not in split_files and file_size < batcher.small_file_size:
+            yield from batch_tasks(batcher.add((file_path, search_parameter, use_regex, chunk_size, line_numbers,
+                                                use_patterns, profile_samples, time_range, query_search), file_size))
+            return
+        if ordered_output:
+            yield from batch_tasks(batcher.flush())
+        if file_path not in split_files:
+            yield ('file', process_file_wrapper, (file_path, search_parameter, use_regex, chunk_size, line_numbers,
+                                                  use_patterns, profile_samples, time_range, query_search),
+                   file_size)
+            return
+        for range_index, (start, end, _) in enumerate(split_files[file_path]):
+            yield ('range', process_range_wrapper, (file_path, range_index, start, end, search_parameter, use_regex,
+                                                    chunk_size, line_numbers, use_patterns, profile_samples,
+                                                    time_range, query_search),
+                   end - start)
+    
+    # Tasks as (kind, wrapper, args) waiting to be submitted, largest first so
+    # the big files don't start last, or in file order for ordered output.
+    # They are numbered in the order they are submitted.
+    task_queue = TaskQueue(largest_first=not ordered_output)
+    planning_errors = []
+    
+    def plan_tasks():
+        """
+        Queue the tasks of all files to scan. Without a list of files up front
+        this runs next to the scan, queuing files as discovery finds them; a
+        split file's ranges are in split_files before its first task is
+        queued, so the writer knows them by the time its results arrive.
+        """
+        try:
+            if stream_discovery:
+                discovery_start = time.perf_counter()
+                for file_path, file_size in discover_log_files(directory_path, file_extensions, follow_symlinks,
+                                                               max_depth, min_file_size, max_file_size,
+                                                               discovery_threads):
+                    log_files.append(file_path)
+                    if (time_catalog_data is not None
+                            and not overlaps_time_range(catalog_file(time_catalog_data, file_path), time_range)):
+                        outside_files.add(file_path)
+                        continue
+                    if split_size and file_size > split_size:
+                        try:
+                            ranges = find_scan_ranges(file_path, file_size, split_size)
+                            if len(ranges) > 1:
+                                split_files[file_path] = [(start, end, None) for start, end in ranges]
+                        except OSError:
+                            # Scanned whole; the worker reports the error if it persists
+                            pass
+                    if time_range:
+                        narrow_to_window(file_path, file_size)
+                        if file_path in outside_files:
+                            continue
+                    for kind, wrapper, args, size in file_tasks(file_path, file_size):
+                        task_queue.put((kind, wrapper, args), size)
+                if time_catalog_data is not None:
+                    save_time_catalog(time_catalog, time_catalog_data)
+                if profile_data is not None:
+                    # Discovery ran alongside the scan, so its time is part of the scanning phase
+                    profile_data["phases"]["discovery"] = {"wall_seconds": time.perf_counter() - discovery_start}
+            else:
+                for file_path in log_files:
+                    if file_path not in skipped_files and file_path not in outside_files:
+                        for kind, wrapper, args, size in file_tasks(file_path, file_sizes[file_path]):
+                            task_queue.put((kind, wrapper, args), size)
+            for kind, wrapper, args, size in batch_tasks(batcher.flush()):
+                task_queue.put((kind, wrapper, args), size)
+        except Exception as e:
+            planning_errors.append(e)
+        finally:
+            task_queue.close()
+    
+    if not stream_discovery:
+        plan_tasks()
+    
+    # Per-pattern match counts, broken down by file
+    pattern_files = {}
+    
+    def add_pattern_counts(file_path, pattern_counts):
+        for pattern, count in pattern_counts.items():
+            file_counts = pattern_files.setdefault(pattern, {})
+            file_counts[file_path] = file_counts.get(file_path, 0) + count
+    
+    # Results travel from the pool to the writer through this queue. A task is
+    # only submitted once one of the in_flight slots is free, and the writer
+    # frees a slot per result it has dealt with, so results queued, waiting
+    # for their turn or still being scanned never exceed the slots.
+    results = queue.Queue()
+    in_flight = threading.Semaphore(RESULTS_IN_FLIGHT_PER_PROCESS * num_processes)
+    writer_errors = []
+    # Tasks and busy time of each worker, for the utilization report
+    worker_busy = {}
+    
+    def write_results():
+        """
+        Writer stage: the only code writing to the output file. Stitches
+        split files back together, puts sections in order if asked and
+        writes them in large batches.
+        """
+        # Results of the ranges of each split file, filled in as they come back
+        pending_ranges = {}
+        waiting = {}  # results that came back before their turn
+        next_task = 0
+        handled = 0
+        expected = None
+        buffered = []
+        buffered_size = 0
+        # Time spent handling results and, of that, writing them
+        busy_seconds = write_seconds = 0.0
+        
+        def handle(kind, result):
+            if kind == 'error':
+                raise result
+            if kind == 'batch':
+                # One worker scanned the batch's files one after the other
+                add_worker_busy(worker_busy, result[0][-1]["worker"],
+                                sum(file_result[-1]["seconds"] for file_result in result))
+                return ''.join(handle_scanned('file', file_result) for file_result in result)
+            add_worker_busy(worker_busy, result[-1]["worker"], result[-1]["seconds"])
+            return handle_scanned(kind, result)
+        
+        def handle_scanned(kind, result):
+            if kind == 'file':
+                file_path, section, pattern_counts, task_stats = result
+            else:
+                file_path, range_index, matches, newline_count, pattern_counts, task_stats = result
+                parts = pending_ranges.setdefault(file_path, [None] * len(split_files[file_path]))
+                parts[range_index] = (matches, newline_count)
+                section = ''
+                if all(part is not None for part in parts):
+                    del pending_ranges[file_path]
+                    section = format_section(file_path, stitch_range_results(parts, split_files[file_path]))
+                    with files_counter.get_lock():
+                        files_counter.value += 1
+            add_pattern_counts(file_path, pattern_counts)
+            add_task_stats(profile_data, file_path, task_stats)
+            return section
+        
+        with open_text(output_file, 'a') as out_file:
+            while expected is None or handled < expected:
+                item = results.get()
+                if item[0] is None:
+                    # All tasks are submitted; item[1] is how many
+                    expected = item[1]
+                    continue
+                
+                if ordered_output:
+                    waiting[item[0]] = item
+                    ready = []
+                    while next_task in waiting:
+                        ready.append(waiting.pop(next_task))
+                        next_task += 1
+                else:
+                    ready = [item]
+                
+                for _, kind, result in ready:
+                    handle_start = time.perf_counter()
+                    try:
+                        if not writer_errors:
+                            section = handle(kind, result)
+                            if section:
+                                buffered.append(section)
+                                buffered_size += len(section)
+                                if buffered_size >= WRITE_BUFFER_SIZE:
+                                    write_start = time.perf_counter()
+                                    out_file.write(''.join(buffered))
+                                    write_seconds += time.perf_counter() - write_start
+                                    buffered = []
+                                    buffered_size = 0
+                    except Exception as e:
+                        # Keep taking results so the scan can wind down
+                        writer_errors.append(e)
+                    handled += 1
+                    in_flight.release()
+                    busy_seconds += time.perf_counter() - handle_start
+            
+            if not writer_errors:
+                write_start = time.perf_counter()
+                out_file.write(''.join(buffered))
+                write_seconds += time.perf_counter() - write_start
+                busy_seconds += time.perf_counter() - write_start
+        
+        if profile_data is not None:
+            # The writer works while the scan runs, so its time is part of the scanning phase
+            profile_data["phases"]["writer"] = {"wall_seconds": busy_seconds, "cpu_seconds": time.thread_time(),
+                                                "write_seconds": write_seconds}
+    
+    def deliver(task_number, kind, result):
+        results.put((task_number, kind, result))
+    
+    end_phase(profile_data, 'planning')
+    
+    if shared_pool is None:
+        pool = multiprocessing.Pool(processes=num_processes, initializer=init_scan_worker,
+                                    initargs=(counters, patterns))
+    else:
+        # Tasks on the shared pool say which slot and patterns they belong to
+        pool = shared_pool["pool"]
+        patterns_digest = add_shared_patterns(shared_pool, patterns) if use_patterns else None
+    
+    scan_start = time.perf_counter()
+    writer = threading.Thread(target=write_results, daemon=True)
+    writer.start()
+    if stream_discovery:
+        threading.Thread(target=plan_tasks, daemon=True).start()
+    submitted = 0
+    try:
+        while True:
+            # Wait for a free slot, then take the largest task queued by then
+            in_flight.acquire()
+            task = task_queue.get()
+            if task is None:
+                break
+            kind, wrapper, args = task
+            if shared_pool is not None:
+                wrapper, args = run_in_slot, (slot, patterns_digest, wrapper, args)
+            pool.apply_async(wrapper, (args,),
+                             callback=partial(deliver, submitted, kind),
+                             error_callback=partial(deliver, submitted, 'error'))
+            submitted += 1
+    finally:
+        results.put((None, submitted))
+        writer.join()
+        if shared_pool is None:
+            pool.terminate()
+        elif use_patterns:
+            remove_shared_patterns(shared_pool, patterns_digest)
+    scan_seconds = time.perf_counter() - scan_start
+    
+    if planning_errors:
+        raise planning_errors[0]
+    if writer_errors:
+        raise writer_errors[0]
+    end_phase(profile_data, 'scanning')
     
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        # Wait for the process to finish its work by collecting the result
-        # This ensures that all files are processed completely
-        result = pool.map(process_file_wrapper, args_list)
+    if stream_discovery:
+        total_files = len(log_files)
+        print(f"Found {total_files} files to scan")
+        if time_catalog_data is not None:
+            print(f"Time catalog skipped {len(outside_files)} of {total_files} files outside the time range")
+        if total_files == 0:
+            print("No files found matching the criteria. Exiting.")
+            return output_file
+    
+    # Record how far each file has been scanned once the scan is complete
+    if state_dir:
+        save_state(state_path, new_state)
     
     print(f"Completed scanning all files")
     
     # Calculate statistics
-    total_matches = TOTAL_MATCHES.value
-    total_files_processed = TOTAL_FILES_PROCESSED.value
-    total_bytes_processed = TOTAL_BYTES_PROCESSED.value
+    total_matches = matches_counter.value
+    total_files_processed = files_counter.value
+    total_bytes_processed = bytes_counter.value
     elapsed_time = time.time() - start_time
     
     # Format bytes in human-readable form
@@ -327,20 +2171,76 @@ def scan_logs_parallel(directory_path, search_parameter, output_file=None,
             size_bytes /= 1024
     
     # Write summary to output file
-    with open(output_file, 'a') as out_file:
+    with open_text(output_file, 'a') as out_file:
         out_file.write(f"\n{'=' * 80}\n")
         out_file.write(f"SCAN SUMMARY\n")
         out_file.write(f"{'=' * 80}\n\n")
         out_file.write(f"Total files scanned: {total_files_processed}\n")
+        if trigram_index:
+            out_file.write(f"Files skipped by trigram index: {len(skipped_files)}\n")
+        if bloom_index:
+            out_file.write(f"Files skipped by Bloom filters: {len(skipped_files)}\n")
+        if state_dir:
+            out_file.write(f"Files unchanged since the last run: {len(skipped_files)}\n")
+        if time_catalog_data is not None:
+            out_file.write(f"Files outside the time range: {len(outside_files)}\n")
         out_file.write(f"Total data processed: {format_size(total_bytes_processed)}\n")
         out_file.write(f"Total matches found: {total_matches}\n")
         out_file.write(f"Elapsed time: {elapsed_time:.2f} seconds\n")
         out_file.write(f"Processing speed: {format_size(total_bytes_processed/max(1, elapsed_time))}/second\n")
         out_file.write(f"Scan completed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        
+        busy_lines = worker_busy_report(worker_busy, scan_seconds)
+        if busy_lines:
+            out_file.write(f"\n{'=' * 80}\n")
+            out_file.write(f"WORKER UTILIZATION\n")
+            out_file.write(f"{'=' * 80}\n\n")
+            for line in busy_lines:
+                out_file.write(f"{line}\n")
+        
+        if use_patterns:
+            out_file.write(f"\n{'=' * 80}\n")
+            out_file.write(f"MATCHES PER PATTERN\n")
+            out_file.write(f"{'=' * 80}\n\n")
+            for pattern in patterns:
+                if pattern in pattern_files:
+                    file_counts = pattern_files[pattern]
+                    out_file.write(f"{pattern}: {sum(file_counts.values())} matches "
+                                   f"in {len(file_counts)} files\n")
+            out_file.write(f"\nPatterns without matches: {len(patterns) - len(pattern_files)}\n")
+    
+    if use_patterns:
+        # Machine-readable per-pattern results, including the patterns never seen
+        with open(f"{output_file}.patterns.json", 'w') as f:
+            json.dump({
+                pattern: {
+                    "matches": sum(pattern_files.get(pattern, {}).values()),
+                    "files": pattern_files.get(pattern, {})
+                }
+                for pattern in patterns
+            }, f, indent=2)
+    end_phase(profile_data, 'summary')
+    
+    if profile_data is not None:
+        profile_file = write_report(f"{output_file}.profile.json", profile_data, {
+            "output_file": output_file,
+            "directory": directory_path,
+            "search_parameter": search_parameter,
+            "processes": num_processes,
+            "files_found": total_files,
+            "files_scanned": total_files_processed,
+            "bytes_processed": total_bytes_processed,
+            "matches_found": total_matches,
+            "elapsed_seconds": round(time.time() - start_time, 4),
+            "worker_busy": {str(worker): {"tasks": tasks, "busy_seconds": round(busy_seconds, 4)}
+                            for worker, (tasks, busy_seconds) in worker_busy.items()}
+        })
     
     # Print minimal console output
     print(f"\nScanning complete. Found {total_matches} matches across all files.")
     print(f"Results saved to: {output_file}")
+    if profile_data is not None:
+        print(f"Profile saved to: {profile_file}")
     
     return output_file
 
@@ -353,7 +2253,8 @@ def main():
     )
     parser.add_argument(
         "search_parameter", 
-        help="Text or pattern to search for in the log files"
+        nargs="?",
+        help="Text or pattern to search for in the log files (omit with --patterns-file or --json-query)"
     )
     parser.add_argument(
         "directory_path", 
@@ -379,13 +2280,14 @@ def main():
         "-c", "--chunk-size",
         type=int,
         default=100*1024*1024,  # 100MB
-        help="Chunk size in bytes for processing large files"
+        help="Window size in bytes for processing large files; lower it to reduce memory use"
     )
     parser.add_argument(
         "-e", "--extensions",
         nargs="+",
         default=[".log", ".1", ".txt"],
-        help="File extensions to scan (default: .log, .1, .txt)"
+        help="File extensions to scan (default: .log, .1, .txt); .gz, .bz2 and .xz copies "
+             "of such files are decompressed on the fly"
     )
     parser.add_argument(
         "-s", "--follow-symlinks",
@@ -410,10 +2312,147 @@ def main():
         default=None,
         help="Maximum file size in bytes to process"
     )
+    parser.add_argument(
+        "--split-size",
+        type=int,
+        default=None,
+        help="Cut files larger than this many bytes into line-aligned ranges scanned in parallel"
+    )
+    parser.add_argument(
+        "-n", "--line-numbers",
+        action="store_true",
+        help="Prefix each matching line with its line number"
+    )
+    parser.add_argument(
+        "--ordered",
+        action="store_true",
+        help="Write the matches of the files in the order the files were found"
+    )
+    parser.add_argument(
+        "--since",
+        default=None,
+        help="Only search lines from this time on: YYYY-MM-DD HH:MM[:SS], YYYY-MM-DD, or HH:MM[:SS] on each file's first day"
+    )
+    parser.add_argument(
+        "--until",
+        default=None,
+        help="Only search lines up to this time, in the same formats as --since"
+    )
+    parser.add_argument(
+        "--time-catalog",
+        default=None,
+        help="Time catalog file recording the first and last timestamp of each log; files outside --since/--until are skipped"
+    )
+    parser.add_argument(
+        "--index-dir",
+        default=DEFAULT_LINE_INDEX_DIR,
+        help=f"Directory for the line indexes numbering the matches of --since/--until (default: {DEFAULT_LINE_INDEX_DIR})"
+    )
+    parser.add_argument(
+        "--discovery-threads",
+        type=int,
+        default=DEFAULT_DISCOVERY_THREADS,
+        help=f"Directories listed at the same time while searching for files (default: {DEFAULT_DISCOVERY_THREADS})"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write a profiling report with per-phase and per-file timings to <output>.profile.json"
+    )
+    parser.add_argument(
+        "--profile-samples",
+        action="store_true",
+        help="Also sample the stacks of the worker processes for the profiling report"
+    )
+    parser.add_argument(
+        "-f", "--patterns-file",
+        default=None,
+        help="File with one literal pattern per line to search for in a single pass"
+    )
+    parser.add_argument(
+        "-j", "--json-query",
+        default=None,
+        help="Field query over JSON-lines logs to search for instead, e.g. 'level=ERROR AND user.id=42'"
+    )
+    parser.add_argument(
+        "--fields",
+        default=None,
+        help="Comma-separated fields to write for each line matching --json-query instead of the whole line"
+    )
+    parser.add_argument(
+        "-q", "--query",
+        default=None,
+        help="Boolean query to search for instead: words, \"phrases\" and /regexes/ joined by AND, OR and NOT, "
+             "e.g. 'ERROR AND (timeout OR \"connection reset\") AND NOT /retry [0-9]+/'"
+    )
+    parser.add_argument(
+        "--trigram-index",
+        default=None,
+        help="Trigram index directory; updated for the files found and used to skip blocks that cannot match"
+    )
+    parser.add_argument(
+        "--index-block-size",
+        type=int,
+        default=DEFAULT_BLOCK_SIZE,
+        help="Block size in bytes for files newly added to the trigram index"
+    )
+    parser.add_argument(
+        "--bloom-index",
+        default=None,
+        help="Bloom filter sketch directory; stale sketches are rebuilt and files or regions without the searched tokens are skipped. "
+             "A single-word search can only be checked as a whole token, e.g. --regex '\\btimeout\\b'"
+    )
+    parser.add_argument(
+        "--bloom-region-size",
+        type=int,
+        default=DEFAULT_REGION_SIZE,
+        help="Region size in bytes for files newly added to the Bloom filter sketches"
+    )
+    parser.add_argument(
+        "--state-dir",
+        default=None,
+        help="Remember how far each file was scanned for this search and only scan lines appended since the last run"
+    )
     
     args = parser.parse_args()
     
+    # With a patterns file or a query the only positional argument is the directory
+    searches = [option for option, value in (("--patterns-file", args.patterns_file),
+                                             ("--json-query", args.json_query),
+                                             ("--query", args.query)) if value]
+    if args.search_parameter is None and not searches:
+        parser.error("search_parameter is required without --patterns-file, --json-query or --query")
+    if args.search_parameter is not None and searches:
+        parser.error(f"search_parameter cannot be combined with {searches[0]}")
+    if len(searches) > 1:
+        parser.error(f"{searches[0]} cannot be combined with {searches[1]}")
+    if args.regex and (args.json_query or args.query):
+        parser.error(f"{searches[0]} cannot be combined with --regex")
+    if args.fields and not args.json_query:
+        parser.error("--fields requires --json-query")
     try:
+        if args.json_query:
+            compile_json_query(args.json_query)
+        if args.query:
+            compile_boolean_query(args.query)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.trigram_index and args.bloom_index:
+        parser.error("--trigram-index cannot be combined with --bloom-index")
+    if args.state_dir and (args.trigram_index or args.bloom_index):
+        parser.error("--state-dir cannot be combined with --trigram-index or --bloom-index")
+    try:
+        time_range = parse_time_range(args.since, args.until)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.state_dir and time_range:
+        parser.error("--state-dir cannot be combined with --since or --until")
+    if args.time_catalog and not time_range:
+        parser.error("--time-catalog requires --since or --until")
+    
+    try:
+        patterns = load_patterns_file(args.patterns_file) if args.patterns_file else None
+        
         # Call the optimized scan_logs function with provided arguments
         scan_logs_parallel(
             args.directory_path,
@@ -426,7 +2465,25 @@ def main():
             follow_symlinks=args.follow_symlinks,
             max_depth=args.max_depth,
             min_file_size=args.min_size,
-            max_file_size=args.max_size
+            max_file_size=args.max_size,
+            split_size=args.split_size,
+            line_numbers=args.line_numbers,
+            patterns=patterns,
+            trigram_index=args.trigram_index,
+            index_block_size=args.index_block_size,
+            bloom_index=args.bloom_index,
+            bloom_region_size=args.bloom_region_size,
+            state_dir=args.state_dir,
+            ordered_output=args.ordered,
+            profile=args.profile,
+            profile_samples=args.profile_samples,
+            discovery_threads=args.discovery_threads,
+            time_range=time_range,
+            time_catalog=args.time_catalog,
+            index_dir=args.index_dir,
+            json_query=args.json_query,
+            json_fields=parse_fields(args.fields) if args.fields else None,
+            query=args.query
         )
     except KeyboardInterrupt:
         print("\nScan interrupted by user.")
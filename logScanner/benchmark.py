@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Benchmark the log scanning engines against each other on the same data.
+
+A synthetic corpus is generated with loggen.py (or reused if it already
+exists with the same parameters), every engine searches it for the
+corpus's needle, and a JSON report is written with each engine's wall time,
+CPU time, peak RSS, throughput and match count. Each run happens in a fresh
+child process, so CPU time and peak RSS cover exactly one engine run with
+its worker processes.
+
+Given a report from an earlier run as --baseline, engines whose throughput
+dropped or whose peak RSS grew by more than --threshold are reported as
+regressions and the exit status is 1.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import multiprocessing
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import main as main_engine
+import main10
+import advancemain
+from loggen import add_corpus_arguments, corpus_parameters_from_args, ensure_corpus
+
+# Lines of context main10 is run with
+CONTEXT_LINES = 10
+
+RIPGREP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ripgrep')
+
+TOTAL_PREFIX = 'Total matches in this file: '
+
+
+def run_main_mmap(corpus_dir, needle, output_file, processes):
+    main_engine.scan_logs_parallel(corpus_dir, needle, output_file, use_mmap=True, num_processes=processes)
+
+
+def run_main_generator(corpus_dir, needle, output_file, processes):
+    main_engine.scan_logs_parallel(corpus_dir, needle, output_file, use_mmap=False, num_processes=processes)
+
+
+def run_main10_context(corpus_dir, needle, output_file, processes):
+    main10.scan_logs_parallel(corpus_dir, needle, output_file, num_processes=processes,
+                              context_lines=CONTEXT_LINES)
+
+
+def run_advancemain_literal(corpus_dir, needle, output_file, processes):
+    advancemain.scan_logs_parallel(corpus_dir, needle, output_file, num_processes=processes)
+
+
+def run_advancemain_regex(corpus_dir, needle, output_file, processes):
+    # The needle is the literal the regex is prefiltered with
+    advancemain.scan_logs_parallel(corpus_dir, rf"{re.escape(needle)}\b", output_file, use_regex=True,
+                                   num_processes=processes)
+
+
+def run_advancemain_regex_full(corpus_dir, needle, output_file, processes):
+    # A case-insensitive regex has no literal to prefilter with, so it runs on every line
+    advancemain.scan_logs_parallel(corpus_dir, f"(?i){re.escape(needle)}", output_file, use_regex=True,
+                                   num_processes=processes)
+
+
+def run_advancemain_patterns(corpus_dir, needle, output_file, processes):
+    advancemain.scan_logs_parallel(corpus_dir, None, output_file, patterns=[needle], num_processes=processes)
+
+
+def run_ripgrep(corpus_dir, needle, output_file, processes):
+    # The script leaves a temporary file in its working directory
+    subprocess.run(['bash', RIPGREP_SCRIPT, needle, corpus_dir, output_file],
+                   cwd=os.path.dirname(output_file), stdout=subprocess.DEVNULL, check=True)
+
+
+# Engines by name: (run function, whether it reads compressed logs)
+ENGINES = {
+    'main-mmap': (run_main_mmap, False),
+    'main-generator': (run_main_generator, False),
+    'main10-context': (run_main10_context, False),
+    'advancemain-literal': (run_advancemain_literal, True),
+    'advancemain-regex': (run_advancemain_regex, True),
+    'advancemain-regex-full': (run_advancemain_regex_full, True),
+    'advancemain-patterns': (run_advancemain_patterns, True),
+    'ripgrep': (run_ripgrep, False)
+}
+
+
+def skip_reason(engine, manifest):
+    """Why an engine can't run on a corpus here, or None if it can."""
+    _, reads_compressed = ENGINES[engine]
+    if manifest["parameters"]["compression"] != 'none' and not reads_compressed:
+        return "cannot read compressed logs"
+    if engine == 'ripgrep' and not (shutil.which('rg') and shutil.which('bash')):
+        # The script would try to install ripgrep
+        return "ripgrep (rg) or bash is not installed"
+    return None
+
+
+def count_matches(engine, output_file, corpus_dir):
+    """Number of matching lines an engine wrote to its output file."""
+    total = 0
+    with open(output_file, 'r', errors='replace') as f:
+        if engine == 'ripgrep':
+            # Matches are written as path:line:text
+            match_line = re.compile(re.escape(corpus_dir.rstrip(os.sep) + os.sep) + r'[^:]*:\d+:')
+            return sum(1 for line in f if match_line.match(line))
+        for line in f:
+            if line.startswith(TOTAL_PREFIX):
+                total += int(line[len(TOTAL_PREFIX):])
+    return total
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its largest child in MB, or None without resource."""
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    unit = 1 if sys.platform == 'darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak * unit / (1024 * 1024), 1)
+
+
+def run_engine_once(engine, corpus_dir, needle, output_file, processes):
+    """
+    Run one engine once in this process and measure it. Meant to run in a
+    fresh process (see measure_engine), whose children are its workers.
+
+    Returns:
+        dict: wall_seconds, cpu_seconds, peak_rss_mb and matches
+    """
+    run, _ = ENGINES[engine]
+    times_before = os.times()
+    start = time.perf_counter()
+    # The engines report progress on stdout
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        run(corpus_dir, needle, output_file, processes)
+    wall = time.perf_counter() - start
+    times_after = os.times()
+
+    cpu = sum(after - before for after, before in zip(times_after[:4], times_before[:4]))
+    return {
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        "peak_rss_mb": peak_rss_mb(),
+        "matches": count_matches(engine, output_file, corpus_dir)
+    }
+
+
+def measure_engine(engine, corpus_dir, needle, processes, work_dir):
+    """Run one engine once in a child process and return its measurements."""
+    output_file = os.path.join(work_dir, f"{engine}.out")
+    result_file = os.path.join(work_dir, f"{engine}.json")
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), corpus_dir, '--run-engine', engine,
+                        '--needle', needle, '--processes', str(processes),
+                        '--output-file', output_file, '--result-file', result_file],
+                       check=True)
+        with open(result_file, 'r') as f:
+            return json.load(f)
+    finally:
+        for path in (output_file, result_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def summarize_runs(runs, total_bytes):
+    """Medians of an engine's runs, its largest peak RSS and its throughput."""
+    wall = statistics.median(run["wall_seconds"] for run in runs)
+    rss = [run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None]
+    return {
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(statistics.median(run["cpu_seconds"] for run in runs), 4),
+        "peak_rss_mb": max(rss) if rss else None,
+        "mb_per_second": round(total_bytes / (1024 * 1024) / wall, 2) if wall else None,
+        "matches": runs[-1]["matches"]
+    }
+
+
+def run_benchmarks(corpus_dir, manifest, engines, processes, repeat=3, warmup=1):
+    """
+    Run every engine on the corpus warmup + repeat times.
+
+    Returns:
+        dict: The report
+    """
+    corpus_dir = os.path.abspath(corpus_dir)
+    needle = manifest["parameters"]["needle"]
+    report = {
+        "created": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "processes": processes,
+        "repeat": repeat,
+        "corpus": dict(manifest["parameters"], total_bytes=manifest["total_bytes"],
+                       total_lines=manifest["total_lines"], expected_matches=manifest["total_matches"]),
+        "engines": {}
+    }
+
+    with tempfile.TemporaryDirectory(prefix='logscan_bench_') as work_dir:
+        for engine in engines:
+            reason = skip_reason(engine, manifest)
+            if reason:
+                print(f"{engine}: skipped, {reason}")
+                report["engines"][engine] = {"status": "skipped", "reason": reason}
+                continue
+
+            runs = []
+            try:
+                for run_index in range(warmup + repeat):
+                    result = measure_engine(engine, corpus_dir, needle, processes, work_dir)
+                    if run_index >= warmup:
+                        runs.append(result)
+            except (subprocess.CalledProcessError, OSError, ValueError) as e:
+                print(f"{engine}: failed, {str(e)}")
+                report["engines"][engine] = {"status": "failed", "reason": str(e)}
+                continue
+
+            summary = summarize_runs(runs, manifest["total_bytes"])
+            summary["status"] = "ok"
+            summary["runs"] = runs
+            report["engines"][engine] = summary
+
+            check = '' if summary["matches"] == manifest["total_matches"] else \
+                f" (expected {manifest['total_matches']} matches)"
+            print(f"{engine}: {summary['mb_per_second']} MB/s, {summary['wall_seconds']}s wall, "
+                  f"{summary['cpu_seconds']}s CPU, {summary['peak_rss_mb']} MB peak RSS, "
+                  f"{summary['matches']} matches{check}")
+
+    return report
+
+
+def compare_reports(report, baseline, threshold):
+    """
+    Compare the engines of a report with a baseline report of the same corpus.
+
+    Args:
+        report (dict): Report of this run
+        baseline (dict): Earlier report
+        threshold (float): Relative change counted as a regression, e.g. 0.1
+
+    Returns:
+        list: (engine, description) of every regression
+    """
+    regressions = []
+    for engine, result in report["engines"].items():
+        before = baseline["engines"].get(engine)
+        if result["status"] != 'ok' or not before or before.get("status") != 'ok':
+            continue
+
+        speed_change = result["mb_per_second"] / before["mb_per_second"] - 1
+        line = f"{engine}: {before['mb_per_second']} -> {result['mb_per_second']} MB/s ({speed_change:+.1%})"
+        if speed_change < -threshold:
+            regressions.append((engine, f"throughput {speed_change:+.1%}"))
+
+        if result["peak_rss_mb"] and before.get("peak_rss_mb"):
+            rss_change = result["peak_rss_mb"] / before["peak_rss_mb"] - 1
+            line += f", peak RSS {before['peak_rss_mb']} -> {result['peak_rss_mb']} MB ({rss_change:+.1%})"
+            if rss_change > threshold:
+                regressions.append((engine, f"peak RSS {rss_change:+.1%}"))
+
+        if result["matches"] != before["matches"]:
+            regressions.append((engine, f"{before['matches']} matches before, {result['matches']} now"))
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the log scanning engines on a generated log corpus."
+    )
+    parser.add_argument(
+        "corpus_dir",
+        nargs='?',
+        help="Directory of the corpus; generated there unless it holds one with the same parameters"
+    )
+    add_corpus_arguments(parser)
+    parser.add_argument(
+        "--regenerate",
+        action="store_true",
+        help="Generate the corpus even if one with the same parameters is there"
+    )
+    parser.add_argument(
+        "-e", "--engines",
+        default=','.join(ENGINES),
+        help=f"Comma-separated engines to run (default: all of {', '.join(ENGINES)})"
+    )
+    parser.add_argument(
+        "-p", "--processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of processes the engines use (default: number of CPU cores)"
+    )
+    parser.add_argument(
+        "-n", "--repeat",
+        type=int,
+        default=3,
+        help="Measured runs per engine; the report has their medians (default: 3)"
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Unmeasured runs per engine before the measured ones, to warm the page cache (default: 1)"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        default='benchmark_report.json',
+        help="Report file (default: benchmark_report.json)"
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="Earlier report to compare with; regressions make the exit status 1"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative throughput drop or peak RSS growth counted as a regression (default: 0.1)"
+    )
+    # Used by measure_engine to run one engine in a child process
+    parser.add_argument("--run-engine", help=argparse.SUPPRESS)
+    parser.add_argument("--needle", help=argparse.SUPPRESS)
+    parser.add_argument("--output-file", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.run_engine:
+        result = run_engine_once(args.run_engine, args.corpus_dir, args.needle, args.output_file, args.processes)
+        with open(args.result_file, 'w') as f:
+            json.dump(result, f)
+        return
+
+    if not args.corpus_dir:
+        parser.error("corpus_dir is required")
+    engines = [engine.strip() for engine in args.engines.split(',') if engine.strip()]
+    unknown = [engine for engine in engines if engine not in ENGINES]
+    if unknown:
+        parser.error(f"Unknown engines: {', '.join(unknown)}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    manifest = ensure_corpus(args.corpus_dir, corpus_parameters_from_args(args), args.regenerate)
+    report = run_benchmarks(args.corpus_dir, manifest, engines, args.processes, args.repeat, args.warmup)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved to: {args.output}")
+
+    if baseline is not None:
+        if baseline["corpus"] != report["corpus"]:
+            print("The baseline was measured on a different corpus; not comparing")
+            sys.exit(2)
+        regressions = compare_reports(report, baseline, args.threshold)
+        for engine, description in regressions:
+            print(f"REGRESSION {engine}: {description}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
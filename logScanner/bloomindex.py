@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Per-region Bloom filter sketches of the tokens in log files.
+
+Every sketched log is cut into line-aligned regions (64MB by default) and the
+distinct tokens of each region (runs of 3 or more word characters, lowercased)
+are added to a Bloom filter sized for them. A search for a token the filter
+of a region has never seen cannot match in that region, so the region is
+skipped without being read, and a file where every region says so is not
+scanned at all.
+
+The filters also hold the first and last AFFIX_LENGTH characters of every
+token, as prefix and suffix entries. A literal like ORD-2554 has no
+complete token: ORD may be the end of a longer token in the line and 2554
+the start of one. But the token holding ORD ends with it and the one
+holding 2554 starts with it, which the affix entries can check.
+
+A sketch is a small sidecar file in a store directory, one per log, named
+after the log's absolute path:
+    SKETCH_MAGIC
+    JSON header: path, dev/inode, size, mtime, sketched size, tail checksum
+                 and regions as [start, end, newlines, num_bits, num_hashes]
+    The bit arrays of the regions, one after another
+
+Sketches are rebuilt lazily: a scan only touches logs whose size or mtime
+changed since they were sketched. When a log has only grown, all regions
+but the last are kept and only the data after them is sketched again.
+"""
+import os
+import re
+import json
+import math
+import mmap
+import zlib
+import hashlib
+import argparse
+import multiprocessing
+
+from lineindex import tail_checksum
+
+SKETCH_MAGIC = b'BLOOMSKETCH2\n'
+SKETCH_SUFFIX = '.bloom'
+DEFAULT_REGION_SIZE = 64 * 1024 * 1024
+
+# Target false positive rate of each region's filter
+FALSE_POSITIVE_RATE = 0.01
+
+# Bytes of a region tokenized at a time, to bound memory
+READ_SIZE = 16 * 1024 * 1024
+
+# Seed of the second hash; positions are h1 + i * h2 (double hashing)
+HASH_SEED = 0x9E3779B9
+
+MIN_TOKEN_LENGTH = 3
+TOKEN_RE = re.compile(rb'\w{%d,}' % MIN_TOKEN_LENGTH)
+WORD_RE = re.compile(rb'\w+')
+
+# Characters of the prefix and suffix entries of each token; the marker
+# can't appear in a token, so entries never collide with tokens
+AFFIX_LENGTH = MIN_TOKEN_LENGTH
+AFFIX_MARKER = b'*'
+
+
+def prefix_entry(token):
+    """The filter entry of the first AFFIX_LENGTH characters of a token."""
+    return token[:AFFIX_LENGTH] + AFFIX_MARKER
+
+
+def suffix_entry(token):
+    """The filter entry of the last AFFIX_LENGTH characters of a token."""
+    return AFFIX_MARKER + token[-AFFIX_LENGTH:]
+
+
+def needle_tokens(needle, bounded_start=False, bounded_end=False):
+    """
+    Return the filter entries any line containing `needle` must hold: the
+    word runs inside it as complete tokens, and for a run touching an edge
+    of the needle, which may continue past it in the line, the prefix or
+    suffix entry of the token it starts or ends. A run touching both edges
+    (a needle that is a single word, unless both edges are known to be
+    token boundaries, e.g. with \\b in a regex) gives nothing.
+
+    Args:
+        needle (bytes): Literal a matching line contains
+        bounded_start (bool): Whether the needle always starts a token
+        bounded_end (bool): Whether the needle always ends a token
+
+    Returns:
+        list: Lowercased tokens and affix entries (bytes); may be empty
+    """
+    tokens = []
+    for match in WORD_RE.finditer(needle):
+        run = match.group().lower()
+        if len(run) < MIN_TOKEN_LENGTH:
+            continue
+        starts_token = match.start() > 0 or bounded_start
+        ends_token = match.end() < len(needle) or bounded_end
+        if starts_token and ends_token:
+            tokens.append(run)
+        elif ends_token:
+            tokens.append(suffix_entry(run))
+        elif starts_token:
+            tokens.append(prefix_entry(run))
+    return tokens
+
+
+def sketch_path_for(store_dir, file_path):
+    """Return where the sketch of a log file is kept in store_dir."""
+    digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+    return os.path.join(store_dir, digest + SKETCH_SUFFIX)
+
+
+def bit_positions(token, num_bits, num_hashes):
+    """Yield the filter bits of a token."""
+    h1 = zlib.crc32(token)
+    h2 = zlib.crc32(token, HASH_SEED) | 1
+    for i in range(num_hashes):
+        yield (h1 + i * h2) % num_bits
+
+
+def might_contain(mm, offset, num_bits, num_hashes, token):
+    """Check a token against the filter whose bits start at mm[offset]."""
+    return all(mm[offset + (position >> 3)] >> (position & 7) & 1
+               for position in bit_positions(token, num_bits, num_hashes))
+
+
+def build_filter(tokens):
+    """
+    Build a Bloom filter holding `tokens`, sized for FALSE_POSITIVE_RATE.
+
+    Returns:
+        tuple: (bits, num_bits, num_hashes) where bits is a bytearray
+    """
+    num_bits = max(64, math.ceil(-len(tokens) * math.log(FALSE_POSITIVE_RATE) / math.log(2) ** 2))
+    num_bits += -num_bits % 8
+    num_hashes = max(1, round(num_bits / max(1, len(tokens)) * math.log(2)))
+
+    bits = bytearray(num_bits // 8)
+    for token in tokens:
+        for position in bit_positions(token, num_bits, num_hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+    return bits, num_bits, num_hashes
+
+
+def region_tokens(mm, start, end):
+    """
+    Return the distinct tokens of the complete lines in mm[start:end], with
+    their prefix and suffix entries.
+    """
+    tokens = set()
+    while start < end:
+        read_end = min(start + READ_SIZE, end)
+        if read_end < end:
+            newline = mm.rfind(b'\n', start, read_end)
+            if newline != -1:
+                read_end = newline + 1
+        tokens.update(TOKEN_RE.findall(mm[start:read_end].lower()))
+        start = read_end
+    affixes = {prefix_entry(token) for token in tokens}
+    affixes.update(suffix_entry(token) for token in tokens)
+    return tokens | affixes
+
+
+def read_sketch_header(sketch_path):
+    """
+    Read the header of a sketch file.
+
+    Returns:
+        tuple: (header, data_offset), or (None, 0) if the sketch is missing or unreadable
+    """
+    try:
+        with open(sketch_path, 'rb') as f:
+            if f.readline() != SKETCH_MAGIC:
+                return None, 0
+            header = json.loads(f.readline().decode('utf-8'))
+            return header, f.tell()
+    except (OSError, ValueError):
+        return None, 0
+
+
+def is_fresh(header, stat):
+    """Whether a sketch header describes the file as it is now."""
+    return (header is not None and
+            (header["dev"], header["inode"]) == (stat.st_dev, stat.st_ino) and
+            header["size"] == stat.st_size and header["mtime_ns"] == stat.st_mtime_ns)
+
+
+def sketch_file(args):
+    """
+    Build or extend the sketch of one log file. Run in a worker process.
+
+    Args:
+        args (tuple): (file_path, sketch_path, region_size)
+
+    Returns:
+        tuple: (file_path, error) where error is None on success
+    """
+    file_path, sketch_path, region_size = args
+
+    try:
+        with open(file_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            header, data_offset = read_sketch_header(sketch_path)
+
+            # Keep the regions of a log that has only grown
+            kept_regions = []
+            kept_bits = b''
+            if (header is not None and
+                    (header["dev"], header["inode"]) == (stat.st_dev, stat.st_ino) and
+                    stat.st_size >= header["sketched_size"] and
+                    tail_checksum(f, header["sketched_size"]) == header["tail_crc"]):
+                # The last region may have been cut short by the end of the data
+                region_size = header["region_size"]
+                kept_regions = header["regions"][:-1]
+                with open(sketch_path, 'rb') as sketch:
+                    sketch.seek(data_offset)
+                    kept_bits = sketch.read(sum(region[3] // 8 for region in kept_regions))
+
+            start = kept_regions[-1][1] if kept_regions else 0
+            regions = list(kept_regions)
+            bit_arrays = [kept_bits]
+
+            if stat.st_size > start:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # Only complete lines are sketched; the partial last line waits
+                    end = mm.rfind(b'\n', start, stat.st_size) + 1
+                    region_start = start
+                    while region_start < end:
+                        region_end = min(region_start + region_size, end)
+                        if region_end < end:
+                            newline = mm.rfind(b'\n', region_start, region_end)
+                            if newline == -1:
+                                # A line longer than the region; stretch to its end
+                                newline = mm.find(b'\n', region_end, end)
+                            region_end = newline + 1
+
+                        bits, num_bits, num_hashes = build_filter(region_tokens(mm, region_start, region_end))
+                        regions.append([region_start, region_end,
+                                        mm[region_start:region_end].count(b'\n'), num_bits, num_hashes])
+                        bit_arrays.append(bits)
+                        region_start = region_end
+
+            sketched_size = regions[-1][1] if regions else 0
+            header = {
+                "path": os.path.abspath(file_path),
+                "dev": stat.st_dev,
+                "inode": stat.st_ino,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sketched_size": sketched_size,
+                "tail_crc": tail_checksum(f, sketched_size),
+                "region_size": region_size,
+                "regions": regions
+            }
+
+        temp_path = f"{sketch_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as sketch:
+            sketch.write(SKETCH_MAGIC)
+            sketch.write(json.dumps(header).encode('utf-8') + b'\n')
+            for bits in bit_arrays:
+                sketch.write(bits)
+        os.replace(temp_path, sketch_path)
+        return file_path, None
+    except Exception as e:
+        return file_path, str(e)
+
+
+def prune_sketches(store_dir):
+    """Delete the sketches of logs that no longer exist."""
+    for name in os.listdir(store_dir):
+        if not name.endswith(SKETCH_SUFFIX):
+            continue
+        sketch_path = os.path.join(store_dir, name)
+        header, _ = read_sketch_header(sketch_path)
+        if header is None or not os.path.exists(header["path"]):
+            try:
+                os.remove(sketch_path)
+            except OSError:
+                pass
+
+
+def update_sketches(store_dir, file_paths, region_size=DEFAULT_REGION_SIZE, num_processes=None):
+    """
+    Sketch the given log files that are new or changed since they were last
+    sketched, and drop the sketches of logs that are gone.
+
+    Args:
+        store_dir (str): Sketch store directory (created if missing)
+        file_paths (list): Log files that should be sketched
+        region_size (int): Target region size in bytes for newly sketched files
+        num_processes (int, optional): Number of sketching processes
+
+    Returns:
+        int: Number of files (re)sketched
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    prune_sketches(store_dir)
+
+    tasks = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        sketch_path = sketch_path_for(store_dir, file_path)
+        header, _ = read_sketch_header(sketch_path)
+        if not is_fresh(header, stat):
+            tasks.append((file_path, sketch_path, region_size))
+
+    if tasks:
+        print(f"Sketching new data in {len(tasks)} files...")
+        if num_processes is None:
+            num_processes = min(multiprocessing.cpu_count(), len(tasks))
+        with multiprocessing.Pool(processes=num_processes) as pool:
+            for file_path, error in pool.imap_unordered(sketch_file, tasks):
+                if error:
+                    # Without a sketch the file is scanned whole
+                    print(f"Error sketching {file_path}: {error}")
+
+    return len(tasks)
+
+
+def find_sketch_ranges(store_dir, file_paths, token_sets, max_range_size=None):
+    """
+    Narrow each file to the regions whose filters may hold all tokens of at
+    least one of the token sets.
+
+    Args:
+        store_dir (str): Sketch store directory
+        file_paths (list): Files to narrow
+        token_sets (list): For each alternative a matching line satisfies, the
+            lowercased tokens (bytes) it contains; none may be empty
+        max_range_size (int, optional): Don't merge adjacent regions past this size
+
+    Returns:
+        dict: file_path -> list of (start, end, first_line) ranges in file order,
+              where first_line is the 0-based line number at start. Files
+              without an up-to-date sketch or where no region can be skipped
+              are left out and must be scanned whole.
+    """
+    candidates = {}
+    for file_path in file_paths:
+        sketch_path = sketch_path_for(store_dir, file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        header, data_offset = read_sketch_header(sketch_path)
+        if not is_fresh(header, stat):
+            continue
+
+        ranges = []
+        line_number = 0
+        skipped = False
+        with open(sketch_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                bits_start = data_offset
+                for start, end, newlines, num_bits, num_hashes in header["regions"]:
+                    if any(all(might_contain(mm, bits_start, num_bits, num_hashes, token) for token in tokens)
+                           for tokens in token_sets):
+                        previous = ranges[-1] if ranges else None
+                        if (previous and previous[1] == start and
+                                (max_range_size is None or end - previous[0] <= max_range_size)):
+                            ranges[-1] = (previous[0], end, previous[2])
+                        else:
+                            ranges.append((start, end, line_number))
+                    else:
+                        skipped = True
+                    line_number += newlines
+                    bits_start += num_bits // 8
+
+        if not skipped:
+            continue
+
+        # The partial last line is not sketched yet and always has to be read
+        if header["sketched_size"] < header["size"]:
+            ranges.append((header["sketched_size"], header["size"], line_number))
+
+        candidates[file_path] = ranges
+
+    return candidates
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or update Bloom filter sketches of log files, or query them."
+    )
+    parser.add_argument(
+        "store_dir",
+        help="Directory holding the sketches"
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="Log files to sketch"
+    )
+    parser.add_argument(
+        "-r", "--region-size",
+        type=int,
+        default=DEFAULT_REGION_SIZE,
+        help="Target region size in bytes for newly sketched files"
+    )
+    parser.add_argument(
+        "-p", "--processes",
+        type=int,
+        default=None,
+        help="Number of sketching processes"
+    )
+    parser.add_argument(
+        "-q", "--query",
+        default=None,
+        help="Print the regions that may contain this token after updating"
+    )
+
+    args = parser.parse_args()
+
+    update_sketches(args.store_dir, args.files, args.region_size, args.processes)
+    if args.query:
+        tokens = needle_tokens(args.query.encode('utf-8'), bounded_start=True, bounded_end=True)
+        if not tokens:
+            parser.error(f"the query has no token of at least {MIN_TOKEN_LENGTH} word characters")
+        candidates = find_sketch_ranges(args.store_dir, args.files, [tokens])
+        for file_path in args.files:
+            ranges = candidates.get(file_path)
+            if ranges is None:
+                print(f"{file_path}: not narrowed")
+            else:
+                total = sum(end - start for start, end, _ in ranges)
+                print(f"{file_path}: {len(ranges)} ranges, {total} of {os.path.getsize(file_path)} bytes")
+    else:
+        for file_path in args.files:
+            header, _ = read_sketch_header(sketch_path_for(args.store_dir, file_path))
+            if header is not None:
+                bits = sum(region[3] for region in header["regions"])
+                print(f"{file_path}: {len(header['regions'])} regions, {bits // 8} bytes of filters")
+
+
+if __name__ == "__main__":
+    main()
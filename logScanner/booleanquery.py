@@ -0,0 +1,284 @@
+"""
+Boolean line queries: terms combined with AND, OR and NOT.
+
+    ERROR AND "disk full" AND NOT /retry(ing)? [0-9]+/i
+    (timeout OR "connection reset") NOT healthcheck
+
+Terms are words, "quoted phrases" or /regexes/ (with an i after the closing
+slash to ignore case); words and phrases match as case-sensitive
+substrings of the line, like a plain search. Terms next to each other are
+joined by AND, AND binds tighter than OR, and parentheses group. The
+operators are only recognised in upper case, so `and` is a word to search
+for.
+
+A query is run like a regex with a required literal. The planner works
+out the literals every matching line must contain one of (its cover): a
+term's own text; for AND, the cheapest cover of its terms; for OR, the
+covers of all its branches together; NOT contributes none. Lines holding
+a literal of the cover are found with mm.find (or one regex of them for an
+OR), and the whole query is only checked on those lines. A cover's cost is
+estimated from how common the bytes of its literals are in log text, so
+the driver is the rarest literal rather than simply the longest. A query
+with no cover, such as NOT DEBUG, is checked on every line.
+"""
+import re
+import math
+from functools import lru_cache
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|/((?:[^/\\]|\\.)+)/(i?)|([^\s()"]+))')
+OPERATORS = ('AND', 'OR', 'NOT')
+
+# Bytes of log text from the most common to the least common, roughly; bytes
+# not listed are rarer still. Each is taken to be RANK_DECAY times as common
+# as the one before it.
+COMMON_BYTES = b' e0t1a:2oinsr-l3.5d4c96u87mp/hgfT=E_,bwyIRSANOkLDCv"P[]xMU(G)FBHqjzKVWXYQJZ'
+MOST_COMMON_FREQUENCY = 0.15
+RANK_DECAY = 0.93
+
+# Bytes of a typical line, to turn a literal's frequency per position into
+# the share of lines holding it
+TYPICAL_LINE_LENGTH = 120
+
+
+def byte_log_frequency(byte):
+    """Natural log of the estimated frequency of a byte in log text."""
+    rank = COMMON_BYTES.find(bytes([byte]))
+    if rank == -1:
+        rank = len(COMMON_BYTES)
+    return math.log(MOST_COMMON_FREQUENCY) + rank * math.log(RANK_DECAY)
+
+
+def literal_cost(literal):
+    """Estimated share of lines containing literal (bytes), at most 1."""
+    log_frequency = sum(byte_log_frequency(byte) for byte in literal)
+    return min(1.0, TYPICAL_LINE_LENGTH * math.exp(log_frequency))
+
+
+def cover_cost(cover):
+    """Estimated share of lines holding any literal of a cover; None (no cover) costs 1."""
+    if cover is None:
+        return 1.0
+    return min(1.0, sum(literal_cost(literal) for literal in cover))
+
+
+def regex_literal(pattern):
+    """
+    The literal among the top-level runs of literal characters of a
+    compiled bytes regex (which every match contains) that is cheapest by
+    literal_cost, or None.
+    """
+    if pattern.flags & re.IGNORECASE:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    runs = []
+    run = bytearray()
+    for opcode, argument in parsed:
+        if opcode == sre_parse.LITERAL:
+            run.append(argument)
+            continue
+        if opcode == sre_parse.AT:
+            # Anchors are zero-width, the run continues past them
+            continue
+        if run:
+            runs.append(bytes(run))
+            run = bytearray()
+    if run:
+        runs.append(bytes(run))
+    return min(runs, key=literal_cost) if runs else None
+
+
+def tokenize(query):
+    """
+    Split a query into '(', ')', 'AND', 'OR', 'NOT', ('literal', bytes)
+    and ('regex', pattern) tokens; raises ValueError for invalid terms.
+    """
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if match is None:
+            raise ValueError(f"Invalid query at '{query[pos:]}'; unterminated phrase or regex?")
+        open_paren, close_paren, phrase, regex, regex_flags, word = match.groups()
+        if open_paren or close_paren:
+            tokens.append(open_paren or close_paren)
+        elif phrase is not None:
+            if not phrase:
+                raise ValueError("Empty phrase in query")
+            tokens.append(('literal', re.sub(r'\\(.)', r'\1', phrase).encode('utf-8')))
+        elif regex is not None:
+            try:
+                pattern = re.compile(regex.encode('utf-8'), re.IGNORECASE if regex_flags else 0)
+            except re.error as e:
+                raise ValueError(f"Invalid regex term /{regex}/: {str(e)}")
+            tokens.append(('regex', pattern))
+        elif word in OPERATORS:
+            tokens.append(word)
+        else:
+            tokens.append(('literal', word.encode('utf-8')))
+        pos = match.end()
+    return tokens
+
+
+def parse_boolean_query(query):
+    """
+    Parse a boolean query into a tree of ('and', children), ('or', children),
+    ('not', child), ('literal', bytes) and ('regex', pattern) nodes.
+
+    Raises:
+        ValueError: For an invalid query
+    """
+    tokens = tokenize(query)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        token = peek()
+        pos += 1
+        return token
+
+    def parse_or():
+        children = [parse_and()]
+        while peek() == 'OR':
+            take()
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def parse_and():
+        children = [parse_not()]
+        while peek() not in (None, ')', 'OR'):
+            if peek() == 'AND':
+                take()
+            children.append(parse_not())
+        return children[0] if len(children) == 1 else ('and', children)
+
+    def parse_not():
+        if peek() == 'NOT':
+            take()
+            return ('not', parse_not())
+        return parse_term()
+
+    def parse_term():
+        token = take()
+        if token == '(':
+            node = parse_or()
+            if take() != ')':
+                raise ValueError("Missing ) in query")
+            return node
+        if isinstance(token, tuple):
+            return token
+        if token is None:
+            raise ValueError("Query ends where a term was expected")
+        raise ValueError(f"Expected a term in query, found {token}")
+
+    if not tokens:
+        raise ValueError("The query is empty")
+    tree = parse_or()
+    if peek() is not None:
+        raise ValueError(f"Unexpected {peek()} in query")
+    return tree
+
+
+def find_cover(node):
+    """
+    The literals every line matching node contains one of, cheapest first
+    chosen, or None if there is no such set.
+    """
+    kind = node[0]
+    if kind == 'literal':
+        return [node[1]]
+    if kind == 'regex':
+        literal = regex_literal(node[1])
+        return [literal] if literal else None
+    if kind == 'not':
+        return None
+    covers = [find_cover(child) for child in node[1]]
+    if kind == 'and':
+        covers = [cover for cover in covers if cover is not None]
+        return min(covers, key=cover_cost) if covers else None
+    if any(cover is None for cover in covers):
+        return None
+    literals = sorted({literal for cover in covers for literal in cover}, key=len)
+    # A line holding a longer literal also holds any literal inside it
+    cover = []
+    for literal in literals:
+        if not any(shorter in literal for shorter in cover):
+            cover.append(literal)
+    return cover
+
+
+def check_order(node):
+    """Sort key running cheap checks of an AND first: literals, then subqueries, then regexes."""
+    return {'literal': 0, 'regex': 2}.get(node[0], 1)
+
+
+def order_checks(node):
+    """The query tree with the children of each AND in check_order."""
+    kind = node[0]
+    if kind == 'not':
+        return ('not', order_checks(node[1]))
+    if kind in ('and', 'or'):
+        children = [order_checks(child) for child in node[1]]
+        if kind == 'and':
+            children.sort(key=check_order)
+        return (kind, children)
+    return node
+
+
+def evaluate(node, line):
+    """Whether a line (bytes) satisfies a query tree."""
+    kind = node[0]
+    if kind == 'literal':
+        return node[1] in line
+    if kind == 'regex':
+        return node[1].search(line) is not None
+    if kind == 'not':
+        return not evaluate(node[1], line)
+    if kind == 'and':
+        return all(evaluate(child, line) for child in node[1])
+    return any(evaluate(child, line) for child in node[1])
+
+
+class BooleanQuery:
+    """
+    A compiled boolean query. Used by the scan like a compiled regex:
+    needle is the literal to find candidate lines with, or prefilter a
+    regex of the literals when there are several (both None to check
+    every line), and search(line) checks a candidate line (bytes). cover
+    is the list of literals a matching line contains one of, or None.
+    """
+
+    def __init__(self, tree):
+        self.tree = order_checks(tree)
+        self.cover = find_cover(tree)
+        self.needle = self.cover[0] if self.cover and len(self.cover) == 1 else None
+        self.prefilter = None
+        if self.cover and len(self.cover) > 1:
+            self.prefilter = re.compile(b'|'.join(re.escape(literal) for literal in self.cover))
+
+    def search(self, line):
+        """Whether a line (bytes) matches the query."""
+        return evaluate(self.tree, line)
+
+
+@lru_cache(maxsize=64)
+def compile_boolean_query(query):
+    """
+    Compile and plan a boolean query. Cached, so a worker only compiles a
+    query once for all its files.
+
+    Returns:
+        BooleanQuery; raises ValueError for an invalid query
+    """
+    return BooleanQuery(parse_boolean_query(query))
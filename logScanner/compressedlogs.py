@@ -0,0 +1,255 @@
+"""
+Reading compressed rotated logs (.gz, .bz2, .xz) without unpacking them.
+
+The decompressed data is streamed in windows of whole lines, so the same
+literal, regex and multi-pattern matching used on plain logs runs over
+them with bounded memory.
+
+A gzip file can hold several members one after the other (what cat, pigz
+and bgzip produce). Each member decompresses on its own, so a large
+multi-member file is cut into ranges of whole members that are scanned in
+parallel. Like the line-aligned ranges of plain files, a range owns the
+lines that start in it: it skips the partial line it starts with and
+reads on into the following members to finish its last line.
+"""
+import os
+import bz2
+import gzip
+import lzma
+import zlib
+
+# Compressed extensions and how to open them
+COMPRESSED_OPENERS = {
+    '.gz': None,  # read member by member, see iter_gzip_members
+    '.bz2': bz2.open,
+    '.xz': lzma.open
+}
+
+# Compressed bytes read at a time
+READ_SIZE = 256 * 1024
+
+# Gzip header (ID1, ID2, deflate) and zlib's window bits for gzip data
+GZIP_MAGIC = b'\x1f\x8b\x08'
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Compressed bytes test-inflated to confirm a member start
+MEMBER_CHECK_SIZE = 64 * 1024
+
+# Compression level of gzip files written through open_text
+WRITE_COMPRESS_LEVEL = 6
+
+
+def compression_extension(file_path):
+    """The compression extension of a file name (e.g. '.gz'), or None."""
+    ext = os.path.splitext(file_path)[1].lower()
+    return ext if ext in COMPRESSED_OPENERS else None
+
+
+def is_compressed(file_path):
+    """Whether a file is one of the compressed formats read here."""
+    return compression_extension(file_path) is not None
+
+
+def strip_compression_extension(file_path):
+    """app.log.2.gz -> app.log.2; other names are returned unchanged."""
+    if is_compressed(file_path):
+        return os.path.splitext(file_path)[0]
+    return file_path
+
+
+def open_text(file_path, mode='r', **kwargs):
+    """
+    Open a file in text mode, through gzip, bz2 or lzma when its name has a
+    compression extension. Appending to a .gz file adds a gzip member, so
+    several writers taking turns still produce a valid file.
+    """
+    extension = compression_extension(file_path)
+    if extension is None:
+        return open(file_path, mode, **kwargs)
+    if extension == '.gz':
+        if mode != 'r':
+            kwargs.setdefault('compresslevel', WRITE_COMPRESS_LEVEL)
+        return gzip.open(file_path, mode + 't', **kwargs)
+    return COMPRESSED_OPENERS[extension](file_path, mode + 't', **kwargs)
+
+
+def iter_gzip_members(file_path, start=0, end=None):
+    """
+    Decompress the gzip members of a file from `start`, which must be the
+    first byte of a member, to the end of the file.
+
+    Args:
+        file_path (str): Path to the gzip file
+        start (int): Offset of the first member to read
+        end (int, optional): Offset where the range ends; members starting at
+            or after it are flagged. Must be a member boundary.
+
+    Yields:
+        tuple: (data, past_end), past_end being True for data of members
+               that start at or after end
+    """
+    with open(file_path, 'rb') as f:
+        if end is None:
+            end = os.fstat(f.fileno()).st_size
+        f.seek(start)
+
+        offset = member_start = start  # file offsets of data[0] and of the current member
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        data = b''
+
+        while True:
+            if not data:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+
+            if offset == member_start:
+                # Members can be followed by NUL padding
+                stripped = data.lstrip(b'\x00')
+                offset += len(data) - len(stripped)
+                member_start = offset
+                data = stripped
+                if not data:
+                    continue
+
+            chunk = decompressor.decompress(data)
+            rest = decompressor.unused_data if decompressor.eof else b''
+            offset += len(data) - len(rest)
+            data = rest
+
+            if chunk:
+                yield chunk, member_start >= end
+
+            if decompressor.eof:
+                if member_start < end < offset:
+                    raise ValueError(f"Offset {end} is not a gzip member boundary in {file_path}")
+                member_start = offset
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+
+        if offset > member_start:
+            raise EOFError(f"Compressed file ended before the end-of-stream marker was reached: {file_path}")
+
+
+def iter_stream(file_path):
+    """Yield the decompressed data of a .bz2 or .xz file as (data, False)."""
+    with COMPRESSED_OPENERS[compression_extension(file_path)](file_path, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            yield data, False
+
+
+def iter_compressed_windows(file_path, start=0, end=None, window_size=100*1024*1024):
+    """
+    Walk the decompressed lines of a compressed file, or of one of the member
+    ranges of a gzip file, as windows of whole lines.
+
+    A range other than the first skips the partial line it starts with, which
+    belongs to the range before it, and reads past its end to finish its last
+    line, so every line is seen by exactly one range.
+
+    Args:
+        file_path (str): Path to the compressed file
+        start (int): Offset of the range; only gzip files can start past 0
+        end (int, optional): End of the range (exclusive)
+        window_size (int): Target size of each window in decompressed bytes
+
+    Yields:
+        tuple: (data, lo, hi) where data[lo:hi] holds whole lines, as
+               iter_line_windows does for plain files
+    """
+    if compression_extension(file_path) == '.gz':
+        chunks = iter_gzip_members(file_path, start, end)
+    elif start:
+        raise ValueError(f"Only gzip files can be read from an offset: {file_path}")
+    else:
+        chunks = iter_stream(file_path)
+
+    skip_first_line = start > 0
+    parts = []
+    size = 0
+    for chunk, past_end in chunks:
+        if skip_first_line:
+            if past_end:
+                # The line the range starts in ends after it, so it owns no lines
+                return
+            newline = chunk.find(b'\n')
+            if newline == -1:
+                continue
+            chunk = chunk[newline + 1:]
+            skip_first_line = False
+
+        if past_end:
+            # Read on only to finish the range's last line
+            newline = chunk.find(b'\n')
+            if newline != -1:
+                parts.append(chunk[:newline + 1])
+                break
+
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= window_size:
+            data = b''.join(parts)
+            cut = data.rfind(b'\n') + 1
+            if cut:
+                yield data, 0, cut
+                parts = [data[cut:]]
+                size = len(parts[0])
+            else:
+                # The line is longer than the window; keep reading
+                parts = [data]
+
+    data = b''.join(parts)
+    if data:
+        yield data, 0, len(data)
+
+
+def is_member_start(f, offset):
+    """Whether a gzip member starts at offset: a valid header that inflates."""
+    f.seek(offset)
+    data = f.read(MEMBER_CHECK_SIZE)
+    # Magic, and no reserved flag bits set
+    if not data.startswith(GZIP_MAGIC) or len(data) < 10 or data[3] & 0xE0:
+        return False
+    try:
+        zlib.decompressobj(GZIP_WBITS).decompress(data)
+    except zlib.error:
+        return False
+    return True
+
+
+def find_member_start(f, pos, file_size):
+    """Offset of the first gzip member starting at or after pos, or None."""
+    while pos < file_size:
+        f.seek(pos)
+        data = f.read(READ_SIZE + len(GZIP_MAGIC) - 1)
+        found = data.find(GZIP_MAGIC)
+        while found != -1:
+            if is_member_start(f, pos + found):
+                return pos + found
+            found = data.find(GZIP_MAGIC, found + 1)
+        pos += READ_SIZE
+    return None
+
+
+def find_gzip_member_ranges(file_path, file_size, split_size):
+    """
+    Cut a multi-member gzip file into ranges of whole members of roughly
+    split_size compressed bytes, to be scanned in parallel with
+    iter_compressed_windows. A file with a single member gives one range.
+
+    Candidate boundaries are checked by inflating from them, and a range
+    raises ValueError when read if its members don't end exactly at its end.
+
+    Returns:
+        list: (start, end) tuples covering [0, file_size) in order
+    """
+    starts = [0]
+    with open(file_path, 'rb') as f:
+        while starts[-1] + split_size < file_size:
+            member_start = find_member_start(f, starts[-1] + split_size, file_size)
+            if member_start is None:
+                break
+            starts.append(member_start)
+    return list(zip(starts, starts[1:] + [file_size]))
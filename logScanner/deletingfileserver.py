@@ -1,11 +1,10 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, stream_with_context
 import os
 import re
 import uuid
 import json
 import time
 import shutil
-import zipfile
 import threading
 import tempfile
 from datetime import datetime
@@ -14,6 +13,7 @@ from werkzeug.utils import secure_filename
 # Import your log scanner module
 # Adjust the import path to match your project structure
 from logsprint import scan_logs_parallel
+from resultarchive import DEFAULT_COMPRESS_LEVEL, iter_zip_stream
 
 app = Flask(__name__)
 
@@ -56,14 +56,15 @@ def cleanup_completed_downloads():
             if current_time - info["timestamp"] >= 600:  # 10 minutes
                 try:
                     result_dir = info["result_dir"]
-                    zip_path = info["zip_path"]
+                    # Only downloads made before zips were streamed left a zip file
+                    zip_path = info.get("zip_path")
                     
                     # Try to delete the result directory
                     if os.path.exists(result_dir):
                         shutil.rmtree(result_dir, ignore_errors=True)
                     
                     # Try to delete the zip file
-                    if os.path.exists(zip_path):
+                    if zip_path and os.path.exists(zip_path):
                         os.remove(zip_path)
                     
                     # Mark this item for removal from registry
@@ -231,11 +232,13 @@ def scan_logs_api():
 @app.route('/download/<result_id>', methods=['GET'])
 def download_results(result_id):
     """
-    Download the complete scan results as a zip file.
-    Files will be automatically cleaned up after the download is complete.
+    Download the complete scan results as a zip file, streamed as it is
+    compressed. Files will be automatically cleaned up after the download is complete.
     
     Parameters:
     - result_id: ID of the scan result to download
+    - level: Compression level from 1 (fastest) to 9 (smallest), or 0 to
+      store the files uncompressed (default: 6)
     
     Returns a zip file containing all result files.
     """
@@ -245,33 +248,33 @@ def download_results(result_id):
         return jsonify({"error": "Results not found or already deleted"}), 404
     
     try:
-        # Create a zip file of results
+        level = int(request.args.get('level', DEFAULT_COMPRESS_LEVEL))
+    except ValueError:
+        return jsonify({"error": "level must be a number from 0 to 9"}), 400
+    if not 0 <= level <= 9:
+        return jsonify({"error": "level must be a number from 0 to 9"}), 400
+    
+    try:
         zip_name = f"scan_results_{result_id}.zip"
-        zip_path = os.path.join(RESULTS_DIR, zip_name)
-        
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, _, files in os.walk(result_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    zipf.write(file_path, os.path.basename(file_path))
+        file_paths = []
+        for root, _, files in os.walk(result_dir):
+            for file in sorted(files):
+                file_paths.append(os.path.join(root, file))
         
         # Add to cleanup registry for later deletion
         registry_data = load_cleanup_registry()
         registry_data[result_id] = {
             "result_dir": result_dir,
-            "zip_path": zip_path,
             "timestamp": time.time(),
             "retry_count": 0
         }
         save_cleanup_registry(registry_data)
         
-        # Send the file for download without immediate deletion
-        return send_file(
-            zip_path,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=zip_name
-        )
+        # Stream the zip without writing it to disk; the files are deleted later
+        response = Response(stream_with_context(iter_zip_stream(file_paths, level)),
+                            mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="{zip_name}"'
+        return response
     
     except Exception as e:
         return jsonify({"error": f"Error creating download: {str(e)}"}), 500
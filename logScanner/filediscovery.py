@@ -0,0 +1,135 @@
+"""
+Parallel discovery of log files.
+
+Directories are listed with os.scandir by a pool of threads, each listing
+handing the subdirectories it finds back to the pool, so a tree on a
+high-latency file system (NFS, SMB) is listed many directories at a time
+instead of one after the other. Names are checked against the extensions
+before anything is stat()ed, and the size filters use the DirEntry's stat
+(free on Windows, one call per candidate elsewhere, where isfile and
+getsize made two).
+
+Files are yielded as they are found, with their sizes, so a scan can start
+on the first files while the rest of the tree is still being listed.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from compressedlogs import strip_compression_extension
+
+# Threads listing directories at the same time; listings wait on the file
+# system rather than the CPU, so this can be well above the core count
+DEFAULT_DISCOVERY_THREADS = 16
+
+
+def is_log_name(file_name, file_extensions):
+    """
+    Whether a file name has one of the log extensions, or is a numbered
+    rotation of one (app.log.3), possibly compressed (app.log.3.gz).
+    """
+    file = strip_compression_extension(file_name)
+    if any(file.endswith(ext) for ext in file_extensions):
+        return True
+    base, extension = os.path.splitext(file)
+    return extension[1:].isdigit() and os.path.splitext(base)[1] in file_extensions
+
+
+def discover_log_files(directory_path, file_extensions, follow_symlinks=False, max_depth=None,
+                       min_file_size=None, max_file_size=None, num_threads=DEFAULT_DISCOVERY_THREADS):
+    """
+    Yield the log files under a directory as they are found, down to
+    max_depth levels below it (files directly in it are at depth 0).
+
+    The order differs from run to run. Directories that can't be listed
+    and files that can't be stat()ed are skipped. When following symlinks,
+    a directory reached twice (a link loop) is only listed once.
+
+    Args:
+        directory_path (str): Directory to search
+        file_extensions (list): Log file extensions, see is_log_name
+        follow_symlinks (bool): Whether to descend into symlinked directories
+        max_depth (int, optional): Deepest level to take files from
+        min_file_size (int, optional): Smallest file size in bytes to yield
+        max_file_size (int, optional): Largest file size in bytes to yield
+        num_threads (int): Directories listed at the same time
+
+    Yields:
+        tuple: (file_path, file_size)
+    """
+    found = queue.Queue()
+    # Directories queued or being listed; the walk is done when none are left
+    outstanding = [0]
+    outstanding_lock = threading.Lock()
+    visited = set()
+    stopped = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix='discovery')
+
+    def submit(path, depth):
+        if stopped.is_set():
+            return
+        with outstanding_lock:
+            outstanding[0] += 1
+        try:
+            executor.submit(list_directory, path, depth)
+        except RuntimeError:
+            # The executor was shut down by a consumer that stopped early
+            with outstanding_lock:
+                outstanding[0] -= 1
+
+    def list_directory(path, depth):
+        files = []
+        try:
+            if stopped.is_set():
+                return
+            if follow_symlinks:
+                # Follow each directory once, however many links lead to it
+                stat = os.stat(path)
+                with outstanding_lock:
+                    if (stat.st_dev, stat.st_ino) in visited:
+                        return
+                    visited.add((stat.st_dev, stat.st_ino))
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=follow_symlinks):
+                            if max_depth is None or depth < max_depth:
+                                submit(entry.path, depth + 1)
+                            continue
+                        if not is_log_name(entry.name, file_extensions):
+                            continue
+                        # Symlinks to files are scanned like os.path.isfile would accept them
+                        if not entry.is_file():
+                            continue
+                        file_size = entry.stat().st_size
+                    except OSError:
+                        continue
+                    if min_file_size is not None and file_size < min_file_size:
+                        continue
+                    if max_file_size is not None and file_size > max_file_size:
+                        continue
+                    files.append((entry.path, file_size))
+        except OSError:
+            pass
+        finally:
+            # Hand over this directory's files, then say whether the walk is done
+            if files:
+                found.put(files)
+            with outstanding_lock:
+                outstanding[0] -= 1
+                done = outstanding[0] == 0
+            if done:
+                found.put(None)
+
+    try:
+        submit(directory_path, 0)
+        while True:
+            files = found.get()
+            if files is None:
+                break
+            yield from files
+    finally:
+        # The consumer may stop early; let the listings still queued end quickly
+        stopped.set()
+        executor.shutdown(wait=False)
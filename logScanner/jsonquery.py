@@ -0,0 +1,206 @@
+"""
+Field queries over logs written as JSON lines.
+
+A query is one or more conditions joined by AND (only in upper case, as in
+boolean queries), each comparing a field (a dotted path into nested
+objects, e.g. user.id) with a value:
+    level=ERROR AND user.id=42 AND msg!="disk full"
+
+Parsing every line of a large log with json.loads would be far too slow,
+so a query is run like a regex with a required literal: the bytes every
+matching line must contain are found with mm.find, and only the lines
+holding them are parsed and checked field by field. A string value must
+appear quoted ("ERROR"); a number, true, false or null must appear as
+written, or at least its integer digits (42 for 42.0). Values with
+characters JSON writers may escape (quotes, backslashes, slashes, <, >,
+&, control or non-ASCII characters) and != conditions can't be looked for
+in the raw bytes; a query made only of those parses every line.
+
+Unquoted values are compared as JSON (42 matches the number 42 and the
+string "42", true matches true and "true"); quoted values only match
+strings; a value starting with = or ! must be quoted. Lines may have a prefix before the JSON object, e.g. a timestamp
+added by a log shipper. Lines that aren't JSON objects never match. Numbers
+written with an exponent in the log (4.2e1) are not found by the literal
+search and so never match a number written without one.
+"""
+import re
+import json
+from functools import lru_cache
+
+# A condition: field, operator and value, quoted as a JSON string or not.
+# An unquoted value can't start with = or !, so level==ERROR is an error
+# rather than a search for "=ERROR"
+CONDITION_RE = re.compile(r'\s*([^\s=!"]+)\s*(!=|=)\s*("(?:[^"\\]|\\.)*"|[^\s"=!][^\s"]*)\s*')
+AND_RE = re.compile(r'AND\s+')
+
+# The integer digits of a JSON number
+NUMBER_DIGITS_RE = re.compile(r'-?\d+')
+
+# Characters a JSON writer may escape; a string value holding one may be
+# written differently than it is queried
+ESCAPED_CHARS_RE = re.compile(r'["\\/<>&\x00-\x1f]|[^\x00-\x7e]')
+
+
+def parse_value(text):
+    """
+    The value of a condition, as (value, string_only): quoted values are
+    strings that only match strings, unquoted ones JSON scalars where they
+    parse as one and strings otherwise.
+    """
+    if text.startswith('"'):
+        return json.loads(text), True
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return text, True
+    if isinstance(value, (dict, list)):
+        return text, True
+    return value, False
+
+
+def parse_json_query(query):
+    """
+    Parse a JSON field query.
+
+    Args:
+        query (str): Conditions like field=value or field!=value joined by AND
+
+    Returns:
+        list: (path, negated, value, string_only, text) tuples, path being a
+              tuple of keys; raises ValueError for an invalid query
+    """
+    conditions = []
+    pos = 0
+    while True:
+        match = CONDITION_RE.match(query, pos)
+        if match is None:
+            raise ValueError(f"Invalid JSON query at '{query[pos:]}'; expected field=value or field!=value")
+        field, operator, text = match.groups()
+        try:
+            value, string_only = parse_value(text)
+        except ValueError:
+            raise ValueError(f"Invalid quoted value {text} in JSON query")
+        conditions.append((tuple(field.split('.')), operator == '!=', value, string_only, text))
+        pos = match.end()
+        if pos == len(query):
+            return conditions
+        match = AND_RE.match(query, pos)
+        if match is None:
+            raise ValueError(f"Invalid JSON query at '{query[pos:]}'; conditions are joined by AND")
+        pos = match.end()
+
+
+def parse_fields(text):
+    """The fields of a comma-separated projection list, e.g. 'ts,level,user.id'."""
+    return [field.strip() for field in text.split(',') if field.strip()]
+
+
+def value_needle(value, string_only, text):
+    """The bytes a line holding this value must contain, or None if there are none to look for."""
+    if string_only:
+        if ESCAPED_CHARS_RE.search(value):
+            return None
+        return b'"' + value.encode('utf-8') + b'"'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return NUMBER_DIGITS_RE.match(text).group().encode('ascii')
+    return text.encode('ascii')
+
+
+def field_value(record, path):
+    """
+    The value at a dotted path in a parsed record, as (found, value). A key
+    holding the dots itself is tried when the nested lookup fails.
+    """
+    value = record
+    for key in path:
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            break
+    else:
+        return True, value
+    dotted = '.'.join(path)
+    if len(path) > 1 and dotted in record:
+        return True, record[dotted]
+    return False, None
+
+
+def values_equal(actual, value, string_only, text):
+    """Whether a field's value satisfies a condition's value, see the module docstring."""
+    if isinstance(actual, str):
+        return actual == (value if string_only else text)
+    if string_only or isinstance(actual, (dict, list)):
+        return False
+    if isinstance(actual, bool) or isinstance(value, bool):
+        return actual is value
+    return actual == value
+
+
+class JsonQuery:
+    """
+    A compiled JSON field query. Used by the scan like a compiled regex:
+    needle is the literal to find candidate lines with (None to check every
+    line) and search(line) checks a candidate line (bytes). With fields,
+    project(line) renders the matching line as just those fields.
+    """
+
+    def __init__(self, conditions, fields=()):
+        self.conditions = conditions
+        self.fields = [(field, tuple(field.split('.'))) for field in fields]
+        self.needles = [needle for needle in (value_needle(value, string_only, text)
+                                              for _, negated, value, string_only, text in conditions
+                                              if not negated)
+                        if needle]
+        # The longest literal is likely the rarest
+        self.needle = max(self.needles, key=len) if self.needles else None
+
+    def parse(self, line):
+        """The JSON object on a line (bytes), or None."""
+        start = line.find(b'{')
+        if start == -1:
+            return None
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            return None
+        return record if isinstance(record, dict) else None
+
+    def search(self, line):
+        """Whether a line (bytes) matches every condition."""
+        # Lines missing any of the literals can't match, and aren't parsed
+        for needle in self.needles:
+            if needle not in line:
+                return False
+        record = self.parse(line)
+        if record is None:
+            return False
+        for path, negated, value, string_only, text in self.conditions:
+            found, actual = field_value(record, path)
+            if (found and values_equal(actual, value, string_only, text)) == negated:
+                return False
+        return True
+
+    def project(self, line):
+        """A matching line (bytes) as a JSON object of just the selected fields present in it."""
+        record = self.parse(line)
+        projected = {}
+        for field, path in self.fields:
+            found, value = field_value(record, path)
+            if found:
+                projected[field] = value
+        return json.dumps(projected, ensure_ascii=False)
+
+
+@lru_cache(maxsize=64)
+def compile_json_query(query, fields=()):
+    """
+    Compile a JSON field query, with the fields to project matching lines
+    to (a tuple; empty for the whole line). Cached, so a worker only
+    compiles a query once for all its files.
+
+    Returns:
+        JsonQuery; raises ValueError for an invalid query
+    """
+    return JsonQuery(parse_json_query(query), fields)
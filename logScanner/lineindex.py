@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Persistent line-offset index for log files.
+
+The index stores the byte offset of every `every`-th line of a file in an
+array, so the line number of any byte offset, or the byte offset of any line
+number, can be found with a binary search plus a scan of at most `every`
+lines instead of a scan from the start of the file.
+
+Indexes are saved as a sidecar file next to the log (<log>.lidx) or in a
+cache directory, keyed by the file's device/inode, size and mtime. When a log
+has only grown since it was indexed, the index is extended from where it
+stopped rather than rebuilt.
+"""
+import os
+import json
+import mmap
+import zlib
+import bisect
+import hashlib
+import argparse
+from array import array
+
+INDEX_MAGIC = b'LINEINDEX1\n'
+INDEX_SUFFIX = '.lidx'
+DEFAULT_EVERY = 1000
+
+# Bytes before the indexed size that are checksummed to detect rewrites; the
+# trigram index, the Bloom filter sketches and the scan state check them too
+TAIL_CHECK_SIZE = 4096
+
+
+def index_path_for(file_path, index_dir=None):
+    """
+    Return where the index of a log file is stored: next to the file, or in
+    index_dir under a name derived from the file's absolute path.
+    """
+    if index_dir is None:
+        return file_path + INDEX_SUFFIX
+    digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+    return os.path.join(index_dir, digest + INDEX_SUFFIX)
+
+
+def tail_checksum(f, size):
+    """
+    Checksum of the last TAIL_CHECK_SIZE bytes before `size`. A file whose
+    checksum at a recorded size is unchanged only had data appended.
+    """
+    start = max(0, size - TAIL_CHECK_SIZE)
+    f.seek(start)
+    return zlib.crc32(f.read(size - start))
+
+
+def extend_offsets(mm, pos, end, line_count, every, offsets, block_size=64*1024):
+    """
+    Walk mm[pos:end], appending to offsets the start of every line whose
+    number is a multiple of `every`. Blocks without such a line are only
+    counted; the find loop runs just inside the block holding the next one.
+
+    Args:
+        mm (mmap.mmap): Map of the file
+        pos (int): Offset of the start of line number `line_count`
+        end (int): Where to stop
+        line_count (int): Number of newlines before pos
+        every (int): Sampling interval in lines
+        offsets (array): Sampled offsets, extended in place
+        block_size (int): Bytes counted at a time
+
+    Returns:
+        int: Number of newlines before end
+    """
+    while pos < end:
+        block_end = min(pos + block_size, end)
+        needed = every - line_count % every
+        newlines = mm[pos:block_end].count(b'\n')
+
+        if newlines < needed:
+            line_count += newlines
+            pos = block_end
+            continue
+
+        # The next sampled line starts in this block
+        for _ in range(needed):
+            pos = mm.find(b'\n', pos, block_end) + 1
+        line_count += needed
+        offsets.append(pos)
+
+    return line_count
+
+
+def build_line_index(file_path, every=DEFAULT_EVERY, index=None):
+    """
+    Build the line index of a file, or extend `index` if the file has grown
+    since it was built.
+
+    Returns:
+        dict: The index, with keys dev, inode, size, mtime_ns, every,
+              line_count, tail_crc and offsets (array of 'Q')
+    """
+    stat = os.stat(file_path)
+
+    if index is None:
+        index = {
+            "every": every,
+            "size": 0,
+            "line_count": 0,
+            "offsets": array('Q', [0])
+        }
+
+    with open(file_path, 'rb') as f:
+        if stat.st_size > index["size"]:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                index["line_count"] = extend_offsets(
+                    mm, index["size"], stat.st_size, index["line_count"],
+                    index["every"], index["offsets"]
+                )
+        index["tail_crc"] = tail_checksum(f, stat.st_size)
+
+    index.update({
+        "dev": stat.st_dev,
+        "inode": stat.st_ino,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns
+    })
+    return index
+
+
+def save_line_index(index, index_file):
+    """
+    Write an index file atomically. Returns False if it can't be written,
+    e.g. because the log directory is read-only.
+    """
+    header = {key: value for key, value in index.items() if key != "offsets"}
+    temp_file = f"{index_file}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            index["offsets"].tofile(f)
+        os.replace(temp_file, index_file)
+        return True
+    except OSError:
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+        return False
+
+
+def load_saved_index(index_file):
+    """Read an index file, or return None if it is missing or unreadable."""
+    try:
+        with open(index_file, 'rb') as f:
+            if f.readline() != INDEX_MAGIC:
+                return None
+            index = json.loads(f.readline().decode('utf-8'))
+            offsets = array('Q')
+            offsets.frombytes(f.read())
+            index["offsets"] = offsets
+            return index
+    except (OSError, ValueError):
+        return None
+
+
+def get_line_index(file_path, every=DEFAULT_EVERY, index_dir=None, save=True):
+    """
+    Return an up-to-date line index for a file, reusing the saved one when
+    the file is unchanged, extending it when the file has only grown and
+    rebuilding it otherwise (rotation, truncation or a rewrite).
+
+    Args:
+        file_path (str): Path to the log file
+        every (int): Sampling interval in lines for a new index
+        index_dir (str, optional): Directory for the index instead of next to the log
+        save (bool): Whether to write the index back after building or extending it
+
+    Returns:
+        dict: The line index
+    """
+    index_file = index_path_for(file_path, index_dir)
+    index = load_saved_index(index_file)
+    stat = os.stat(file_path)
+
+    if index is not None:
+        same_file = (index["dev"], index["inode"]) == (stat.st_dev, stat.st_ino)
+        if same_file and index["size"] == stat.st_size and index["mtime_ns"] == stat.st_mtime_ns:
+            return index
+
+        # Extend only if the indexed part of the file is untouched
+        grown = same_file and stat.st_size > index["size"]
+        if grown:
+            with open(file_path, 'rb') as f:
+                grown = tail_checksum(f, index["size"]) == index["tail_crc"]
+        if not grown:
+            index = None
+
+    index = build_line_index(file_path, every, index)
+    if save:
+        if index_dir is not None:
+            os.makedirs(index_dir, exist_ok=True)
+        save_line_index(index, index_file)
+    return index
+
+
+def line_number_at(index, mm, offset):
+    """
+    Return the 0-based number of the line containing byte `offset`.
+    """
+    sample = bisect.bisect_right(index["offsets"], offset) - 1
+    start = index["offsets"][sample]
+    return sample * index["every"] + mm[start:offset].count(b'\n')
+
+
+def offset_of_line(index, mm, line_number):
+    """
+    Return the byte offset where a 0-based line number starts, or the file
+    size if the file has fewer lines.
+    """
+    sample = min(line_number // index["every"], len(index["offsets"]) - 1)
+    pos = index["offsets"][sample]
+    for _ in range(line_number - sample * index["every"]):
+        newline = mm.find(b'\n', pos)
+        if newline == -1:
+            return mm.size()
+        pos = newline + 1
+    return pos
+
+
+def read_lines(file_path, first_line, last_line, index=None, index_dir=None):
+    """
+    Read lines first_line..last_line (1-based, inclusive) of a file, seeking
+    straight to them through the line index.
+
+    Returns:
+        list: The lines, without their newlines
+    """
+    if index is None:
+        index = get_line_index(file_path, index_dir=index_dir)
+
+    lines = []
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return lines
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = offset_of_line(index, mm, first_line - 1)
+            for _ in range(first_line, last_line + 1):
+                if pos >= mm.size():
+                    break
+                line_end = mm.find(b'\n', pos)
+                if line_end == -1:
+                    line_end = mm.size()
+                lines.append(mm[pos:line_end].decode('utf-8', errors='replace'))
+                pos = line_end + 1
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build line-offset indexes for log files, or print a range of lines through one."
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="Log files to index"
+    )
+    parser.add_argument(
+        "--every",
+        type=int,
+        default=DEFAULT_EVERY,
+        help="Record the offset of every Nth line"
+    )
+    parser.add_argument(
+        "--index-dir",
+        default=None,
+        help="Directory to keep indexes in instead of next to the logs"
+    )
+    parser.add_argument(
+        "--lines",
+        default=None,
+        help="Print lines X-Y (1-based, inclusive) of each file, e.g. 1000-1020"
+    )
+
+    args = parser.parse_args()
+
+    for file_path in args.files:
+        index = get_line_index(file_path, every=args.every, index_dir=args.index_dir)
+        if args.lines:
+            first_line, _, last_line = args.lines.partition('-')
+            first_line = int(first_line)
+            last_line = int(last_line or first_line)
+            for number, line in enumerate(read_lines(file_path, first_line, last_line, index), first_line):
+                print(f"{file_path}:{number}: {line}")
+        else:
+            print(f"{file_path}: {index['line_count']} lines, "
+                  f"{len(index['offsets'])} offsets every {index['every']} lines")
+
+
+if __name__ == "__main__":
+    main()
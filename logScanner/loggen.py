@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Synthetic log corpus generator for benchmarks.
+
+Writes a directory of application-style log files (timestamp, level,
+component, request ID and a message of random words) with a chosen total
+size, number of files, line length distribution, share of lines holding a
+known needle, and compression. The same parameters and seed always give
+the same bytes, so results from different runs and machines compare.
+
+A corpus.json manifest next to the logs records the parameters, the
+needle, and the uncompressed size, line count and number of needle lines
+of each file.
+"""
+import os
+import bz2
+import gzip
+import json
+import lzma
+import random
+import argparse
+from datetime import datetime, timedelta
+
+MANIFEST_NAME = 'corpus.json'
+
+# Lines with the needle carry it as a word of their message
+DEFAULT_NEEDLE = 'BENCHMARK-ID-4242'
+
+LEVELS = ['INFO'] * 70 + ['DEBUG'] * 20 + ['WARN'] * 7 + ['ERROR'] * 3
+COMPONENTS = ['api', 'auth', 'billing', 'cache', 'db', 'gateway', 'orders', 'queue', 'scheduler', 'search']
+WORDS = ('request handled user session order payment retry timeout connection pool query cache miss hit '
+         'upstream response status latency token refresh queue message consumer producer batch commit '
+         'rollback lock acquired released worker started finished scheduled job shard replica leader '
+         'follower sync checkpoint snapshot compaction index lookup insert update delete').split()
+
+COMPRESSIONS = {
+    'none': ('', open),
+    # mtime=0 keeps the bytes the same from run to run
+    'gz': ('.gz', lambda path, mode: gzip.GzipFile(path, mode, mtime=0)),
+    'bz2': ('.bz2', bz2.open),
+    'xz': ('.xz', lzma.open)
+}
+
+# Lines generated before each write
+WRITE_BATCH_LINES = 10000
+
+
+def corpus_parameters(size_mb=256, files=8, line_length=120, line_length_spread=0.5,
+                      match_density=0.001, compression='none', seed=1, needle=DEFAULT_NEEDLE):
+    """
+    Parameters of a corpus, as stored in its manifest.
+
+    Args:
+        size_mb (float): Total uncompressed size in MB, spread evenly over the files
+        files (int): Number of log files
+        line_length (int): Median line length in bytes
+        line_length_spread (float): Sigma of the log-normal line length
+            distribution; 0 makes every line about line_length bytes
+        match_density (float): Share of lines holding the needle, from 0 to 1
+        compression (str): none, gz, bz2 or xz
+        seed (int): Seed of the random generator
+        needle (str): Word put in the matching lines
+
+    Returns:
+        dict: The parameters
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}; use one of {', '.join(COMPRESSIONS)}")
+    if not 0 <= match_density <= 1:
+        raise ValueError("match_density must be between 0 and 1")
+    return {
+        "size_mb": size_mb,
+        "files": files,
+        "line_length": line_length,
+        "line_length_spread": line_length_spread,
+        "match_density": match_density,
+        "compression": compression,
+        "seed": seed,
+        "needle": needle
+    }
+
+
+def generate_lines(rng, params, start_time, target_size):
+    """
+    Yield batches of lines of one file until target_size bytes are produced.
+
+    Yields:
+        tuple: (data, line_count, match_count) for each batch
+    """
+    line_length = params["line_length"]
+    spread = params["line_length_spread"]
+    match_density = params["match_density"]
+    needle = params["needle"]
+    # Words are drawn a line's worth at a time, then trimmed to the line length
+    words_per_line = max(1, line_length // 6)
+    produced = 0
+    line_number = 0
+    timestamp_second = None
+
+    while produced < target_size:
+        lines = []
+        matches = 0
+        for _ in range(WRITE_BATCH_LINES):
+            # Ten lines a second
+            if line_number // 10 != timestamp_second:
+                timestamp_second = line_number // 10
+                timestamp = (start_time + timedelta(seconds=timestamp_second)).strftime('%Y-%m-%d %H:%M:%S')
+            prefix = (f"{timestamp}.{line_number % 10}00 {rng.choice(LEVELS)} [{rng.choice(COMPONENTS)}] "
+                      f"req={rng.getrandbits(48):012x}")
+            line_number += 1
+            length = int(line_length * rng.lognormvariate(0, spread)) if spread else line_length
+
+            words = []
+            size = len(prefix)
+            while size < length:
+                for word in rng.choices(WORDS, k=words_per_line):
+                    words.append(word)
+                    size += len(word) + 1
+                    if size >= length:
+                        break
+            if rng.random() < match_density:
+                words.insert(rng.randint(0, len(words)), needle)
+                matches += 1
+
+            line = f"{prefix} {' '.join(words)}\n"
+            lines.append(line)
+            produced += len(line)
+            if produced >= target_size:
+                break
+
+        yield ''.join(lines).encode('utf-8'), len(lines), matches
+
+
+def generate_corpus(corpus_dir, params):
+    """
+    Write a corpus into corpus_dir, replacing the logs of an earlier one.
+
+    Returns:
+        dict: The manifest, also written to corpus_dir/corpus.json
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    extension, opener = COMPRESSIONS[params["compression"]]
+    rng = random.Random(params["seed"])
+    file_size = int(params["size_mb"] * 1024 * 1024 / params["files"])
+    start_time = datetime(2024, 1, 1)
+
+    for name in os.listdir(corpus_dir):
+        if name.startswith('app') and '.log' in name:
+            os.remove(os.path.join(corpus_dir, name))
+
+    files = []
+    for index in range(params["files"]):
+        name = f"app{index:03d}.log{extension}"
+        lines = matches = size = 0
+        with opener(os.path.join(corpus_dir, name), 'wb') as f:
+            for data, line_count, match_count in generate_lines(rng, params, start_time, file_size):
+                f.write(data)
+                size += len(data)
+                lines += line_count
+                matches += match_count
+        files.append({"name": name, "size": size, "lines": lines, "matches": matches})
+        print(f"Generated {name}: {size} bytes, {lines} lines, {matches} matching")
+
+    manifest = {
+        "parameters": params,
+        "files": files,
+        "total_bytes": sum(f["size"] for f in files),
+        "total_lines": sum(f["lines"] for f in files),
+        "total_matches": sum(f["matches"] for f in files)
+    }
+    with open(os.path.join(corpus_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(corpus_dir):
+    """The manifest of the corpus in corpus_dir, or None if there is none."""
+    try:
+        with open(os.path.join(corpus_dir, MANIFEST_NAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ensure_corpus(corpus_dir, params, regenerate=False):
+    """
+    Reuse the corpus in corpus_dir if it was generated with the same
+    parameters and its files are all there, or generate it.
+
+    Returns:
+        dict: The corpus manifest
+    """
+    manifest = load_manifest(corpus_dir)
+    if (not regenerate and manifest is not None and manifest["parameters"] == params and
+            all(os.path.isfile(os.path.join(corpus_dir, f["name"])) for f in manifest["files"])):
+        print(f"Reusing the corpus in {corpus_dir}")
+        return manifest
+    print(f"Generating a {params['size_mb']} MB corpus in {corpus_dir}...")
+    return generate_corpus(corpus_dir, params)
+
+
+def add_corpus_arguments(parser):
+    """Add the corpus parameters to an argument parser, see corpus_parameters."""
+    parser.add_argument("--size-mb", type=float, default=256, help="Total uncompressed size in MB (default: 256)")
+    parser.add_argument("--files", type=int, default=8, help="Number of log files (default: 8)")
+    parser.add_argument("--line-length", type=int, default=120, help="Median line length in bytes (default: 120)")
+    parser.add_argument("--line-length-spread", type=float, default=0.5,
+                        help="Sigma of the log-normal line length distribution, 0 for fixed lengths (default: 0.5)")
+    parser.add_argument("--match-density", type=float, default=0.001,
+                        help="Share of lines holding the needle (default: 0.001)")
+    parser.add_argument("--compression", choices=list(COMPRESSIONS), default='none',
+                        help="Compression of the log files (default: none)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+
+
+def corpus_parameters_from_args(args):
+    """corpus_parameters from arguments added with add_corpus_arguments."""
+    return corpus_parameters(args.size_mb, args.files, args.line_length, args.line_length_spread,
+                             args.match_density, args.compression, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a reproducible synthetic log corpus for benchmarks."
+    )
+    parser.add_argument(
+        "corpus_dir",
+        help="Directory to write the log files and corpus.json to"
+    )
+    add_corpus_arguments(parser)
+    parser.add_argument(
+        "--regenerate",
+        action="store_true",
+        help="Generate the corpus even if one with the same parameters is there"
+    )
+    args = parser.parse_args()
+
+    manifest = ensure_corpus(args.corpus_dir, corpus_parameters_from_args(args), args.regenerate)
+    print(f"{manifest['total_bytes']} bytes in {len(manifest['files'])} files, "
+          f"{manifest['total_lines']} lines, {manifest['total_matches']} holding '{manifest['parameters']['needle']}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,14 @@
 import os
 import re
 import mmap
+import time
 import argparse
 import multiprocessing
 from datetime import datetime
 from functools import partial
 
+from scanschedule import plan_batches, add_worker_busy, worker_busy_report
+
 def scan_file_with_mmap(file_path, search_parameter):
     """
     Scan a single file using memory-mapped I/O for efficiency.
@@ -69,6 +72,15 @@ def process_file_generator(file_path, search_parameter):
     
     return file_path, matches
 
+def process_batch(file_paths, process_func, search_parameter):
+    """
+    Scan a batch of files in one pool task.
+    Returns the results of the files, the worker's process ID and the time taken.
+    """
+    start = time.perf_counter()
+    results = [process_func(file_path, search_parameter) for file_path in file_paths]
+    return results, os.getpid(), time.perf_counter() - start
+
 def scan_logs_parallel(directory_path, search_parameter, output_file=None, use_mmap=True, num_processes=None):
     """
     Scan all log files in the directory in parallel for lines containing the search parameter
@@ -105,15 +117,34 @@ def scan_logs_parallel(directory_path, search_parameter, output_file=None, use_m
     # Choose the processing function
     process_func = scan_file_with_mmap if use_mmap else process_file_generator
     
+    # Largest files first, small files in batches of about the same size
+    file_sizes = []
+    for file_path in log_files:
+        try:
+            file_sizes.append((file_path, os.path.getsize(file_path)))
+        except OSError:
+            file_sizes.append((file_path, 0))
+    batches = plan_batches(file_sizes, max(1, num_processes))
+    
     # Process files in parallel
     print(f"Processing with {num_processes} processes {'using mmap' if use_mmap else 'using generators'}")
     
+    results = []
+    worker_busy = {}
+    scan_start = time.perf_counter()
     with multiprocessing.Pool(processes=num_processes) as pool:
         # Create a partial function with the search parameter
-        partial_func = partial(process_func, search_parameter=search_parameter)
+        partial_func = partial(process_batch, process_func=process_func, search_parameter=search_parameter)
         
-        # Process all files and collect results
-        results = pool.map(partial_func, log_files)
+        # Process all batches and collect results as workers finish them
+        for batch_results, worker, seconds in pool.imap_unordered(partial_func, batches):
+            results.extend(batch_results)
+            add_worker_busy(worker_busy, worker, seconds)
+    scan_seconds = time.perf_counter() - scan_start
+    
+    # Write the files in the order they were found
+    file_order = {file_path: index for index, file_path in enumerate(log_files)}
+    results.sort(key=lambda result: file_order[result[0]])
     
     # Write results to output file
     total_matches = 0
@@ -132,6 +163,8 @@ def scan_logs_parallel(directory_path, search_parameter, output_file=None, use_m
     
     print(f"Scanning complete. Found {total_matches} matches across all files.")
     print(f"Results saved to: {output_file}")
+    for line in worker_busy_report(worker_busy, scan_seconds):
+        print(line)
     
     return output_file
 
@@ -8,81 +8,124 @@ from datetime import datetime
 from functools import partial
 from collections import deque
 
-def scan_file_with_mmap(file_path, search_parameter, context_lines=10):
+from lineindex import get_line_index, line_number_at
+
+def count_newlines(mm, start, end, step=16*1024*1024):
+    """
+    Count newline bytes in mm[start:end] without copying more than `step`
+    bytes at a time.
+    """
+    total = 0
+    for pos in range(start, end, step):
+        total += mm[pos:min(pos + step, end)].count(b'\n')
+    return total
+
+def scan_file_with_mmap(file_path, search_parameter, context_lines=10, use_line_index=False,
+                        index_dir=None):
     """
     Scan a single file using memory-mapped I/O for efficiency.
     Returns a list of matching lines with context (lines before and after).
     
+    The file is read in a single pass: mm.find jumps from match to match,
+    line numbers are counted incrementally over the skipped bytes, and only
+    the last context_lines lines before the next match are kept in a ring
+    buffer. When matches are close together their context windows are
+    merged, so every line is emitted once: the earlier match's context after
+    stops at the next match, whose context before then starts after it.
+    
+    With use_line_index, line numbers come from the file's persistent line
+    index (see lineindex.py) instead of counting the skipped bytes.
+    
     Args:
         file_path (str): Path to the log file
         search_parameter (str): Text to search for
         context_lines (int): Number of lines to include before and after each match
+        use_line_index (bool): Whether to look line numbers up in the line index
+        index_dir (str, optional): Directory holding the line indexes
     """
     matches = []
     try:
-        with open(file_path, 'r') as f:
-            # First, read all lines of the file to build context
-            all_lines = f.readlines()
-            
+        line_index = get_line_index(file_path, index_dir=index_dir) if use_line_index else None
+        
+        with open(file_path, 'rb') as f:
             # Memory map the file for faster searching
-            f.seek(0)  # Reset file position
             with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
                 # Convert to bytes for mmap searching
                 search_bytes = search_parameter.encode('utf-8')
+                file_size = mm.size()
                 
-                # Start position for searching
+                # Lines not yet emitted that may become context before the next match
+                context_before = deque(maxlen=context_lines)
+                context_match = None
+                after_remaining = 0
+                
+                # Start of the next unread line and its 0-based line number
                 current_pos = 0
+                line_number = 0
                 
-                # Find each occurrence
-                while True:
+                while current_pos < file_size:
                     found_pos = mm.find(search_bytes, current_pos)
-                    if found_pos == -1:
-                        break
                     
                     # Find the start of the line containing match
-                    line_start = mm.rfind(b'\n', 0, found_pos)
-                    if line_start == -1:  # If not found, start of file
-                        line_start = 0
+                    if found_pos == -1:
+                        line_start = file_size
                     else:
-                        line_start += 1  # Skip the newline character
+                        line_start = mm.rfind(b'\n', current_pos, found_pos)
+                        if line_start == -1:  # If not found, start of the unread part
+                            line_start = current_pos
+                        else:
+                            line_start += 1  # Skip the newline character
+                    
+                    # Fill the context after the previous match, up to this match at most
+                    while after_remaining and current_pos < line_start:
+                        line_end = mm.find(b'\n', current_pos, line_start)
+                        if line_end == -1:  # If not found, end of file
+                            line_end = line_start
+                        context_match['context_after'].append(
+                            mm[current_pos:line_end].decode('utf-8', errors='replace'))
+                        current_pos = line_end + 1
+                        line_number += 1
+                        after_remaining -= 1
+                    
+                    if found_pos == -1:
+                        break
+                    
+                    # Skip the lines up to the match, keeping the last few as context
+                    if current_pos < line_start:
+                        tail = []
+                        line_end = line_start - 1
+                        while len(tail) < context_lines and line_end >= current_pos:
+                            tail_start = mm.rfind(b'\n', current_pos, line_end)
+                            tail_start = current_pos if tail_start == -1 else tail_start + 1
+                            tail.append(mm[tail_start:line_end].decode('utf-8', errors='replace'))
+                            line_end = tail_start - 1
+                        context_before.extend(reversed(tail))
+                        
+                        if line_index is not None:
+                            line_number = line_number_at(line_index, mm, line_start)
+                        else:
+                            line_number += count_newlines(mm, current_pos, line_start)
+                        current_pos = line_start
                     
                     # Find the end of the line
                     line_end = mm.find(b'\n', found_pos)
                     if line_end == -1:  # If not found, end of file
-                        line_end = mm.size()
-                    
-                    # Extract the line and decode to string
-                    matched_line = mm[line_start:line_end].decode('utf-8', errors='replace')
-                    
-                    # Determine line number for the matched line
-                    # Count newlines up to the start of the match
-                    line_count = mm[:line_start].count(b'\n')
-                    match_line_number = line_count
+                        line_end = file_size
                     
                     # Build context for this match
                     context_match = {
-                        'match_line': matched_line,
-                        'match_line_number': match_line_number,
-                        'context_before': [],
+                        'match_line': mm[line_start:line_end].decode('utf-8', errors='replace'),
+                        'match_line_number': line_number,
+                        'context_before': list(context_before),
                         'context_after': []
                     }
-                    
-                    # Add lines before the match
-                    start_line = max(0, match_line_number - context_lines)
-                    for i in range(start_line, match_line_number):
-                        if i < len(all_lines):
-                            context_match['context_before'].append(all_lines[i].rstrip('\n'))
-                    
-                    # Add lines after the match
-                    end_line = min(len(all_lines), match_line_number + context_lines + 1)
-                    for i in range(match_line_number + 1, end_line):
-                        if i < len(all_lines):
-                            context_match['context_after'].append(all_lines[i].rstrip('\n'))
-                    
                     matches.append(context_match)
+                    context_before.clear()
+                    after_remaining = context_lines
                     
-                    # Move to position after current match
-                    current_pos = found_pos + 1
+                    # Move to the line after the match
+                    current_pos = line_end + 1
+                    line_number += 1
     
     except Exception as e:
         print(f"Error processing {file_path}: {str(e)}")
@@ -94,34 +137,37 @@ def process_file_generator(file_path, search_parameter, context_lines=10):
     Process a file using generators for memory efficiency.
     Alternative to mmap for certain cases.
     Includes context lines before and after matches.
+    
+    Lines are read one at a time; only the last context_lines lines are kept
+    in a ring buffer, and overlapping context windows are merged the same
+    way as in scan_file_with_mmap.
     """
     matches = []
     try:
         with open(file_path, 'r') as f:
-            # First, read all lines of the file to build context
-            all_lines = list(f)
+            context_before = deque(maxlen=context_lines)
+            context_match = None
+            after_remaining = 0
             
             # Search for matches
-            for i, line in enumerate(all_lines):
+            for i, line in enumerate(f):
+                line = line.rstrip('\n')
                 if search_parameter in line:
                     context_match = {
-                        'match_line': line.rstrip('\n'),
+                        'match_line': line,
                         'match_line_number': i,
-                        'context_before': [],
+                        'context_before': list(context_before),
                         'context_after': []
                     }
-                    
-                    # Add lines before the match
-                    start_line = max(0, i - context_lines)
-                    for j in range(start_line, i):
-                        context_match['context_before'].append(all_lines[j].rstrip('\n'))
-                    
-                    # Add lines after the match
-                    end_line = min(len(all_lines), i + context_lines + 1)
-                    for j in range(i + 1, end_line):
-                        context_match['context_after'].append(all_lines[j].rstrip('\n'))
-                    
                     matches.append(context_match)
+                    context_before.clear()
+                    after_remaining = context_lines
+                elif after_remaining:
+                    # Add lines after the match
+                    context_match['context_after'].append(line)
+                    after_remaining -= 1
+                else:
+                    context_before.append(line)
     
     except Exception as e:
         print(f"Error processing {file_path}: {str(e)}")
@@ -129,7 +175,7 @@ def process_file_generator(file_path, search_parameter, context_lines=10):
     return file_path, matches
 
 def scan_logs_parallel(directory_path, search_parameter, output_file=None, use_mmap=True, 
-                      num_processes=None, context_lines=10):
+                      num_processes=None, context_lines=10, use_line_index=False, index_dir=None):
     """
     Scan all log files in the directory in parallel for lines containing the search parameter
     and combine them into a single output file. Includes context lines before and after matches.
@@ -141,6 +187,8 @@ def scan_logs_parallel(directory_path, search_parameter, output_file=None, use_m
         use_mmap (bool): Whether to use mmap for file processing
         num_processes (int, optional): Number of processes to use. If None, uses CPU count.
         context_lines (int): Number of lines to include before and after each match
+        use_line_index (bool): Whether to use persistent line indexes for line numbers (mmap only)
+        index_dir (str, optional): Directory for the line indexes instead of next to the logs
     
     Returns:
         str: Path to the output file
@@ -172,6 +220,8 @@ def scan_logs_parallel(directory_path, search_parameter, output_file=None, use_m
     with multiprocessing.Pool(processes=num_processes) as pool:
         # Create a partial function with the search parameter and context lines
         partial_func = partial(process_func, search_parameter=search_parameter, context_lines=context_lines)
+        if use_mmap:
+            partial_func = partial(partial_func, use_line_index=use_line_index, index_dir=index_dir)
         
         # Process all files and collect results
         results = pool.map(partial_func, log_files)
@@ -257,6 +307,16 @@ def main():
         default=10,
         help="Number of context lines to include before and after matches (default: 10)"
     )
+    parser.add_argument(
+        "--line-index",
+        action="store_true",
+        help="Keep a persistent line-offset index per log and use it for line numbers"
+    )
+    parser.add_argument(
+        "--index-dir",
+        default=None,
+        help="Directory to keep line indexes in (default: next to each log)"
+    )
     
     args = parser.parse_args()
     
@@ -274,7 +334,9 @@ def main():
         args.output,
         use_mmap=not args.no_mmap,
         num_processes=args.processes,
-        context_lines=args.context
+        context_lines=args.context,
+        use_line_index=args.line_index,
+        index_dir=args.index_dir
     )
 
 if __name__ == "__main__":
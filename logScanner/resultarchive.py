@@ -0,0 +1,124 @@
+"""
+Streaming downloads of scan results.
+
+Archives are generated while they are sent rather than written to disk
+first, so a download starts right away and takes no extra disk space:
+
+- A zip archive of the result files, deflated at a chosen level. Files
+  already stored gzip-compressed go into it as they are.
+- A single gzip stream of the result files one after the other. Files
+  already stored gzip-compressed are copied without recompression, since
+  concatenated gzip members are a valid gzip stream.
+"""
+import os
+import gzip
+import zlib
+import zipfile
+
+from compressedlogs import compression_extension
+
+# Compression level of downloads, from 1 (fastest) to 9 (smallest)
+DEFAULT_COMPRESS_LEVEL = 6
+
+# Bytes read from a result file at a time
+READ_SIZE = 1024 * 1024
+
+
+class StreamSink:
+    """
+    Write-only file for zipfile that keeps what is written until it is
+    drained into the response. It has no tell(), so zipfile writes data
+    descriptors after each file instead of seeking back to its header.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip_stream(file_paths, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """
+    Yield a zip archive of the given files, named by their base names, as
+    it is built.
+
+    Args:
+        file_paths (list): Files to put in the archive, in order
+        compress_level (int): Deflate level, or 0 to store the files
+
+    Yields:
+        bytes: The next part of the archive
+    """
+    sink = StreamSink()
+    compression = zipfile.ZIP_DEFLATED if compress_level else zipfile.ZIP_STORED
+    with zipfile.ZipFile(sink, 'w', compression=compression, compresslevel=compress_level or None) as zipf:
+        for file_path in file_paths:
+            if compression_extension(file_path) is None:
+                # Opened by name, an entry takes the archive's compression and level
+                entry = os.path.basename(file_path)
+            else:
+                # Compressed files are stored as they are
+                entry = zipfile.ZipInfo.from_file(file_path, os.path.basename(file_path))
+                entry.compress_type = zipfile.ZIP_STORED
+
+            # force_zip64 as the size isn't known up front
+            with open(file_path, 'rb') as src, zipf.open(entry, 'w', force_zip64=True) as dest:
+                while True:
+                    data = src.read(READ_SIZE)
+                    if not data:
+                        break
+                    dest.write(data)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+
+    # The central directory, written when the archive is closed
+    yield sink.drain()
+
+
+def iter_gzip_stream(file_paths, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """
+    Yield one gzip stream holding the given files one after the other.
+    Each plain file becomes a gzip member of its own; .gz files are copied.
+    """
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            if compression_extension(file_path) == '.gz':
+                while True:
+                    data = f.read(READ_SIZE)
+                    if not data:
+                        break
+                    yield data
+                continue
+
+            compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            while True:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                data = compressor.compress(data)
+                if data:
+                    yield data
+            yield compressor.flush()
+
+
+def iter_decompressed_file(file_path):
+    """Yield the decompressed contents of a .gz file, for clients that can't take gzip."""
+    with gzip.open(file_path, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            yield data
+
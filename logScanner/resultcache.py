@@ -0,0 +1,229 @@
+"""
+Result cache for the scan API.
+
+A scan result is reused when the same search is run again over the same
+directory. Each cached result is recorded in an index under the results
+directory with a fingerprint (size, mtime and inode) of every file in the
+scanned directory:
+
+- If no fingerprint changed, the earlier result is returned as it is.
+- If only some files changed, the per-file sections of the earlier result
+  can be copied for the unchanged files, and only the others are scanned.
+"""
+import os
+import json
+import hashlib
+import threading
+
+from compressedlogs import open_text
+
+CACHE_INDEX_NAME = 'cache_index.json'
+
+SEPARATOR_LINE = '=' * 80 + '\n'
+SECTION_PREFIX = 'MATCHES FROM: '
+SUMMARY_LINE = 'SCAN SUMMARY\n'
+TOTAL_PREFIX = 'Total matches in this file: '
+
+# Part of a result file holding the scan summary, see iter_result_lines
+SUMMARY_PART = object()
+
+# Serialises updates of the cache index from concurrent requests
+CACHE_LOCK = threading.Lock()
+
+
+def fingerprint_directory(directory_path):
+    """
+    Fingerprint every regular file under a directory.
+
+    Returns:
+        dict: file_path -> [size, mtime_ns, inode], with paths as os.walk
+              builds them, so they match the paths in scan results
+    """
+    fingerprints = {}
+    for root, _, files in os.walk(directory_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            fingerprints[file_path] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+    return fingerprints
+
+
+def cache_key(directory_path, search_parameter, patterns, options):
+    """Key of a scan: what is searched for, where and with which output options."""
+    query = json.dumps([os.path.abspath(directory_path), search_parameter, patterns, options],
+                       sort_keys=True)
+    return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+
+def load_cache_index(results_dir):
+    """Read the cache index, or return an empty one."""
+    try:
+        with open(os.path.join(results_dir, CACHE_INDEX_NAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache_index(results_dir, index):
+    """Write the cache index atomically."""
+    index_path = os.path.join(results_dir, CACHE_INDEX_NAME)
+    temp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_path, index_path)
+
+
+def find_cached_result(results_dir, key, fingerprints):
+    """
+    Look a scan up in the cache.
+
+    Args:
+        results_dir (str): Directory holding the results and the cache index
+        key (str): Key of the scan from cache_key
+        fingerprints (dict): Current fingerprints from fingerprint_directory
+
+    Returns:
+        tuple: (result_id, unchanged_files, exact). result_id is None on a
+               miss; unchanged_files is the set of files whose fingerprint
+               is the same as when the result was made; exact is True when
+               the directory is exactly as it was.
+    """
+    with CACHE_LOCK:
+        entry = load_cache_index(results_dir).get(key)
+
+    if entry is None or not os.path.isdir(os.path.join(results_dir, entry["result_id"])):
+        return None, set(), False
+
+    cached = entry["fingerprints"]
+    unchanged_files = {file_path for file_path, fingerprint in fingerprints.items()
+                       if cached.get(file_path) == fingerprint}
+    exact = len(unchanged_files) == len(fingerprints) == len(cached)
+    return entry["result_id"], unchanged_files, exact
+
+
+def record_result(results_dir, key, result_id, fingerprints):
+    """Make result_id the cached result of a scan."""
+    with CACHE_LOCK:
+        index = load_cache_index(results_dir)
+        index[key] = {"result_id": result_id, "fingerprints": fingerprints}
+        save_cache_index(results_dir, index)
+
+
+def prune_cache_index(results_dir):
+    """Drop cache entries whose result directory is gone."""
+    with CACHE_LOCK:
+        index = load_cache_index(results_dir)
+        live = {key: entry for key, entry in index.items()
+                if os.path.isdir(os.path.join(results_dir, entry["result_id"]))}
+        if len(live) != len(index):
+            save_cache_index(results_dir, live)
+
+
+def iter_result_lines(result_file):
+    """
+    Yield the lines of a scan result file written by advancemain, each with
+    the part of the file it belongs to: None for the header, the scanned
+    file's path inside its MATCHES FROM section, or SUMMARY_PART.
+
+    The two lines opening a part (a blank line and a separator) are only
+    tagged once the line after them shows which part they open.
+    """
+    part = None
+    held = []
+    with open_text(result_file, 'r', errors='replace') as f:
+        for line in f:
+            if (part is not SUMMARY_PART and held == ['\n', SEPARATOR_LINE] and
+                    (line.startswith(SECTION_PREFIX) or line == SUMMARY_LINE)):
+                if line == SUMMARY_LINE:
+                    part = SUMMARY_PART
+                else:
+                    part = line[len(SECTION_PREFIX):].rstrip('\n')
+                for held_line in held:
+                    yield part, held_line
+                held = []
+                yield part, line
+                continue
+
+            held.append(line)
+            if len(held) > 2:
+                yield part, held.pop(0)
+
+    for held_line in held:
+        yield part, held_line
+
+
+def merge_cached_result(output_file, cached_file, reused_files, cached_result_id):
+    """
+    Add the sections of the reused files from a cached result file to a
+    result file that only covers the other files. The reused sections go
+    before the summary, which gets a note about what was reused.
+
+    Args:
+        output_file (str): Result of scanning the changed files, rewritten in place
+        cached_file (str): The cached result file of the same scan
+        reused_files (set): Files whose sections are copied from cached_file
+        cached_result_id (str): ID of the cached result, for the note
+
+    Returns:
+        tuple: (reused_sections, reused_matches)
+    """
+    # Keep the extension, so a compressed result is read back as one
+    partial_file = os.path.join(os.path.dirname(output_file), f"partial_{os.path.basename(output_file)}")
+    os.replace(output_file, partial_file)
+
+    reused_sections = reused_matches = 0
+    with open_text(output_file, 'w') as out_file:
+        summary = []
+        for part, line in iter_result_lines(partial_file):
+            if part is SUMMARY_PART:
+                summary.append(line)
+            else:
+                out_file.write(line)
+
+        for part, line in iter_result_lines(cached_file):
+            if part in reused_files:
+                out_file.write(line)
+                if line.startswith(TOTAL_PREFIX):
+                    reused_sections += 1
+                    reused_matches += int(line[len(TOTAL_PREFIX):])
+
+        if not summary:
+            # Nothing was left to scan, so the engine wrote no summary
+            summary = ['\n', SEPARATOR_LINE, SUMMARY_LINE, SEPARATOR_LINE, '\n', 'Total files scanned: 0\n']
+        out_file.writelines(summary)
+        out_file.write(f"\nReused from cached result {cached_result_id}: "
+                       f"{len(reused_files)} unchanged files, {reused_matches} matches "
+                       f"in {reused_sections} files (not included in the totals above)\n")
+
+    os.remove(partial_file)
+    return reused_sections, reused_matches
+
+
+def merge_cached_pattern_counts(counts_file, cached_counts_file, reused_files, patterns):
+    """
+    Add the per-pattern counts of the reused files from a cached
+    <output>.patterns.json to the one of the changed files (which is missing
+    if no changed file was scanned), rewriting counts_file.
+    """
+    counts = {}
+    for path in (cached_counts_file, counts_file):
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            for pattern, result in json.load(f).items():
+                files = counts.setdefault(pattern, {})
+                for file_path, count in result["files"].items():
+                    if path == counts_file or file_path in reused_files:
+                        files[file_path] = count
+
+    with open(counts_file, 'w') as f:
+        json.dump({
+            pattern: {
+                "matches": sum(counts.get(pattern, {}).values()),
+                "files": counts.get(pattern, {})
+            }
+            for pattern in patterns
+        }, f, indent=2)
@@ -0,0 +1,172 @@
+"""
+Scan statistics for monitoring, in the Prometheus text exposition format.
+
+Workers of a shared pool count what they scan in local variables and copy
+the totals to their own row of a shared table every few seconds and after
+each task (see advancemain.flush_worker_stats). Nothing is locked on the
+way, as each row has a single writer; the service reads the table when it
+is scraped. Request latencies are kept in histograms in the service itself.
+"""
+import bisect
+import threading
+import multiprocessing
+
+# What every worker counts, in the order of the columns of the table
+WORKER_STAT_FIELDS = ('bytes', 'lines', 'matches', 'files', 'tasks',
+                      'busy_seconds', 'io_wait_seconds', 'decode_seconds')
+
+WORKER_STAT_HELP = {
+    'bytes': 'Bytes of log data scanned by the worker',
+    'lines': 'Lines scanned by the worker, counted for scans that number lines',
+    'matches': 'Matching lines found by the worker',
+    'files': 'Whole files scanned by the worker',
+    'tasks': 'Files and file ranges scanned by the worker',
+    'busy_seconds': 'Time the worker spent running scan tasks',
+    'io_wait_seconds': 'Time the worker spent mapping, reading or decompressing log data',
+    'decode_seconds': 'Time the worker spent decoding matching lines'
+}
+
+# Table rows per pool process, so workers replacing ones that died get rows of their own
+WORKER_ROWS_PER_PROCESS = 2
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def new_worker_stats_table(num_processes):
+    """
+    Shared table the workers of a pool write their statistics to, to be
+    handed to every worker when the pool starts.
+
+    Returns:
+        dict: The table, for claim_worker_row and read_worker_stats
+    """
+    rows = num_processes * WORKER_ROWS_PER_PROCESS
+    return {
+        "values": multiprocessing.RawArray('d', rows * len(WORKER_STAT_FIELDS)),
+        "rows_claimed": multiprocessing.Value('i', 0),
+        "rows": rows
+    }
+
+
+def claim_worker_row(table):
+    """Claim the next free row of the table for a worker, or None if all are taken."""
+    with table["rows_claimed"].get_lock():
+        row = table["rows_claimed"].value
+        if row >= table["rows"]:
+            return None
+        table["rows_claimed"].value += 1
+    return row
+
+
+def write_worker_row(table, row, stats):
+    """Copy a worker's totals (a dict of WORKER_STAT_FIELDS) to its row."""
+    values = table["values"]
+    base = row * len(WORKER_STAT_FIELDS)
+    for column, field in enumerate(WORKER_STAT_FIELDS):
+        values[base + column] = stats[field]
+
+
+def read_worker_stats(table):
+    """
+    The totals of every worker that has claimed a row.
+
+    Returns:
+        list: One dict of WORKER_STAT_FIELDS per worker, by row
+    """
+    values = table["values"]
+    width = len(WORKER_STAT_FIELDS)
+    return [dict(zip(WORKER_STAT_FIELDS, values[row * width:(row + 1) * width]))
+            for row in range(min(table["rows_claimed"].value, table["rows"]))]
+
+
+def format_labels(labels):
+    """{'endpoint': 'scan'} -> '{endpoint="scan"}', or '' without labels."""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    """Whole numbers without a decimal point, other values as they are."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_metric(name, help_text, kind, samples):
+    """
+    Render one metric.
+
+    Args:
+        name (str): Metric name
+        help_text (str): Description for the HELP line
+        kind (str): counter or gauge
+        samples (list): (labels, value) pairs
+
+    Returns:
+        list: Lines of the exposition format
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+    return lines
+
+
+def render_worker_stats(table):
+    """Render the totals of every worker as counters labelled by worker."""
+    workers = read_worker_stats(table)
+    lines = []
+    for field in WORKER_STAT_FIELDS:
+        lines += render_metric(f"logscanner_worker_{field}_total", WORKER_STAT_HELP[field], 'counter',
+                               [({"worker": row}, stats[field]) for row, stats in enumerate(workers)])
+    return lines
+
+
+class LatencyHistogram:
+    """
+    Latencies in cumulative buckets as Prometheus expects them, kept per
+    value of one label. Safe to update from several request threads.
+    """
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        # label value -> [count per bucket..., count above the last bucket], sum
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        """Count one latency."""
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            counts, total = self.series.get(label_value, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[bucket] += 1
+            self.series[label_value] = (counts, total + seconds)
+
+    def render(self):
+        """Lines of the exposition format for all label values seen so far."""
+        with self.lock:
+            series = {label_value: (list(counts), total)
+                      for label_value, (counts, total) in self.series.items()}
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else format_value(float(bound))
+                labels = format_labels({self.label: label_value, "le": le})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels({self.label: label_value})
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
@@ -0,0 +1,196 @@
+"""
+Profiling reports of scans.
+
+A profiled scan records the wall and CPU time of each of its phases
+(finding the files, planning the ranges, scanning, writing the summary)
+and what every file cost its workers: bytes, time, CPU time, time waiting
+for data, time decoding matches and page faults. The report is written
+as JSON next to the scan output.
+
+Workers can also take a sampling profile: a thread in each worker records
+the Python stack of the task being run every few milliseconds, and the
+collapsed stacks (root;...;leaf count, as flame graph tools read them) of
+all tasks are added up in the report. Samples are taken between Python
+bytecodes, so time inside a long C call such as mmap.find or a regex
+search is counted at the line that made the call.
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+
+# Time between stack samples of a worker
+SAMPLE_INTERVAL = 0.005
+
+# Stacks in the report, most sampled first
+MAX_REPORTED_STACKS = 200
+
+# Per-task statistics added up per file
+FILE_STAT_FIELDS = ('bytes', 'matches', 'seconds', 'cpu_seconds', 'io_wait_seconds', 'decode_seconds',
+                    'minor_faults', 'major_faults')
+
+
+def new_profile():
+    """A profile to record a scan's phases and files in, started now."""
+    return {
+        "phases": {},
+        "phase_start": (time.perf_counter(), time.process_time()),
+        "files": {},
+        "samples": Counter()
+    }
+
+
+def end_phase(profile, name):
+    """
+    Record the time since the previous phase ended (or the profile started)
+    as phase `name`; the next phase starts now. Does nothing without a profile.
+    """
+    if profile is None:
+        return
+    wall, cpu = time.perf_counter(), time.process_time()
+    wall_start, cpu_start = profile["phase_start"]
+    phase = profile["phases"].setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0})
+    phase["wall_seconds"] += wall - wall_start
+    phase["cpu_seconds"] += cpu - cpu_start
+    profile["phase_start"] = (wall, cpu)
+
+
+def add_task_stats(profile, file_path, task_stats):
+    """Add the statistics of one scanned file or range to the file's totals."""
+    if profile is None or not task_stats:
+        return
+    totals = profile["files"].setdefault(file_path, dict.fromkeys(FILE_STAT_FIELDS, 0))
+    totals["tasks"] = totals.get("tasks", 0) + 1
+    for field in FILE_STAT_FIELDS:
+        totals[field] += task_stats.get(field, 0)
+    profile["samples"].update(task_stats.get("samples", {}))
+
+
+def build_report(profile, details):
+    """
+    The JSON report of a profiled scan.
+
+    Args:
+        profile (dict): Profile from new_profile
+        details (dict): Facts about the scan to put at the top of the report
+
+    Returns:
+        dict: The report
+    """
+    files = []
+    for file_path, totals in profile["files"].items():
+        entry = {"file": file_path}
+        entry.update({field: round(value, 4) if isinstance(value, float) else value
+                      for field, value in totals.items()})
+        entry["bytes_per_second"] = round(totals["bytes"] / totals["seconds"]) if totals["seconds"] else None
+        files.append(entry)
+    # The files that took longest first
+    files.sort(key=lambda entry: entry["seconds"], reverse=True)
+
+    workers = dict.fromkeys(FILE_STAT_FIELDS, 0)
+    for totals in profile["files"].values():
+        for field in FILE_STAT_FIELDS:
+            workers[field] += totals[field]
+    # Worker time not spent waiting for data or decoding matches
+    workers["search_seconds"] = workers["seconds"] - workers["io_wait_seconds"] - workers["decode_seconds"]
+    workers = {field: round(value, 4) if isinstance(value, float) else value for field, value in workers.items()}
+
+    report = dict(details)
+    report["phases"] = {name: {key: round(value, 4) for key, value in phase.items()}
+                        for name, phase in profile["phases"].items()}
+    report["workers"] = workers
+    report["files"] = files
+
+    samples = profile["samples"]
+    if samples:
+        report["samples"] = {
+            "interval_seconds": SAMPLE_INTERVAL,
+            "total": sum(samples.values()),
+            "stacks": [{"stack": stack, "count": count}
+                       for stack, count in samples.most_common(MAX_REPORTED_STACKS)]
+        }
+    return report
+
+
+def write_report(report_path, profile, details):
+    """Write the report of a profiled scan to report_path."""
+    with open(report_path, 'w') as f:
+        json.dump(build_report(profile, details), f, indent=2)
+    return report_path
+
+
+def collapse_stack(frame, root_frame=None):
+    """
+    'module.py:function;...' from root_frame (or the outermost frame) down
+    to frame, with the line of the innermost.
+    """
+    names = []
+    leaf = frame
+    stop = root_frame.f_back if root_frame is not None else None
+    while frame is not None and frame is not stop:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    names[-1] += f":{leaf.f_lineno}"
+    return ';'.join(names)
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stack of one thread of this process while sampling is on.
+    One is started per worker process, the first time a task asks for samples.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.active = False
+        self.root_frame = None
+        self.counts = Counter()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.active:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse_stack(frame, self.root_frame)] += 1
+
+    def drain(self):
+        """Stop sampling and return the samples taken since it was started."""
+        self.active = False
+        self.root_frame = None
+        counts = self.counts
+        self.counts = Counter()
+        return dict(counts)
+
+
+# This process's sampler, see start_sampling
+SAMPLER = None
+
+
+def start_sampling(root_frame=None):
+    """
+    Start sampling the stack of the calling thread. Frames above root_frame,
+    e.g. those of the pool running the task, are left out of the stacks.
+    """
+    global SAMPLER
+    # A sampler inherited through fork has no thread running
+    if SAMPLER is None or SAMPLER.thread_id != threading.get_ident() or not SAMPLER.is_alive():
+        SAMPLER = StackSampler(threading.get_ident())
+        SAMPLER.start()
+    SAMPLER.counts = Counter()
+    SAMPLER.root_frame = root_frame
+    SAMPLER.active = True
+
+
+def stop_sampling():
+    """Stop sampling; returns the collapsed stacks sampled since start_sampling, with their counts."""
+    if SAMPLER is None:
+        return {}
+    return SAMPLER.drain()
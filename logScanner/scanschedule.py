@@ -0,0 +1,152 @@
+"""
+Scheduling of scan tasks over a process pool.
+
+Tasks are handed out largest first, so a huge file starts while there are
+still small ones to fill the other workers, instead of starting last and
+running alone. Small files are packed into batches of about the same byte
+size, so thousands of tiny files cost a few round trips to the pool rather
+than one each. How long each worker was busy is reported after the scan,
+to show how evenly the work was spread.
+"""
+import queue
+import itertools
+
+# Byte size small files are packed into batches of, at most
+BATCH_BYTES = 8 * 1024 * 1024
+
+# Smallest batch size picked for a small scan
+MIN_BATCH_BYTES = 256 * 1024
+
+# Batches aimed for per worker when the total size is known, so the last
+# batches to finish are small next to the scan
+BATCHES_PER_PROCESS = 8
+
+# Files in a batch, at most, bounding the results a single task sends back
+MAX_BATCH_FILES = 256
+
+
+def batch_size_for(total_bytes, num_processes):
+    """
+    Byte size to pack small files into batches of: BATCH_BYTES, or less for
+    a scan too small to give each worker several batches. total_bytes is
+    None when the files are scanned as they are found.
+    """
+    if total_bytes is None:
+        return BATCH_BYTES
+    return max(MIN_BATCH_BYTES, min(BATCH_BYTES, total_bytes // (num_processes * BATCHES_PER_PROCESS)))
+
+
+class FileBatcher:
+    """
+    Packs small files into batches of about batch_bytes as they come.
+    Files of small_file_size bytes or more are not worth batching and are
+    left to the caller.
+    """
+
+    def __init__(self, batch_bytes, max_files=MAX_BATCH_FILES):
+        self.batch_bytes = batch_bytes
+        self.small_file_size = batch_bytes // 4
+        self.max_files = max_files
+        self.items = []
+        self.size = 0
+
+    def add(self, item, size):
+        """Add a small file; returns (items, size) of the batch it completes, or None."""
+        self.items.append(item)
+        self.size += size
+        if self.size >= self.batch_bytes or len(self.items) >= self.max_files:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """(items, size) of the files added since the last batch, or None if there are none."""
+        if not self.items:
+            return None
+        batch = (self.items, self.size)
+        self.items = []
+        self.size = 0
+        return batch
+
+
+def plan_batches(files, num_processes):
+    """
+    Tasks for a list of files: large files alone, small files packed into
+    batches, largest first.
+
+    Args:
+        files (list): (file_path, file_size) tuples
+        num_processes (int): Workers the tasks are shared between
+
+    Returns:
+        list: Lists of file paths, one per task
+    """
+    batcher = FileBatcher(batch_size_for(sum(size for _, size in files), num_processes))
+    tasks = []
+    for file_path, file_size in files:
+        if file_size >= batcher.small_file_size:
+            tasks.append(([file_path], file_size))
+        else:
+            batch = batcher.add(file_path, file_size)
+            if batch is not None:
+                tasks.append(batch)
+    batch = batcher.flush()
+    if batch is not None:
+        tasks.append(batch)
+    tasks.sort(key=lambda task: task[1], reverse=True)
+    return [file_paths for file_paths, _ in tasks]
+
+
+class TaskQueue:
+    """
+    Tasks waiting to be submitted to the pool, filled by one thread (e.g.
+    file discovery) while another submits them. Tasks come out largest
+    first, or in the order they were put in without largest_first; of
+    equal sizes, the one put in first.
+    """
+
+    def __init__(self, largest_first=True):
+        self.largest_first = largest_first
+        self.tasks = queue.PriorityQueue()
+        self.order = itertools.count()
+
+    def put(self, task, size):
+        self.tasks.put((-size if self.largest_first else 0, next(self.order), task))
+
+    def close(self):
+        """No more tasks will be put in; get returns None once the rest are out."""
+        self.tasks.put((float('inf'), next(self.order), None))
+
+    def get(self):
+        """The next task, waiting for one if none is queued; None after close."""
+        return self.tasks.get()[2]
+
+
+def add_worker_busy(worker_busy, worker, seconds):
+    """Count a finished task of `worker` taking `seconds` in worker_busy."""
+    tasks, busy_seconds = worker_busy.get(worker, (0, 0.0))
+    worker_busy[worker] = (tasks + 1, busy_seconds + seconds)
+
+
+def worker_busy_report(worker_busy, scan_seconds):
+    """
+    How busy each worker was during a scan.
+
+    Args:
+        worker_busy (dict): worker (process ID) -> (tasks, busy_seconds), see add_worker_busy
+        scan_seconds (float): Wall time of the scan's scanning phase
+
+    Returns:
+        list: Lines of text, one per worker and a last one comparing the
+              busiest worker to the average; empty without workers
+    """
+    if not worker_busy:
+        return []
+    lines = []
+    for number, (worker, (tasks, busy_seconds)) in enumerate(sorted(worker_busy.items()), 1):
+        share = busy_seconds / scan_seconds * 100 if scan_seconds else 0
+        lines.append(f"Worker {number} (pid {worker}): {tasks} tasks, {busy_seconds:.2f} s busy ({share:.0f}% of the scan)")
+    busiest = max(busy_seconds for _, busy_seconds in worker_busy.values())
+    average = sum(busy_seconds for _, busy_seconds in worker_busy.values()) / len(worker_busy)
+    balance = average / busiest * 100 if busiest else 100
+    lines.append(f"Busiest worker: {busiest:.2f} s, average: {average:.2f} s ({balance:.0f}% balanced)")
+    return lines
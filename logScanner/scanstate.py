@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Scan state for re-running the same search over growing logs.
+
+For every search a state file records, per log file, the device/inode it
+was scanned under, the offset up to which its complete lines have been
+scanned and the number of lines before that offset. The next run of the
+same search only scans the bytes appended since, with exact line numbers.
+
+Logs are matched to their state by device and inode first, so a rotated
+log (app.log renamed to app.log.1) continues from where app.log stopped
+instead of being scanned again, while the new app.log starts from zero.
+A log that was truncated or rewritten below the recorded offset starts
+from zero as well. Compressed logs are written once, so they are scanned
+whole the first time they are seen and skipped after that. A compressed
+log that is a rotated log compressed after it was scanned (app.log.1
+compressed into app.log.2.gz, under a new inode) is recognised by its
+decompressed size and tail checksum matching the plain log's state, and
+skipped without being scanned again.
+"""
+import os
+import json
+import lzma
+import mmap
+import zlib
+import hashlib
+
+from compressedlogs import compression_extension, is_compressed, iter_gzip_members, iter_stream
+from lineindex import tail_checksum, TAIL_CHECK_SIZE
+
+# Bytes counted at a time when counting the lines of new data
+COUNT_STEP = 16 * 1024 * 1024
+
+
+def state_path_for(state_dir, search_parameter, use_regex=False, patterns=None):
+    """Return the state file of a search in state_dir."""
+    query = json.dumps([search_parameter, use_regex, patterns])
+    digest = hashlib.sha1(query.encode('utf-8')).hexdigest()
+    return os.path.join(state_dir, f"{digest}.state.json")
+
+
+def load_state(state_path):
+    """Read a state file, or return an empty state if there is none."""
+    try:
+        with open(state_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+
+def save_state(state_path, state):
+    """Write a state file atomically."""
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    temp_path = f"{state_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, state_path)
+
+
+def decompressed_tail(file_path):
+    """
+    Return the decompressed size of a compressed log and the checksum of its
+    last TAIL_CHECK_SIZE decompressed bytes, as tail_checksum takes it of a
+    plain log, or None if the file can't be decompressed.
+    """
+    if compression_extension(file_path) == '.gz':
+        chunks = iter_gzip_members(file_path)
+    else:
+        chunks = iter_stream(file_path)
+    size = 0
+    tail = b''
+    try:
+        for data, _ in chunks:
+            size += len(data)
+            tail = (tail + data)[-TAIL_CHECK_SIZE:]
+    except (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError):
+        return None
+    return size, zlib.crc32(tail)
+
+
+def plan_incremental_scan(state, file_paths):
+    """
+    Work out which bytes of each file have not been scanned yet.
+
+    Only complete lines are planned; a partial last line is left for the
+    next run, when it has been finished.
+
+    Args:
+        state (dict): State loaded with load_state
+        file_paths (list): Files found by this run
+
+    Returns:
+        tuple: (new_ranges, new_state) where new_ranges maps each file with
+               unscanned lines to (start, end, first_line), first_line being
+               the 0-based line number at start, and new_state is the state
+               to save once those ranges have been scanned.
+    """
+    entries = state.get("files", {})
+    by_inode = {(entry["dev"], entry["inode"]): entry for entry in entries.values()}
+    # Plain logs scanned up to some offset, by their size and tail checksum there
+    by_content = {(entry["offset"], entry["tail_crc"]): entry
+                  for path, entry in entries.items() if not is_compressed(path) and entry["offset"]}
+
+    new_ranges = {}
+    new_entries = {}
+    for file_path in file_paths:
+        key = os.path.abspath(file_path)
+        try:
+            with open(file_path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+
+                # Same inode under the same or a rotated name
+                entry = by_inode.get((stat.st_dev, stat.st_ino))
+                start = first_line = 0
+                if (entry is not None and stat.st_size >= entry["offset"] and
+                        tail_checksum(f, entry["offset"]) == entry["tail_crc"]):
+                    start, first_line = entry["offset"], entry["lines"]
+
+                end = start
+                lines = first_line
+                if is_compressed(file_path):
+                    # Compressed logs don't grow, so they are scanned whole or not at all
+                    if entry is None and by_content and decompressed_tail(file_path) in by_content:
+                        # A plain log scanned to its end and compressed since
+                        start = stat.st_size
+                    if stat.st_size > start:
+                        start = first_line = 0
+                    end, lines = stat.st_size, 0
+                elif stat.st_size > start:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        last_newline = mm.rfind(b'\n', start, stat.st_size)
+                        if last_newline != -1:
+                            end = last_newline + 1
+                        for pos in range(start, end, COUNT_STEP):
+                            lines += mm[pos:min(pos + COUNT_STEP, end)].count(b'\n')
+
+                if end > start:
+                    new_ranges[file_path] = (start, end, first_line)
+                new_entries[key] = {
+                    "dev": stat.st_dev,
+                    "inode": stat.st_ino,
+                    "offset": end,
+                    "lines": lines,
+                    "tail_crc": tail_checksum(f, end)
+                }
+        except OSError:
+            continue
+
+    return new_ranges, {"files": new_entries}
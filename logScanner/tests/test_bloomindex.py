@@ -0,0 +1,41 @@
+"""
+Bloom filter sketches: the entries a needle must hit, and regions ruled out
+by them.
+"""
+from bloomindex import needle_tokens, update_sketches, find_sketch_ranges
+
+
+def test_needle_tokens_of_id_literals_check_edge_affixes():
+    assert needle_tokens(b'ORD-2554') == [b'*ord', b'255*']
+    assert needle_tokens(b'req-8f3a2c') == [b'*req', b'8f3*']
+    assert needle_tokens(b'disk full error') == [b'*isk', b'full', b'err*']
+
+
+def test_needle_tokens_of_a_single_word_need_both_boundaries():
+    assert needle_tokens(b'timeout') == []
+    assert needle_tokens(b'timeout', bounded_start=True) == [b'tim*']
+    assert needle_tokens(b'timeout', bounded_end=True) == [b'*out']
+    assert needle_tokens(b'timeout', True, True) == [b'timeout']
+
+
+def test_sketches_skip_regions_without_an_id(tmp_path):
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    lines = [f"2024-01-01 order ORD-{i:04d} shipped by worker{i % 7}" for i in range(4000)]
+    log_path = logs / "orders.log"
+    log_path.write_text("\n".join(lines) + "\n")
+    other_path = logs / "other.log"
+    other_path.write_text("\n".join(f"request req-{i:06x} done" for i in range(2000)) + "\n")
+    files = [str(log_path), str(other_path)]
+    store = str(tmp_path / "sketches")
+
+    update_sketches(store, files, region_size=16 * 1024, num_processes=1)
+    candidates = find_sketch_ranges(store, files, [needle_tokens(b'ORD-2554')])
+
+    # other.log holds no token ending in ord, and most regions of orders.log
+    # hold no token starting with 255
+    assert candidates[str(other_path)] == []
+    ranges = candidates[str(log_path)]
+    assert ranges and sum(end - start for start, end, _ in ranges) < log_path.stat().st_size // 2
+    data = log_path.read_bytes()
+    assert any(b'ORD-2554' in data[start:end] for start, end, _ in ranges)
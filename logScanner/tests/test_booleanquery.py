@@ -0,0 +1,93 @@
+"""
+Boolean line queries: parse trees, parse errors, the planner's cover and
+checking lines.
+"""
+import re
+
+import pytest
+
+from booleanquery import parse_boolean_query, find_cover, literal_cost, compile_boolean_query
+
+
+def lit(text):
+    return ('literal', text.encode('utf-8'))
+
+
+def test_parse_precedence():
+    # Juxtaposition is AND, and AND binds tighter than OR
+    assert parse_boolean_query('a b OR c AND NOT d') == \
+        ('or', [('and', [lit('a'), lit('b')]), ('and', [lit('c'), ('not', lit('d'))])])
+    assert parse_boolean_query('(a OR b) c') == ('and', [('or', [lit('a'), lit('b')]), lit('c')])
+    assert parse_boolean_query('NOT NOT a') == ('not', ('not', lit('a')))
+
+
+def test_parse_terms():
+    tree = parse_boolean_query(r'"disk \"full\"" and /retr(y|ies) [0-9]+/i')
+    kind, (phrase, word, regex) = tree
+    assert kind == 'and'
+    assert phrase == lit('disk "full"')
+    # Operators are only recognised in upper case
+    assert word == lit('and')
+    assert regex[0] == 'regex'
+    assert regex[1].pattern == rb'retr(y|ies) [0-9]+' and regex[1].flags & re.IGNORECASE
+
+
+@pytest.mark.parametrize("query, message", [
+    ('', "empty"),
+    ('   ', "empty"),
+    ('a AND', "ends where a term was expected"),
+    ('(a OR b', r"Missing \)"),
+    ('a OR b)', r"Unexpected \)"),
+    ('OR a', "Expected a term"),
+    ('"unterminated', "unterminated phrase or regex"),
+    ('""', "Empty phrase"),
+    ('/a(/', "Invalid regex term"),
+])
+def test_parse_errors(query, message):
+    with pytest.raises(ValueError, match=message):
+        parse_boolean_query(query)
+
+
+def test_cover_of_and_is_its_cheapest_term():
+    assert find_cover(parse_boolean_query('error zqxj')) == [b'zqxj']
+    assert literal_cost(b'zqxj') < literal_cost(b'error')
+
+
+def test_cover_of_or_takes_every_branch():
+    assert find_cover(parse_boolean_query('timeout OR "reset by peer"')) == [b'timeout', b'reset by peer']
+    # A line holding the longer literal holds the shorter one too
+    assert find_cover(parse_boolean_query('fail OR failed OR "fail fast"')) == [b'fail']
+
+
+def test_terms_without_a_cover():
+    assert find_cover(parse_boolean_query('NOT DEBUG')) is None
+    assert find_cover(parse_boolean_query('timeout OR NOT DEBUG')) is None
+    assert find_cover(parse_boolean_query('/[0-9]+ms/i')) is None
+    # NOT doesn't count, the other terms of an AND still do
+    assert find_cover(parse_boolean_query('ERROR NOT DEBUG')) == [b'ERROR']
+    # A regex is covered by its literal runs
+    assert find_cover(parse_boolean_query(r'/^took \d+ms$/')) == [b'took ']
+
+
+def test_compiled_query_needle_and_prefilter():
+    single = compile_boolean_query('ERROR NOT retry')
+    assert single.needle == b'ERROR' and single.prefilter is None
+    several = compile_boolean_query('timeout OR reset')
+    assert several.needle is None
+    assert several.prefilter.search(b'connection reset') and not several.prefilter.search(b'ok')
+    none = compile_boolean_query('NOT DEBUG')
+    assert none.needle is None and none.prefilter is None and none.cover is None
+
+
+@pytest.mark.parametrize("line, expected", [
+    (b'ERROR disk full on /dev/sda', True),
+    (b'ERROR connection reset, retrying 3 times', False),
+    (b'ERROR timeout, Retry 3', False),
+    (b'ERROR timeout, retry later', True),
+    (b'WARN disk full', False),
+    (b'ERROR timeout', True),
+    (b'error disk full', False),
+])
+def test_search(line, expected):
+    query = compile_boolean_query('ERROR AND ("disk full" OR timeout OR reset) AND NOT /retry(ing)? [0-9]+/i')
+    assert query.search(line) is expected
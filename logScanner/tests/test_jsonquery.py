@@ -0,0 +1,79 @@
+"""
+JSON field queries: parsing, the literals lines are found by, and checking
+and projecting candidate lines.
+"""
+import pytest
+
+from jsonquery import parse_json_query, parse_fields, compile_json_query
+
+
+def test_parse_conditions():
+    assert parse_json_query('level=ERROR AND user.id=42 AND msg!="disk full"') == [
+        (('level',), False, 'ERROR', True, 'ERROR'),
+        (('user', 'id'), False, 42, False, '42'),
+        (('msg',), True, 'disk full', True, '"disk full"'),
+    ]
+
+
+def test_parse_unquoted_values_as_json_scalars():
+    assert parse_json_query('ok=true')[0][2:4] == (True, False)
+    assert parse_json_query('v=null')[0][2:4] == (None, False)
+    assert parse_json_query('v=4.5')[0][2:4] == (4.5, False)
+    # Quoted, or not a JSON scalar, the value is a string
+    assert parse_json_query('v="42"')[0][2:4] == ('42', True)
+    assert parse_json_query('v=[1]')[0][2:4] == ('[1]', True)
+
+
+@pytest.mark.parametrize("query, message", [
+    ('level', "expected field=value"),
+    ('level==ERROR', "expected field=value"),
+    ('level!==ERROR', "expected field=value"),
+    ('level=!ERROR', "expected field=value"),
+    ('level=ERROR and user=1', "conditions are joined by AND"),
+    ('level=ERROR OR user=1', "conditions are joined by AND"),
+    ('level="\\q"', "Invalid quoted value"),
+    ('', "expected field=value"),
+])
+def test_parse_errors(query, message):
+    with pytest.raises(ValueError, match=message):
+        parse_json_query(query)
+
+
+def test_quoted_values_may_start_with_operators():
+    assert parse_json_query('expr="==x"')[0][2] == '==x'
+
+
+def test_parse_fields():
+    assert parse_fields(' ts, level,,user.id ') == ['ts', 'level', 'user.id']
+
+
+def test_needles():
+    query = compile_json_query('level=ERROR AND latency=12.5 AND user!=bob AND path="/a"')
+    # != conditions and values JSON may escape have no literal
+    assert query.needles == [b'"ERROR"', b'12']
+    assert query.needle == b'"ERROR"'
+    assert compile_json_query('user!=bob').needle is None
+
+
+def test_search():
+    query = compile_json_query('level=ERROR AND user.id=42 AND msg!="disk full"')
+    assert query.search(b'{"level": "ERROR", "user": {"id": 42}, "msg": "timeout"}')
+    assert query.search(b'2024-01-01T00:00:00Z {"level":"ERROR","user":{"id":"42"}}')
+    assert query.search(b'{"level": "ERROR", "user.id": 42.0}')
+    assert not query.search(b'{"level": "ERROR", "user": {"id": 42}, "msg": "disk full"}')
+    assert not query.search(b'{"level": "WARN", "user": {"id": 42}, "note": "ERROR"}')
+    assert not query.search(b'{"level": "ERROR", "user": {"id": 420}}')
+    assert not query.search(b'level "ERROR" user 42, not JSON')
+
+
+def test_quoted_and_unquoted_values():
+    assert compile_json_query('ok=true').search(b'{"ok": "true"}')
+    assert not compile_json_query('ok=true').search(b'{"ok": 1}')
+    assert not compile_json_query('id="42"').search(b'{"id": 42}')
+    assert compile_json_query('tags.1=b').search(b'{"tags": ["a", "b"]}')
+
+
+def test_project():
+    query = compile_json_query('level=ERROR', ('ts', 'user.id', 'missing'))
+    assert query.project(b'{"ts": 1, "level": "ERROR", "user": {"id": "\xc3\xa9"}}') == \
+        '{"ts": 1, "user.id": "é"}'
@@ -0,0 +1,64 @@
+"""
+Incremental scans over rotated logs: bytes scanned by an earlier run are
+not scanned again when their log is renamed or compressed.
+"""
+import gzip
+import os
+import re
+
+from advancemain import scan_logs_parallel
+
+
+def write_log(file_path, first, count):
+    with open(file_path, "w") as f:
+        for i in range(first, first + count):
+            f.write(f"2024-01-01 12:00:{i % 60:02d} request {i} failed: timeout\n")
+            f.write(f"2024-01-01 12:00:{i % 60:02d} request {i} ok\n")
+
+
+def total_matches(output_file):
+    return int(re.search(r"Total matches found: (\d+)", open(output_file).read()).group(1))
+
+
+def test_rotated_then_compressed_log_is_not_rescanned(tmp_path):
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    state_dir = str(tmp_path / "state")
+
+    def run(name):
+        output_file = str(tmp_path / name)
+        scan_logs_parallel(str(logs), "timeout", output_file=output_file, state_dir=state_dir,
+                           num_processes=1)
+        return total_matches(output_file)
+
+    write_log(logs / "app.log", 0, 100)
+    assert run("first") == 100
+
+    # Rotated: app.log renamed to app.log.1, a new app.log started
+    os.rename(logs / "app.log", logs / "app.log.1")
+    write_log(logs / "app.log", 100, 50)
+    assert run("second") == 50
+
+    # app.log.1 compressed into app.log.2.gz under a new inode
+    with open(logs / "app.log.1", "rb") as src, gzip.open(logs / "app.log.2.gz", "wb") as dest:
+        dest.write(src.read())
+    os.remove(logs / "app.log.1")
+    assert run("third") == 0
+    assert run("fourth") == 0
+
+
+def test_compressed_log_with_unscanned_lines_is_scanned(tmp_path):
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    state_dir = str(tmp_path / "state")
+    write_log(logs / "app.log", 0, 10)
+    scan_logs_parallel(str(logs), "timeout", output_file=str(tmp_path / "first"), state_dir=state_dir,
+                       num_processes=1)
+
+    # Lines were appended after the last run before the log was compressed
+    with open(logs / "app.log", "rb") as src, gzip.open(logs / "app.log.1.gz", "wb") as dest:
+        dest.write(src.read() + b"2024-01-01 12:01:00 request 10 failed: timeout\n")
+    os.remove(logs / "app.log")
+    output_file = str(tmp_path / "second")
+    scan_logs_parallel(str(logs), "timeout", output_file=output_file, state_dir=state_dir, num_processes=1)
+    assert total_matches(output_file) == 11
@@ -0,0 +1,121 @@
+"""
+Split and chunked scans against a line-by-line reference: ranges must
+cover each file exactly once and stitching must turn range-relative line
+numbers into file line numbers.
+"""
+import gzip
+import random
+
+import pytest
+
+from advancemain import find_line_aligned_ranges, stitch_range_results, scan_logs_parallel
+from timerange import parse_time_range
+
+NEEDLE = "needle"
+
+
+def make_lines(count, seed):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        words = [rng.choice(["alpha", "beta", "gamma", NEEDLE, "x" * rng.randint(0, 300)])
+                 for _ in range(rng.randint(0, 6))]
+        lines.append(f"line {i} " + " ".join(words))
+    return lines
+
+
+def expected_matches(lines):
+    # A plain search writes a line once for each occurrence of the literal
+    return [f"{i + 1}: {line}" for i, line in enumerate(lines) for _ in range(line.count(NEEDLE))]
+
+
+def write_logs(directory):
+    """Plain logs with and without a trailing newline, and a multi-member gzip log."""
+    logs = {}
+    lines = make_lines(3000, 1)
+    (directory / "trailing.log").write_text("\n".join(lines) + "\n")
+    logs[str(directory / "trailing.log")] = lines
+
+    lines = make_lines(3000, 2) + [f"last {NEEDLE} line without a newline"]
+    (directory / "no_newline.log").write_text("\n".join(lines))
+    logs[str(directory / "no_newline.log")] = lines
+
+    lines = make_lines(3000, 3)
+    text = "\n".join(lines) + "\n"
+    # Members cut at line boundaries, as a log rotated with several appends
+    cuts = [0, len(text) // 3, 2 * len(text) // 3, len(text)]
+    cuts = [0] + [text.index("\n", cut) + 1 for cut in cuts[1:-1]] + [len(text)]
+    members = [gzip.compress(text[a:b].encode()) for a, b in zip(cuts, cuts[1:])]
+    (directory / "members.log.gz").write_bytes(b"".join(members))
+    logs[str(directory / "members.log.gz")] = lines
+    return logs
+
+
+def read_sections(output_file):
+    """Matching lines of each file in a scan's output, by file."""
+    text = open(output_file).read()
+    sections = {}
+    for section in text.split("MATCHES FROM: ")[1:]:
+        file_path, body = section.split("\n", 1)
+        body = body.split("\n\nTotal matches in this file")[0]
+        sections[file_path] = [line for line in body.strip("=\n").split("\n") if line]
+    return sections
+
+
+@pytest.fixture(scope="module")
+def logs(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("logs")
+    return directory, write_logs(directory)
+
+
+def test_line_aligned_ranges_cover_the_file(tmp_path):
+    data = b"".join(f"{'y' * (i % 37)}\n".encode() for i in range(500)) + b"no newline at the end"
+    file_path = tmp_path / "a.log"
+    file_path.write_bytes(data)
+    ranges = find_line_aligned_ranges(str(file_path), len(data), 100)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert data[start - 1:start] == b"\n"
+
+
+def test_stitch_continues_numbering_across_ranges():
+    range_results = [([(0, "a"), (2, "b")], 3), ([(1, "c")], 2), ([(0, "d")], 1)]
+    ranges = [(0, 10, None), (10, 20, None), (20, 30, 100)]
+    assert stitch_range_results(range_results, ranges) == ["1: a", "3: b", "5: c", "101: d"]
+
+
+@pytest.mark.parametrize("split_size, chunk_size", [
+    (None, 100 * 1024 * 1024),
+    (None, 4096),
+    (50000, 100 * 1024 * 1024),
+    (50000, 4096),
+    (7000, 1000),
+])
+def test_split_scans_match_the_reference(logs, tmp_path, split_size, chunk_size):
+    directory, expected = logs
+    output_file = str(tmp_path / "out")
+    scan_logs_parallel(str(directory), NEEDLE, output_file=output_file, split_size=split_size,
+                       chunk_size=chunk_size, line_numbers=True, ordered_output=True, num_processes=2)
+    sections = read_sections(output_file)
+    for file_path, lines in expected.items():
+        assert sections.get(file_path, []) == expected_matches(lines), file_path
+
+
+@pytest.mark.parametrize("split_size", [None, 7000])
+def test_time_range_scans_number_lines_from_the_index(tmp_path, split_size):
+    directory = tmp_path / "logs"
+    directory.mkdir()
+    lines = [f"2024-03-05 {10 + i // 600:02d}:{i // 10 % 60:02d}:{i % 10:02d} line {i} "
+             f"{NEEDLE if i % 7 == 0 else 'other'}" for i in range(3000)]
+    (directory / "timed.log").write_text("\n".join(lines) + "\n")
+    index_dir = tmp_path / "indexes"
+    output_file = str(tmp_path / "out")
+    time_range = parse_time_range("2024-03-05 11:30", "2024-03-05 12:10")
+    scan_logs_parallel(str(directory), NEEDLE, output_file=output_file, split_size=split_size,
+                       line_numbers=True, ordered_output=True, num_processes=2, time_range=time_range,
+                       index_dir=str(index_dir))
+    inside = [line if "11:30:00" <= line[11:19] <= "12:10:00" else "" for line in lines]
+    assert read_sections(output_file)[str(directory / "timed.log")] == expected_matches(inside)
+    # Lines before the range were left out, so the parent numbered them with the index
+    assert len(list(index_dir.iterdir())) == 1
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Catalog of the time span of each log file, to skip whole files outside a
+--since/--until window.
+
+For every log it has seen, the catalog records the first and last
+timestamp, the size and, when known, the line count. A scan over months
+of rotated logs then only opens the files whose span overlaps the window.
+Entries are filled in lazily, the first time a scan with a time range
+meets a file:
+    plain logs      the first lines and the last lines are read through a
+                    mapping of the file, a page or two each
+    compressed logs have no readable tail, so they are read through once,
+                    counting their lines on the way; rotated archives don't
+                    change, so that is once per archive
+
+Entries are keyed by device and inode and are only used while the size and
+mtime still match, so a log renamed by rotation (app.log to app.log.1)
+keeps its entry, and a log that grew is cataloged again from its head and
+tail. The catalog is a single JSON file; concurrent scans may overwrite
+each other's new entries, which are then filled in again by the next scan.
+Files whose timestamps aren't recognised are cataloged without a span and
+never skipped.
+"""
+import os
+import json
+import mmap
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from compressedlogs import is_compressed, iter_compressed_windows
+from timerange import (DETECT_LINES, TIMESTAMP_SEARCH_BYTES, MAX_UNTIMESTAMPED_BYTES, detect_timestamp_format,
+                       line_timestamp, resolve_time_range, parse_time_range, format_time_range)
+
+# Files cataloged at the same time; reading heads and tails waits on the
+# file system rather than the CPU
+DEFAULT_CATALOG_THREADS = 16
+
+# Bytes at the start of a file its timestamp format is detected from
+HEAD_BYTES = DETECT_LINES * TIMESTAMP_SEARCH_BYTES * 8
+
+# Bytes copied at a time while counting the lines of a plain log
+COUNT_STEP = 16 * 1024 * 1024
+
+
+def file_key(stat):
+    """The catalog key of a file: its device and inode."""
+    return f"{stat.st_dev}:{stat.st_ino}"
+
+
+def load_catalog(catalog_path):
+    """Read a time catalog, or return an empty one."""
+    try:
+        with open(catalog_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_catalog(catalog_path, catalog):
+    """Write a time catalog atomically, dropping the entries of logs that are gone."""
+    for key, entry in list(catalog.items()):
+        try:
+            if file_key(os.stat(entry["path"])) == key:
+                continue
+        except OSError:
+            pass
+        del catalog[key]
+    directory = os.path.dirname(os.path.abspath(catalog_path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{catalog_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(catalog, f)
+    os.replace(temp_path, catalog_path)
+
+
+def last_timestamp(data, start, end, timestamp_format):
+    """
+    The timestamp of the last line of data[start:end] that has one,
+    looking back at most MAX_UNTIMESTAMPED_BYTES; None if there is none.
+    """
+    limit = max(start, end - MAX_UNTIMESTAMPED_BYTES)
+    line_end = end
+    while line_end > limit:
+        newline = data.rfind(b'\n', limit, line_end - 1)
+        line_start = newline + 1 if newline != -1 else limit
+        timestamp = line_timestamp(data[line_start:min(line_end, line_start + TIMESTAMP_SEARCH_BYTES)],
+                                   timestamp_format)
+        if timestamp is not None:
+            return timestamp
+        line_end = line_start
+    return None
+
+
+def read_plain_span(file_path, count_lines=False):
+    """
+    (timestamp_format name, first, last, lines) of a plain log, from the
+    head and tail of its mapping; lines is None without count_lines.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None, None, None, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            head = mm[:min(len(mm), HEAD_BYTES)].split(b'\n')[:DETECT_LINES]
+            timestamp_format, first = detect_timestamp_format(head)
+            last = last_timestamp(mm, 0, len(mm), timestamp_format) if timestamp_format else None
+            lines = None
+            if count_lines:
+                lines = sum(mm[pos:pos + COUNT_STEP].count(b'\n') for pos in range(0, len(mm), COUNT_STEP))
+                if mm[-1:] != b'\n':
+                    lines += 1
+    return (timestamp_format[0] if timestamp_format else None), first, last, lines
+
+
+def read_compressed_span(file_path):
+    """(timestamp_format name, first, last, lines) of a compressed log, read through once."""
+    timestamp_format = first = last = None
+    lines = 0
+    started = False
+    ends_with_newline = True
+    for data, lo, hi in iter_compressed_windows(file_path):
+        if hi == lo:
+            continue
+        if not started:
+            # The format is detected from the first lines only, as when the file is narrowed
+            head = data[lo:min(hi, lo + HEAD_BYTES)].split(b'\n')[:DETECT_LINES]
+            timestamp_format, first = detect_timestamp_format(head)
+            started = True
+        if timestamp_format is not None:
+            last = last_timestamp(data, lo, hi, timestamp_format) or last
+        lines += data.count(b'\n', lo, hi)
+        ends_with_newline = data[hi - 1:hi] == b'\n'
+    if not ends_with_newline:
+        lines += 1
+    return (timestamp_format[0] if timestamp_format else None), first, last, lines
+
+
+def catalog_file(catalog, file_path, count_lines=False):
+    """
+    The catalog entry of a log, cataloging it first if it is new or
+    changed. The entry is a dict of path (absolute), size, mtime (ns), format, first
+    and last (ISO timestamps, None if not recognised) and lines (None if
+    not counted).
+
+    Args:
+        catalog (dict): Catalog from load_catalog, updated in place
+        file_path (str): Log file
+        count_lines (bool): Whether to count the lines of a plain log,
+            which reads all of it
+
+    Returns:
+        dict: The entry, or None if the file can't be read
+    """
+    file_path = os.path.abspath(file_path)
+    try:
+        stat = os.stat(file_path)
+        key = file_key(stat)
+        entry = catalog.get(key)
+        if (entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns
+                and (entry["lines"] is not None or not count_lines)):
+            if entry["path"] != file_path:
+                # Renamed, e.g. by rotation
+                entry = dict(entry, path=file_path)
+                catalog[key] = entry
+            return entry
+        if is_compressed(file_path):
+            format_name, first, last, lines = read_compressed_span(file_path)
+        else:
+            format_name, first, last, lines = read_plain_span(file_path, count_lines)
+    except Exception as e:
+        print(f"Error cataloging {file_path}: {str(e)}")
+        return None
+    entry = {
+        "path": file_path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "format": format_name,
+        "first": first.isoformat() if first else None,
+        "last": last.isoformat() if last else None,
+        "lines": lines
+    }
+    catalog[key] = entry
+    return entry
+
+
+def catalog_files(catalog, file_paths, num_threads=DEFAULT_CATALOG_THREADS, count_lines=False):
+    """
+    Catalog entries of several logs, cataloging new and changed ones a few
+    at a time.
+
+    Returns:
+        dict: file_path -> entry (None for files that can't be read)
+    """
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        entries = executor.map(lambda file_path: catalog_file(catalog, file_path, count_lines), file_paths)
+        return dict(zip(file_paths, entries))
+
+
+def overlaps_time_range(entry, time_range):
+    """
+    Whether a log with this catalog entry may have lines inside time_range
+    (from timerange.parse_time_range). Times of day are taken on the date
+    of the file's first timestamp, as when the file itself is narrowed.
+    """
+    if entry is None or entry["first"] is None or entry["last"] is None:
+        return True
+    first = datetime.fromisoformat(entry["first"])
+    last = datetime.fromisoformat(entry["last"])
+    since, until = resolve_time_range(time_range, first)
+    if until is not None and first > until:
+        return False
+    if since is not None and last < since:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Catalog the time span of log files, or list the ones inside a time range."
+    )
+    parser.add_argument(
+        "catalog",
+        help="Catalog file"
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="Log files to catalog"
+    )
+    parser.add_argument(
+        "--count-lines",
+        action="store_true",
+        help="Also count the lines of plain logs, reading them whole"
+    )
+    parser.add_argument(
+        "--since",
+        default=None,
+        help="Only list the files with lines at or after this time"
+    )
+    parser.add_argument(
+        "--until",
+        default=None,
+        help="Only list the files with lines at or before this time"
+    )
+
+    args = parser.parse_args()
+
+    try:
+        time_range = parse_time_range(args.since, args.until)
+    except ValueError as e:
+        parser.error(str(e))
+
+    catalog = load_catalog(args.catalog)
+    entries = catalog_files(catalog, args.files, count_lines=args.count_lines)
+    save_catalog(args.catalog, catalog)
+
+    if time_range:
+        print(f"Files with lines {format_time_range(time_range)}:")
+    for file_path in args.files:
+        entry = entries[file_path]
+        if time_range and not overlaps_time_range(entry, time_range):
+            continue
+        if entry is None:
+            print(f"{file_path}: unreadable")
+        elif entry["first"] is None:
+            print(f"{file_path}: no recognised timestamps")
+        else:
+            lines = f", {entry['lines']} lines" if entry["lines"] is not None else ""
+            print(f"{file_path}: {entry['first']} to {entry['last']} ({entry['format']}{lines})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Time-range narrowing of logs written in time order.
+
+A search scoped to a time window (--since/--until) doesn't need to read
+a whole day's log. The timestamp format of a file is detected from its
+first lines, and the first line at or after `since` and the first line
+after `until` are found by bisecting over byte offsets of the mapped
+file. Each probe reads a page or two, so only the window itself is
+scanned.
+
+Bounds are a date and time (2024-01-01 14:02) or only a time of day
+(14:02). A time of day is taken on the date of the file's first
+timestamp, and a window whose end is before its start runs over midnight.
+Timestamps are compared as written, to the second; zone offsets are
+ignored and epoch seconds are read as UTC. Lines without a timestamp
+(stack traces, continuation lines) stay with the timestamped line before
+them. A file whose format isn't recognised is scanned whole.
+"""
+import re
+from datetime import datetime, time, timedelta, timezone
+
+# Bytes at the start of a line the timestamp is looked for in
+TIMESTAMP_SEARCH_BYTES = 128
+
+# Lines at the start of a file its timestamp format is detected from
+DETECT_LINES = 50
+
+# Bytes read past a probe looking for a line with a timestamp; a longer
+# run of lines without one is treated as the end of the timestamps
+MAX_UNTIMESTAMPED_BYTES = 1024 * 1024
+
+MONTHS = {name: number for number, name in enumerate(
+    [b'Jan', b'Feb', b'Mar', b'Apr', b'May', b'Jun', b'Jul', b'Aug', b'Sep', b'Oct', b'Nov', b'Dec'], 1)}
+
+
+def parse_iso(match):
+    """2024-01-01 12:00:00, 2024-01-01T12:00:00.123Z or 2024/01/01 12:00:00"""
+    return datetime(*(int(group) for group in match.groups()))
+
+
+def parse_common_log(match):
+    """01/Jan/2024:12:00:00, as in Apache and nginx access logs"""
+    day, month, year, hour, minute, second = match.groups()
+    return datetime(int(year), MONTHS[month], int(day), int(hour), int(minute), int(second))
+
+
+def parse_epoch(match):
+    """1704110400 or 1704110400.123 at the start of the line"""
+    return datetime.fromtimestamp(int(match.group(1)), timezone.utc).replace(tzinfo=None)
+
+
+# (name, regex, parser) of the formats recognised, tried in this order
+TIMESTAMP_FORMATS = [
+    ('iso', re.compile(rb'(\d{4})[-/](\d{2})[-/](\d{2})[T ](\d{2}):(\d{2}):(\d{2})'), parse_iso),
+    ('common_log', re.compile(rb'(\d{2})/([A-Z][a-z]{2})/(\d{4}):(\d{2}):(\d{2}):(\d{2})'), parse_common_log),
+    ('epoch', re.compile(rb'^(\d{10})(?:\.\d+)?\b'), parse_epoch),
+]
+
+
+def parse_time_bound(text):
+    """
+    Parse a --since/--until value: '2024-01-01 14:02[:05]', '2024-01-01T14:02',
+    '2024-01-01' (midnight) or a time of day, '14:02[:05]'.
+
+    Returns:
+        datetime or time; raises ValueError for anything else
+    """
+    text = text.strip()
+    try:
+        return time.fromisoformat(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        raise ValueError(f"Invalid time '{text}'; use YYYY-MM-DD HH:MM[:SS], YYYY-MM-DD or HH:MM[:SS]")
+
+
+def parse_time_range(since=None, until=None):
+    """
+    The time range of --since/--until values, either of which may be None.
+
+    Returns:
+        tuple: (since, until) bounds as from parse_time_bound, or None
+               without either; raises ValueError for invalid values
+    """
+    if not since and not until:
+        return None
+    since = parse_time_bound(since) if since else None
+    until = parse_time_bound(until) if until else None
+    if since is not None and until is not None:
+        if isinstance(since, datetime) != isinstance(until, datetime):
+            raise ValueError("since and until must both be times of day or both include a date")
+        if isinstance(since, datetime) and until < since:
+            raise ValueError("until is before since")
+    return since, until
+
+
+def format_time_range(time_range):
+    """'since X until Y' for the header of a scan's output."""
+    since, until = time_range
+    parts = []
+    if since is not None:
+        parts.append(f"since {since.isoformat(sep=' ') if isinstance(since, datetime) else since.isoformat()}")
+    if until is not None:
+        parts.append(f"until {until.isoformat(sep=' ') if isinstance(until, datetime) else until.isoformat()}")
+    return ' '.join(parts)
+
+
+def line_timestamp(line, timestamp_format, search_bytes=TIMESTAMP_SEARCH_BYTES):
+    """The timestamp of a line (bytes) in the given format, or None."""
+    _, regex, parser = timestamp_format
+    match = regex.search(line, 0, search_bytes)
+    if match is None:
+        return None
+    try:
+        return parser(match)
+    except ValueError:
+        return None
+
+
+def detect_timestamp_format(lines):
+    """
+    The format of the first of `lines` (bytes) with a recognised timestamp,
+    and that timestamp.
+
+    Returns:
+        tuple: (timestamp_format, first_timestamp), or (None, None)
+    """
+    for line in lines:
+        for timestamp_format in TIMESTAMP_FORMATS:
+            timestamp = line_timestamp(line, timestamp_format)
+            if timestamp is not None:
+                return timestamp_format, timestamp
+    return None, None
+
+
+def resolve_time_range(time_range, first_timestamp):
+    """
+    (since, until) as datetimes (or None), times of day taken on the date
+    of first_timestamp.
+    """
+    since, until = time_range
+    if isinstance(since, time):
+        since = datetime.combine(first_timestamp.date(), since)
+    if isinstance(until, time):
+        until = datetime.combine(first_timestamp.date(), until)
+        if since is not None and until < since:
+            # The window runs over midnight
+            until += timedelta(days=1)
+    return since, until
+
+
+def time_filter_for(head_lines, time_range):
+    """
+    The timestamp format of a file and the window of time_range in it, as
+    (timestamp_format, since, until), from the first lines of the file
+    (bytes); None if the file's timestamps aren't recognised.
+    """
+    timestamp_format, first_timestamp = detect_timestamp_format(head_lines)
+    if timestamp_format is None:
+        return None
+    return (timestamp_format,) + resolve_time_range(time_range, first_timestamp)
+
+
+def next_timestamped_line(mm, pos, end, timestamp_format):
+    """
+    The first line starting at or after pos (a line start) that has a
+    timestamp, as (line_start, timestamp), or (end, None) if there is none
+    before end or within MAX_UNTIMESTAMPED_BYTES.
+    """
+    limit = min(end, pos + MAX_UNTIMESTAMPED_BYTES)
+    while pos < limit:
+        line_end = mm.find(b'\n', pos, end)
+        if line_end == -1:
+            line_end = end
+        timestamp = line_timestamp(mm[pos:min(line_end, pos + TIMESTAMP_SEARCH_BYTES)], timestamp_format)
+        if timestamp is not None:
+            return pos, timestamp
+        pos = line_end + 1
+    return end, None
+
+
+def find_time_boundary(mm, start, end, timestamp_format, bound, after):
+    """
+    Bisect the line-aligned range [start, end) for the first timestamped
+    line at (or, with after, past) bound. Returns its offset, or end.
+    """
+    lo, hi = start, end
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # The line starting at or after mid
+        if mid > start:
+            newline = mm.find(b'\n', mid - 1, end)
+            line_start = end if newline == -1 else newline + 1
+        else:
+            line_start = start
+        _, timestamp = next_timestamped_line(mm, line_start, end, timestamp_format)
+        if timestamp is None or (timestamp > bound if after else timestamp >= bound):
+            hi = mid
+        else:
+            lo = mid + 1
+    if lo > start:
+        newline = mm.find(b'\n', lo - 1, end)
+        lo = end if newline == -1 else newline + 1
+    return next_timestamped_line(mm, lo, end, timestamp_format)[0]
+
+
+def find_time_bounds(mm, time_range):
+    """
+    The part of a mapped log file holding the lines inside time_range. The
+    format and the date of times of day come from the first lines of the file.
+
+    Args:
+        mm (mmap.mmap): The whole file, mapped
+        time_range (tuple): (since, until) from parse_time_range
+
+    Returns:
+        tuple: (start, end) of the lines inside the window, with start == end
+               if there are none; the whole file if the format isn't recognised
+    """
+    head = mm[:min(len(mm), DETECT_LINES * TIMESTAMP_SEARCH_BYTES * 8)].split(b'\n')[:DETECT_LINES]
+    time_filter = time_filter_for(head, time_range)
+    if time_filter is None:
+        return 0, len(mm)
+    timestamp_format, since, until = time_filter
+
+    start, end = 0, len(mm)
+    if since is not None:
+        start = find_time_boundary(mm, start, end, timestamp_format, since, after=False)
+    if until is not None:
+        end = find_time_boundary(mm, start, end, timestamp_format, until, after=True)
+    return start, end
+
+
+def narrow_windows(windows, time_filter, count_lines=False):
+    """
+    Narrow the windows of whole lines of a log that can only be read from
+    the start, as iter_compressed_windows yields them, to the lines inside
+    a time filter's window. Windows before it are passed over without
+    being searched, and no more are read once a line after it turns up.
+
+    Args:
+        windows: (data, lo, hi) tuples
+        time_filter (tuple): From time_filter_for
+        count_lines (bool): Whether to count the lines passed over
+
+    Yields:
+        tuple: (data, lo, hi, lines_skipped), lines_skipped being the
+               newlines passed over before lo
+    """
+    timestamp_format, since, until = time_filter
+    started = since is None
+    for data, lo, hi in windows:
+        start, end = lo, hi
+        if not started:
+            start = find_time_boundary(data, lo, hi, timestamp_format, since, after=False)
+            # Lines without a timestamp after the first line inside the window belong to it
+            started = start < hi
+        if until is not None:
+            end = max(start, find_time_boundary(data, start, hi, timestamp_format, until, after=True))
+        yield data, start, end, data.count(b'\n', lo, start) if count_lines else 0
+        if end < hi:
+            return
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+On-disk trigram index for repeated searches over the same log directory.
+
+Every indexed log is cut into line-aligned blocks (4MB by default). For each
+block the index records which trigrams occur inside its whitespace-separated
+tokens. A literal search only has to read the blocks that contain every
+trigram of the literal; all other blocks are skipped without being read.
+
+Layout of an index directory:
+    catalog.json   Per log file: dev/inode, size, mtime, indexed size,
+                   blocks as [start, end, newlines] and its segment files
+    *.tri          Inverted segments: sorted trigrams, each with the list of
+                   block numbers it occurs in
+    lock           Serialises updates from concurrent scans
+
+When a log grows, the new complete lines are indexed into an extra segment.
+A rotated log (app.log renamed to app.log.1) keeps its index because entries
+are matched by device and inode. Truncated or rewritten logs are re-indexed.
+"""
+import os
+import re
+import json
+import mmap
+import fcntl
+import bisect
+import hashlib
+import argparse
+import multiprocessing
+from array import array
+
+from lineindex import tail_checksum
+
+CATALOG_NAME = 'catalog.json'
+SEGMENT_MAGIC = b'TRIGRAM1'
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Files with more segments than this are re-indexed from scratch
+MAX_SEGMENTS_PER_FILE = 16
+
+TOKEN_RE = re.compile(rb'\S{3,}')
+WHITESPACE_RE = re.compile(rb'\s+')
+
+
+def token_trigrams(data):
+    """
+    Return the set of trigrams (as 24-bit ints) inside the whitespace-separated
+    tokens of data. Only unique tokens are broken into trigrams.
+    """
+    trigrams = set()
+    for token in set(TOKEN_RE.findall(data)):
+        trigrams.update(int.from_bytes(token[i:i + 3], 'big') for i in range(len(token) - 2))
+    return trigrams
+
+
+def query_trigrams(needle):
+    """
+    Return the trigrams a block must contain to possibly hold `needle`.
+    Whitespace-free pieces of the needle sit inside a single token of any
+    matching line, so their trigrams are always indexed.
+    """
+    trigrams = set()
+    for piece in WHITESPACE_RE.split(needle):
+        trigrams.update(int.from_bytes(piece[i:i + 3], 'big') for i in range(len(piece) - 2))
+    return trigrams
+
+
+def write_segment(segment_path, postings):
+    """
+    Write an inverted segment: a header, the sorted trigrams, the offset of
+    each trigram's postings and then all postings, as native uint32 arrays.
+    """
+    trigrams = array('I', sorted(postings))
+    offsets = array('I', [0])
+    blocks = array('I')
+    for trigram in trigrams:
+        blocks.extend(sorted(postings[trigram]))
+        offsets.append(len(blocks))
+
+    with open(segment_path, 'wb') as f:
+        f.write(SEGMENT_MAGIC)
+        f.write(array('I', [len(trigrams)]).tobytes())
+        trigrams.tofile(f)
+        offsets.tofile(f)
+        blocks.tofile(f)
+
+
+def read_segment_postings(segment_path, trigrams):
+    """
+    Look trigrams up in a segment by binary search over its mmap, so only the
+    pages touched by the search are read.
+
+    Returns:
+        dict: trigram -> set of block numbers (empty set if absent)
+    """
+    result = {trigram: set() for trigram in trigrams}
+    with open(segment_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                header = len(SEGMENT_MAGIC)
+                with view[header:header + 4].cast('I') as count_view:
+                    count = count_view[0]
+                trigram_start = header + 4
+                offset_start = trigram_start + count * 4
+                block_start = offset_start + (count + 1) * 4
+
+                with view[trigram_start:offset_start].cast('I') as trigram_view, \
+                        view[offset_start:block_start].cast('I') as offset_view, \
+                        view[block_start:].cast('I') as block_view:
+                    for trigram in trigrams:
+                        position = bisect.bisect_left(trigram_view, trigram)
+                        if position < count and trigram_view[position] == trigram:
+                            result[trigram].update(block_view[offset_view[position]:offset_view[position + 1]])
+    return result
+
+
+def index_file_range(args):
+    """
+    Index the complete lines of [start, file size) of a log into a new segment.
+    Run in a worker process.
+
+    Args:
+        args (tuple): (file_path, start, first_block, block_size, segment_path)
+
+    Returns:
+        tuple: (file_path, segment_path, blocks, indexed_size, error) where blocks is a list
+               of [start, end, newlines] and indexed_size ends after the last
+               newline. The partial last line is left for the next update.
+    """
+    file_path, start, first_block, block_size, segment_path = args
+    blocks = []
+    postings = {}
+
+    try:
+        with open(file_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size <= start:
+                return file_path, segment_path, blocks, start, None
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = mm.rfind(b'\n', start, file_size) + 1
+                block_start = start
+
+                while block_start < end:
+                    block_end = min(block_start + block_size, end)
+                    if block_end < end:
+                        newline = mm.rfind(b'\n', block_start, block_end)
+                        if newline == -1:
+                            # A line longer than the block; stretch to its end
+                            newline = mm.find(b'\n', block_end, end)
+                        block_end = newline + 1
+
+                    data = mm[block_start:block_end]
+                    block_number = first_block + len(blocks)
+                    for trigram in token_trigrams(data):
+                        postings.setdefault(trigram, []).append(block_number)
+                    blocks.append([block_start, block_end, data.count(b'\n')])
+                    block_start = block_end
+
+        if blocks:
+            write_segment(segment_path, postings)
+        return file_path, segment_path, blocks, (blocks[-1][1] if blocks else start), None
+    except Exception as e:
+        return file_path, segment_path, [], start, str(e)
+
+
+def load_catalog(index_dir):
+    """Read the catalog of an index directory."""
+    catalog_path = os.path.join(index_dir, CATALOG_NAME)
+    if not os.path.exists(catalog_path):
+        return {}
+    with open(catalog_path, 'r') as f:
+        return json.load(f)
+
+
+def save_catalog(index_dir, catalog):
+    """Write the catalog atomically."""
+    catalog_path = os.path.join(index_dir, CATALOG_NAME)
+    temp_path = f"{catalog_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(catalog, f)
+    os.replace(temp_path, catalog_path)
+
+
+def remove_segments(index_dir, entry):
+    """Delete the segment files of a catalog entry."""
+    for segment in entry.get("segments", []):
+        try:
+            os.remove(os.path.join(index_dir, segment))
+        except OSError:
+            pass
+
+
+def new_segment_name(file_path, start):
+    """Unique segment file name for indexing file_path from `start`."""
+    digest = hashlib.sha1(f"{os.path.abspath(file_path)}:{start}:{os.getpid()}".encode('utf-8')).hexdigest()
+    return f"{digest[:24]}.tri"
+
+
+def update_index(index_dir, file_paths, block_size=DEFAULT_BLOCK_SIZE, num_processes=None):
+    """
+    Bring the index up to date for the given log files: index new files,
+    extend grown ones, follow rotated ones by inode, re-index truncated or
+    rewritten ones and drop entries of files that no longer exist.
+
+    Args:
+        index_dir (str): Index directory (created if missing)
+        file_paths (list): Log files that should be indexed
+        block_size (int): Target block size in bytes for newly indexed files
+        num_processes (int, optional): Number of indexing processes
+
+    Returns:
+        dict: The updated catalog
+    """
+    os.makedirs(index_dir, exist_ok=True)
+
+    with open(os.path.join(index_dir, 'lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        catalog = load_catalog(index_dir)
+
+        # Forget files that are gone, but remember their inodes for rotation
+        by_inode = {}
+        for path in list(catalog):
+            entry = catalog[path]
+            try:
+                stat = os.stat(path)
+                still_there = (stat.st_dev, stat.st_ino) == (entry["dev"], entry["inode"])
+            except OSError:
+                still_there = False
+            if not still_there:
+                by_inode[(entry["dev"], entry["inode"])] = catalog.pop(path)
+
+        tasks = []
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+
+            entry = catalog.get(file_path)
+            if entry is None:
+                # A rotated file keeps the index it had under its old name
+                entry = by_inode.pop((stat.st_dev, stat.st_ino), None)
+
+            unchanged = False
+            if entry is not None:
+                unchanged = entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+                grown = stat.st_size >= entry["indexed_size"] and len(entry["segments"]) < MAX_SEGMENTS_PER_FILE
+                if grown and not unchanged:
+                    with open(file_path, 'rb') as f:
+                        grown = tail_checksum(f, entry["indexed_size"]) == entry["tail_crc"]
+                if not (unchanged or grown):
+                    remove_segments(index_dir, entry)
+                    entry = None
+
+            if entry is None:
+                entry = {"blocks": [], "segments": [], "indexed_size": 0, "tail_crc": 0,
+                         "block_size": block_size}
+
+            entry.update({"dev": stat.st_dev, "inode": stat.st_ino,
+                          "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+            catalog[file_path] = entry
+
+            if not unchanged and stat.st_size > entry["indexed_size"]:
+                tasks.append((file_path, entry["indexed_size"], len(entry["blocks"]),
+                              entry.get("block_size", block_size),
+                              os.path.join(index_dir, new_segment_name(file_path, entry["indexed_size"]))))
+
+        # Whatever was not matched by a rotation is gone for good
+        for entry in by_inode.values():
+            remove_segments(index_dir, entry)
+
+        if tasks:
+            print(f"Indexing new data in {len(tasks)} files...")
+            if num_processes is None:
+                num_processes = min(multiprocessing.cpu_count(), len(tasks))
+            with multiprocessing.Pool(processes=num_processes) as pool:
+                for file_path, segment_path, blocks, indexed_size, error in pool.imap_unordered(
+                        index_file_range, tasks):
+                    entry = catalog[file_path]
+                    if error:
+                        # Leave the file unindexed so it is scanned whole
+                        print(f"Error indexing {file_path}: {error}")
+                        remove_segments(index_dir, catalog.pop(file_path))
+                        continue
+                    if blocks:
+                        entry["blocks"].extend(blocks)
+                        entry["segments"].append(os.path.basename(segment_path))
+                    entry["indexed_size"] = indexed_size
+                    with open(file_path, 'rb') as f:
+                        entry["tail_crc"] = tail_checksum(f, indexed_size)
+
+        save_catalog(index_dir, catalog)
+        return catalog
+
+
+def find_candidate_ranges(index_dir, file_paths, needles, catalog=None, max_range_size=None):
+    """
+    Narrow each file to the byte ranges that can contain at least one of the
+    needles. A block qualifies for a needle when it holds every trigram of it.
+
+    Args:
+        index_dir (str): Index directory
+        file_paths (list): Files to narrow
+        needles (list): Literals (bytes) a matching line contains one of
+        catalog (dict, optional): Catalog from update_index, to save reloading it
+        max_range_size (int, optional): Don't merge adjacent blocks past this size
+
+    Returns:
+        dict: file_path -> list of (start, end, first_line) ranges in file order,
+              where first_line is the 0-based line number at start. Files the
+              index can't narrow are left out and must be scanned whole.
+    """
+    if catalog is None:
+        catalog = load_catalog(index_dir)
+
+    needle_trigrams = [query_trigrams(needle) for needle in needles]
+    if not needle_trigrams or any(not trigrams for trigrams in needle_trigrams):
+        # A needle without trigrams could be anywhere
+        return {}
+    all_trigrams = set().union(*needle_trigrams)
+
+    candidates = {}
+    for file_path in file_paths:
+        entry = catalog.get(file_path)
+        if entry is None:
+            continue
+        try:
+            if os.path.getsize(file_path) != entry["size"]:
+                continue
+        except OSError:
+            continue
+
+        # Merge the postings of all segments of the file
+        postings = {trigram: set() for trigram in all_trigrams}
+        for segment in entry["segments"]:
+            for trigram, blocks in read_segment_postings(os.path.join(index_dir, segment), all_trigrams).items():
+                postings[trigram] |= blocks
+
+        matching_blocks = set()
+        for trigrams in needle_trigrams:
+            matching_blocks |= set.intersection(*(postings[trigram] for trigram in trigrams))
+
+        ranges = []
+        line_number = 0
+        for block_number, (start, end, newlines) in enumerate(entry["blocks"]):
+            if block_number in matching_blocks:
+                previous = ranges[-1] if ranges else None
+                if (previous and previous[1] == start and
+                        (max_range_size is None or end - previous[0] <= max_range_size)):
+                    ranges[-1] = (previous[0], end, previous[2])
+                else:
+                    ranges.append((start, end, line_number))
+            line_number += newlines
+
+        # The partial last line is not indexed yet and always has to be read
+        if entry["indexed_size"] < entry["size"]:
+            ranges.append((entry["indexed_size"], entry["size"], line_number))
+
+        candidates[file_path] = ranges
+
+    return candidates
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or update a trigram index over log files, or query it."
+    )
+    parser.add_argument(
+        "index_dir",
+        help="Directory holding the index"
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="Log files to index"
+    )
+    parser.add_argument(
+        "-b", "--block-size",
+        type=int,
+        default=DEFAULT_BLOCK_SIZE,
+        help="Target block size in bytes for newly indexed files"
+    )
+    parser.add_argument(
+        "-p", "--processes",
+        type=int,
+        default=None,
+        help="Number of indexing processes"
+    )
+    parser.add_argument(
+        "-q", "--query",
+        default=None,
+        help="Print the candidate byte ranges for this literal after updating"
+    )
+
+    args = parser.parse_args()
+
+    catalog = update_index(args.index_dir, args.files, args.block_size, args.processes)
+    if args.query:
+        candidates = find_candidate_ranges(args.index_dir, args.files, [args.query.encode('utf-8')], catalog)
+        for file_path in args.files:
+            ranges = candidates.get(file_path)
+            if ranges is None:
+                print(f"{file_path}: not narrowed")
+            else:
+                total = sum(end - start for start, end, _ in ranges)
+                print(f"{file_path}: {len(ranges)} ranges, {total} of {catalog[file_path]['size']} bytes")
+    else:
+        indexed = sum(entry["indexed_size"] for entry in catalog.values())
+        print(f"Index at {args.index_dir} covers {len(catalog)} files, {indexed} bytes")
+
+
+if __name__ == "__main__":
+    main()